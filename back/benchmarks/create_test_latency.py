@@ -0,0 +1,70 @@
+"""Measures test persistence latency against question count: per-question commits vs the batched path.
+
+Each run creates a throwaway test (no course, no creator) and deletes it afterwards. LLM time is not
+included — only the database writes that create_test performs. Run from back/:
+
+    python -m benchmarks.create_test_latency --counts 10 50 100 200
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from model.database import async_session_maker
+from model.question import QuestionType
+from repositories import QuestionRepository, TestRepository
+
+def _question_rows(count: int) -> List[dict]:
+    return [
+        dict(
+            text=f"Which topic does 'keyword {i}' belong to?",
+            correct_answer="Topic A",
+            choices=["Topic A", "Topic B", "Topic C", "Topic D"],
+            type=QuestionType.MATCHING,
+        )
+        for i in range(count)
+    ]
+
+async def _per_question(count: int) -> int:
+    """The pre-batching path: one INSERT + COMMIT + REFRESH per question."""
+    async with async_session_maker() as session:
+        test_repo = TestRepository(session)
+        question_repo = QuestionRepository(session)
+        test = await test_repo.create_test(title="bench")
+        for row in _question_rows(count):
+            await question_repo.create_question(test_id=test.id, **row)
+        return test.id
+
+async def _batched(count: int) -> int:
+    async with async_session_maker() as session:
+        test_repo = TestRepository(session)
+        question_repo = QuestionRepository(session)
+        test = await test_repo.create_test(title="bench", commit=False)
+        await question_repo.create_questions(test.id, _question_rows(count), commit=False)
+        await session.commit()
+        return test.id
+
+async def _time(fn, count: int, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        test_id = await fn(count)
+        timings.append(time.perf_counter() - start)
+        async with async_session_maker() as session:
+            await TestRepository(session).delete_test(test_id)
+    return statistics.median(timings) * 1000
+
+async def run(counts: List[int], repeats: int) -> None:
+    print(f"{'questions':>9} {'per-question ms':>16} {'batched ms':>11} {'speedup':>8}")
+    for count in counts:
+        slow = await _time(_per_question, count, repeats)
+        fast = await _time(_batched, count, repeats)
+        print(f"{count:>9} {slow:>16.1f} {fast:>11.1f} {slow / fast:>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.counts, args.repeats))
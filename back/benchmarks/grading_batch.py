@@ -0,0 +1,54 @@
+"""Measures LLM grading latency and tokens per answer: one call per answer vs batched grading.
+
+Grades the same synthetic open answers once per batch size, against the real LLM API (GROQ_API_KEY
+must be set). The response cache is switched off so every run pays for its calls. Run from back/:
+
+    python -m benchmarks.grading_batch --answers 20 --batch-sizes 1 5 10
+"""
+import os
+
+os.environ["LLM_CACHE"] = "off"
+
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+from query_llm import llm
+from services.grading_service import grade_open_answers
+
+SAMPLES = [
+    ("What is Photosynthesis?", "The process by which plants convert light energy into chemical energy stored in glucose.",
+     "Plants using sunlight to make sugar."),
+    ("What is Mitosis?", "Cell division producing two genetically identical daughter cells.",
+     "When a cell splits into two cells that are the same."),
+    ("What is an Enzyme?", "A protein that speeds up chemical reactions by lowering activation energy.",
+     "A type of sugar found in fruit."),
+    ("What is Osmosis?", "Diffusion of water across a semi-permeable membrane from low to high solute concentration.",
+     "Water moving through a membrane toward where there is more dissolved stuff."),
+]
+
+def _items(count: int) -> List[Tuple[str, str, str]]:
+    return [SAMPLES[i % len(SAMPLES)] for i in range(count)]
+
+async def run(answers: int, batch_sizes: List[int]) -> None:
+    items = _items(answers)
+    print(f"{'batch':>5} {'ms/answer':>10} {'prompt tok/answer':>18} {'completion tok/answer':>22} {'fallbacks':>10}")
+    for batch_size in batch_sizes:
+        llm.usage.clear()
+        start = time.perf_counter()
+        await grade_open_answers(items, batch_size=batch_size)
+        elapsed = (time.perf_counter() - start) * 1000
+        prompt_tokens = sum(totals["prompt_tokens"] for totals in llm.usage.values())
+        completion_tokens = sum(totals["completion_tokens"] for totals in llm.usage.values())
+        # With batching on, single-answer calls are fallbacks (or a lone leftover after the last full batch).
+        fallbacks = llm.usage.get("grading", {}).get("calls", 0) if batch_size > 1 else 0
+        print(f"{batch_size:>5} {elapsed / answers:>10.1f} {prompt_tokens / answers:>18.1f} {completion_tokens / answers:>22.1f} {fallbacks:>10}")
+    await llm.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answers", type=int, default=20)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 5, 10])
+    args = parser.parse_args()
+    asyncio.run(run(args.answers, args.batch_sizes))
@@ -0,0 +1,84 @@
+"""Compares subtree fetches: the old level-by-level loop, the recursive CTE and the closure table.
+
+Builds synthetic keyword trees inside a transaction that is rolled back at the end, so it can be
+pointed at a development database without leaving rows behind. Run from back/:
+
+    python -m benchmarks.keyword_subtree --sizes 1000 10000 50000 --branching 4
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from sqlmodel import select
+
+from model.database import async_session_maker
+from model.keyword import Keyword
+from repositories import KeywordRepository
+
+async def _level_by_level(session, root_id: int) -> List[Keyword]:
+    """The pre-CTE implementation: one query per tree level."""
+    all_keywords: List[Keyword] = []
+    current_level_ids = [root_id]
+    while current_level_ids:
+        result = await session.execute(select(Keyword).where(Keyword.parent_id.in_(current_level_ids)))
+        children = result.scalars().all()
+        all_keywords.extend(children)
+        current_level_ids = [keyword.id for keyword in children]
+    return all_keywords
+
+async def _build_tree(repo: KeywordRepository, size: int, branching: int) -> int:
+    """Inserts a tree of `size` keywords with the given fan-out, one bulk insert per level.
+
+    Goes through create_keywords_bulk so the closure table is filled like it is for real uploads.
+    """
+    root_id = (await repo.create_keywords_bulk([{"name": "bench-root", "definition": "benchmark root", "parent_id": None}]))[0]
+    created = 1
+    level = [root_id]
+    while created < size:
+        rows = []
+        for parent_id in level:
+            for _ in range(branching):
+                if created + len(rows) >= size:
+                    break
+                rows.append({"name": f"bench-{created + len(rows)}", "definition": "benchmark node", "parent_id": parent_id})
+        level = await repo.create_keywords_bulk(rows)
+        created += len(rows)
+    return root_id
+
+async def _time(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+async def run(sizes: List[int], branching: int, repeats: int) -> None:
+    print(f"{'keywords':>9} {'depth':>6} {'loop ms':>10} {'cte ms':>10} {'closure ms':>11} {'cte x':>7} {'closure x':>10}")
+    for size in sizes:
+        async with async_session_maker() as session:
+            repo = KeywordRepository(session)
+            root_id = await _build_tree(repo, size, branching)
+            rows = await repo.get_subtree_with_paths(root_id)
+            depth = max(d for _, d, _ in rows) if rows else 0
+            # All three must return the same subtree, or the timings compare different work.
+            assert len(rows) == len(await _level_by_level(session, root_id)) == len(await repo.get_subtree(root_id)) == size - 1
+
+            loop_ms = await _time(lambda: _level_by_level(session, root_id), repeats)
+            cte_ms = await _time(lambda: repo.get_subtree_with_paths(root_id), repeats)
+            closure_ms = await _time(lambda: repo.get_subtree(root_id), repeats)
+            print(
+                f"{size:>9} {depth:>6} {loop_ms:>10.1f} {cte_ms:>10.1f} {closure_ms:>11.1f}"
+                f" {loop_ms / cte_ms:>6.1f}x {loop_ms / closure_ms:>9.1f}x"
+            )
+            await session.rollback()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000, 50000])
+    parser.add_argument("--branching", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.branching, args.repeats))
@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import List, Optional
 from pydantic import BaseModel
 from model.question import QuestionType
@@ -44,6 +45,8 @@ class QuestionResultDTO(BaseModel):
     correct_answer: str
     is_correct: Optional[bool]
     feedback: Optional[str]
+    graded_by: Optional[str] = None         # a GradedBy value: how the verdict was reached
+    lexical_score: Optional[float] = None   # pre-grader similarity to the reference definition
 
 class AttemptDetailDTO(BaseModel):
     attempt_id: int
@@ -60,10 +63,19 @@ class AttemptListItemDTO(BaseModel):
     status: AttemptStatus
     score: Optional[float]
 
+class AttemptSortField(str, Enum):
+    ID = "id"
+    SCORE = "score"
+    STATUS = "status"
+
 class TestAttemptsDTO(BaseModel):
     enrolled_count: int
     attempts: List[AttemptListItemDTO]
+    next_cursor: Optional[str] = None   # pass back as `cursor` for the next page; None on the last page
 
 class GradeOverrideDTO(BaseModel):
     is_correct: bool
     feedback: Optional[str] = None
+    # Also apply the correction to every other graded answer to this question with the same
+    # normalized text, and to identical answers graded later.
+    propagate: bool = False
@@ -6,3 +6,8 @@ class CourseSummaryDTO(BaseModel):
     name: str
     keyword_hierarchy_id: Optional[int] = None
     student_count: int = 0
+
+class GradingThresholdsDTO(BaseModel):
+    """Lexical pre-grading thresholds (0..1); null resets one to the server default."""
+    pass_threshold: Optional[float] = None
+    fail_threshold: Optional[float] = None
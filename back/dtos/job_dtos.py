@@ -0,0 +1,18 @@
+from enum import Enum
+from typing import Optional
+from pydantic import BaseModel
+
+class JobStatus(str, Enum):
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+class JobProgressDTO(BaseModel):
+    job_id: str
+    kind: str                        # e.g. "delete_course"
+    status: JobStatus
+    completed_steps: int = 0
+    total_steps: Optional[int] = None
+    current_step: Optional[str] = None
+    error: Optional[str] = None
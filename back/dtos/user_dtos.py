@@ -1,5 +1,6 @@
 from typing import List
 from pydantic import BaseModel
+from model.user import UserRole
 
 class UserRegistration(BaseModel):
     email: str
@@ -34,3 +35,9 @@ class StudentRegisterResultDTO(StudentSummaryDTO):
     created: bool
     newly_enrolled: List[str] = []
     already_enrolled: List[str] = []
+
+class Principal(BaseModel):
+    """The authenticated caller, resolved once per request from the token (see principal.py)."""
+    id: int
+    email: str
+    role: UserRole
@@ -0,0 +1,105 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from dtos.keyword_dtos import KeywordNodeDTO
+
+load_dotenv()
+
+# Bound on the total number of cached keyword nodes across all hierarchies.
+HIERARCHY_CACHE_MAX_NODES = int(os.getenv("HIERARCHY_CACHE_MAX_NODES", "200000"))
+# Writes invalidate this process' cache immediately; other workers see them once the entry expires.
+HIERARCHY_CACHE_TTL = float(os.getenv("HIERARCHY_CACHE_TTL", "60"))
+
+class HierarchyCache:
+    """In-process LRU of whole keyword trees (root first, then by depth), keyed by hierarchy id.
+
+    Each hierarchy has a version counter that every invalidation bumps. A reader captures the version
+    before loading from the database and `put` drops the result if the version moved meanwhile, so a
+    load that raced with a write can never repopulate the cache with the pre-write tree.
+    """
+
+    def __init__(self, max_nodes: int, ttl: float):
+        self.max_nodes = max_nodes
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, List[KeywordNodeDTO]]]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._generation = 0
+        self._node_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def version(self, hierarchy_id: int) -> Tuple[int, int]:
+        return self._generation, self._versions.get(hierarchy_id, 0)
+
+    def get(self, hierarchy_id: int) -> Optional[List[KeywordNodeDTO]]:
+        entry = self._entries.get(hierarchy_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            if entry is not None:
+                self._drop(hierarchy_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(hierarchy_id)
+        self.hits += 1
+        return list(entry[1])
+
+    def put(self, hierarchy_id: int, version: Tuple[int, int], nodes: List[KeywordNodeDTO]) -> None:
+        if version != self.version(hierarchy_id) or len(nodes) > self.max_nodes:
+            return
+        self._drop(hierarchy_id)
+        self._entries[hierarchy_id] = (time.monotonic(), list(nodes))
+        self._node_count += len(nodes)
+        while self._node_count > self.max_nodes:
+            oldest_id = next(iter(self._entries))
+            self._drop(oldest_id)
+            self.evictions += 1
+
+    def invalidate(self, hierarchy_id: Optional[int]) -> None:
+        if hierarchy_id is None:
+            return
+        self._versions[hierarchy_id] = self._versions.get(hierarchy_id, 0) + 1
+        self._drop(hierarchy_id)
+        self.invalidations += 1
+
+    def clear(self) -> None:
+        """Invalidates every hierarchy, including ones with a load in flight."""
+        self._generation += 1
+        self._entries.clear()
+        self._node_count = 0
+        self.invalidations += 1
+
+    def _drop(self, hierarchy_id: int) -> None:
+        entry = self._entries.pop(hierarchy_id, None)
+        if entry is not None:
+            self._node_count -= len(entry[1])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hierarchies": len(self._entries),
+            "nodes": self._node_count,
+            "max_nodes": self.max_nodes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+        }
+
+hierarchy_cache = HierarchyCache(HIERARCHY_CACHE_MAX_NODES, HIERARCHY_CACHE_TTL)
+
+def subtree_nodes(nodes: List[KeywordNodeDTO], root_id: int) -> List[KeywordNodeDTO]:
+    """Descendants of root_id (excluding it) from a cached tree, shallowest levels first."""
+    children_by_parent: Dict[int, List[KeywordNodeDTO]] = {}
+    for node in nodes:
+        if node.parent_id is not None:
+            children_by_parent.setdefault(node.parent_id, []).append(node)
+    result: List[KeywordNodeDTO] = []
+    level = children_by_parent.get(root_id, [])
+    while level:
+        result.extend(level)
+        level = [child for node in level for child in children_by_parent.get(node.id, [])]
+    return result
@@ -0,0 +1,32 @@
+from typing import Optional
+from dtos.job_dtos import JobProgressDTO, JobStatus
+from model.database import async_session_maker
+from model.job import Job, JobState
+from repositories import JobRepository
+
+# A job waiting for a retry is back in QUEUED; it reads as PENDING, with the error that caused the retry.
+_STATUS = {
+    JobState.QUEUED: JobStatus.PENDING,
+    JobState.RUNNING: JobStatus.RUNNING,
+    JobState.DONE: JobStatus.DONE,
+    JobState.FAILED: JobStatus.FAILED,
+}
+
+def to_progress_dto(job: Job) -> JobProgressDTO:
+    return JobProgressDTO(
+        job_id=str(job.id),
+        kind=job.kind,
+        status=_STATUS[job.state],
+        completed_steps=job.completed_steps,
+        total_steps=job.total_steps,
+        current_step=job.current_step,
+        error=job.last_error,
+    )
+
+async def load_job_progress(job_id: str) -> Optional[JobProgressDTO]:
+    """Progress of a job from the durable job table, so any API process can answer for any worker's job."""
+    if not job_id.isdigit():
+        return None
+    async with async_session_maker() as session:
+        job = await JobRepository(session).get_job(int(job_id))
+    return to_progress_dto(job) if job else None
@@ -0,0 +1,50 @@
+import os
+import random
+from typing import Optional
+from dotenv import load_dotenv
+from model.job import Job, JobKind
+from repositories import JobRepository
+
+load_dotenv()
+
+# Jobs a worker process runs at once.
+WORKER_CONCURRENCY = max(1, int(os.getenv("WORKER_CONCURRENCY", "4")))
+# Claims per job before it's marked FAILED.
+JOB_MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "5")))
+# Seconds a claim holds a job without a heartbeat. A running worker extends its claim every third
+# of this, so a job is only handed to another worker once its worker has died or hung.
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+# Retry delay doubles per attempt from the base, up to the cap, with up to 25% jitter.
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "600"))
+# How often an idle worker looks for new jobs, and how often it runs the recovery sweep.
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "60"))
+
+def grading_dedupe_key(attempt_id: int) -> str:
+    return f"{JobKind.GRADE_ATTEMPT.value}:{attempt_id}"
+
+async def enqueue_grading(job_repo: JobRepository, attempt_id: int, commit: bool = True) -> None:
+    await job_repo.enqueue(
+        JobKind.GRADE_ATTEMPT, {"attempt_id": attempt_id},
+        dedupe_key=grading_dedupe_key(attempt_id), max_attempts=JOB_MAX_ATTEMPTS, commit=commit,
+    )
+
+def retry_delay(attempt: int) -> float:
+    """Backoff before retrying a job that failed on its `attempt`-th claim (1-based)."""
+    delay = min(JOB_RETRY_MAX_DELAY, JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay * (1 + random.uniform(0, 0.25))
+
+def course_deletion_dedupe_key(course_id: int) -> str:
+    return f"{JobKind.DELETE_COURSE.value}:{course_id}"
+
+async def enqueue_course_deletion(job_repo: JobRepository, course_id: int) -> Optional[Job]:
+    """Queues the course's deletion, or returns the deletion already queued or running for it."""
+    dedupe_key = course_deletion_dedupe_key(course_id)
+    job_id = await job_repo.enqueue(
+        JobKind.DELETE_COURSE, {"course_id": course_id},
+        dedupe_key=dedupe_key, max_attempts=JOB_MAX_ATTEMPTS,
+    )
+    if job_id is None:
+        return await job_repo.get_live_job(dedupe_key)
+    return await job_repo.get_job(job_id)
@@ -0,0 +1,160 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from dotenv import load_dotenv
+from model.database import async_session_maker
+from repositories import LLMCacheRepository
+
+load_dotenv()
+
+# Where cached LLM responses live: "postgres" (shared by all workers), "sqlite" (a local file) or "off".
+LLM_CACHE = os.getenv("LLM_CACHE", "postgres")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "data/llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+# Eviction runs after every this many writes per worker rather than on each one.
+LLM_CACHE_EVICT_EVERY = 100
+
+def cache_key(model: str, prompt: str, messages: list) -> str:
+    """Content address of a request: the same model, prompt and rendered messages give the same key."""
+    payload = json.dumps([model, prompt, messages], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class LLMCacheBackend(ABC):
+    @abstractmethod
+    async def get(self, key: str, max_age: float) -> Optional[str]: ...
+
+    @abstractmethod
+    async def put(self, key: str, model: str, prompt: str, response: str) -> None: ...
+
+    @abstractmethod
+    async def evict(self, max_age: float, max_entries: int) -> None: ...
+
+class PostgresLLMCache(LLMCacheBackend):
+    async def get(self, key: str, max_age: float) -> Optional[str]:
+        async with async_session_maker() as session:
+            return await LLMCacheRepository(session).get_response(key, _utc_ago(max_age))
+
+    async def put(self, key: str, model: str, prompt: str, response: str) -> None:
+        async with async_session_maker() as session:
+            await LLMCacheRepository(session).put_response(key, model, prompt, response, datetime.now(timezone.utc))
+
+    async def evict(self, max_age: float, max_entries: int) -> None:
+        async with async_session_maker() as session:
+            await LLMCacheRepository(session).evict(_utc_ago(max_age), max_entries)
+
+class SqliteLLMCache(LLMCacheBackend):
+    """Single-file cache for one host; sqlite3 is blocking, so every call runs in a worker thread."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, prompt TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)")
+
+    def _run(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def get(self, key: str, max_age: float) -> Optional[str]:
+        rows = await asyncio.to_thread(
+            self._run, "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?", (key, time.time() - max_age)
+        )
+        return rows[0][0] if rows else None
+
+    async def put(self, key: str, model: str, prompt: str, response: str) -> None:
+        await asyncio.to_thread(
+            self._run,
+            "INSERT OR REPLACE INTO llm_cache (key, model, prompt, response, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, model, prompt, response, time.time()),
+        )
+
+    async def evict(self, max_age: float, max_entries: int) -> None:
+        await asyncio.to_thread(self._run, "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - max_age,))
+        await asyncio.to_thread(
+            self._run,
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (max_entries,),
+        )
+
+def _utc_ago(seconds: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+class LLMCache:
+    """Content-addressed LLM response cache with TTL and size bounds, and per-prompt hit counters.
+
+    A cache failure never fails the LLM call: lookups that error count as misses and writes that
+    error are dropped.
+    """
+
+    def __init__(self, backend: Optional[LLMCacheBackend], ttl: float, max_entries: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.errors = 0
+
+    async def get(self, key: str, prompt: str) -> Optional[str]:
+        if self.backend is None:
+            return None
+        try:
+            response = await self.backend.get(key, self.ttl)
+        except Exception:
+            self.errors += 1
+            response = None
+        counter = self.hits if response is not None else self.misses
+        counter[prompt] = counter.get(prompt, 0) + 1
+        return response
+
+    async def put(self, key: str, model: str, prompt: str, response: str) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.put(key, model, prompt, response)
+            self._writes += 1
+            if self._writes % LLM_CACHE_EVICT_EVERY == 0:
+                await self.backend.evict(self.ttl, self.max_entries)
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        prompts = sorted(set(self.hits) | set(self.misses))
+        per_prompt = {}
+        for prompt in prompts:
+            hits, misses = self.hits.get(prompt, 0), self.misses.get(prompt, 0)
+            per_prompt[prompt] = {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3)}
+        total_hits, total_misses = sum(self.hits.values()), sum(self.misses.values())
+        lookups = total_hits + total_misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": total_hits,
+            "misses": total_misses,
+            "hit_rate": round(total_hits / lookups, 3) if lookups else None,
+            "errors": self.errors,
+            "prompts": per_prompt,
+        }
+
+def _create_backend(kind: str) -> Optional[LLMCacheBackend]:
+    if kind == "off":
+        return None
+    if kind == "postgres":
+        return PostgresLLMCache()
+    if kind == "sqlite":
+        return SqliteLLMCache(LLM_CACHE_PATH)
+    raise ValueError(f"Unknown LLM_CACHE {kind!r}; expected postgres, sqlite or off")
+
+llm_cache = LLMCache(_create_backend(LLM_CACHE), LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
@@ -2,34 +2,42 @@ import os
 import shutil
 from dtos.keyword_dtos import KeywordUpdateDTO, KeywordNodeDTO
 from services.keyword_service import get_hierarchy, get_hierarchy_keywords, update_keyword
-from services.course_service import create_course, get_courses_for_user, get_all_materials_for_course, get_course, get_material, remove_from_course, signup_to_course, delete_course_from_db
+from services.course_service import create_course, get_courses_for_user, get_all_materials_for_course, get_course, get_material, remove_from_course, signup_to_course, delete_course_from_db, get_grading_thresholds, set_grading_thresholds, start_course_deletion
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List
+from typing import List, Optional
 from dtos.user_dtos import Token, UserLogin, UserRegistration
 from services.user_service import create_user, login
 from dtos.test_dtos import TestCreateDTO, TestResponseDTO
 from services.test_service import create_test, get_course_tests_for_professor, get_test_detail_for_professor, delete_test_by_id
-from dtos.attempt_dtos import AttemptDetailDTO, AttemptResultDTO, GradeOverrideDTO, SubmitTestDTO, TestAttemptsDTO
+from dtos.attempt_dtos import AttemptDetailDTO, AttemptResultDTO, AttemptSortField, GradeOverrideDTO, SubmitTestDTO, TestAttemptsDTO
 from services.take_test_service import get_course_tests_for_student, get_test_for_student, submit_test
-from dtos.user_dtos import StudentCreateDTO, StudentRegisterResultDTO, StudentSummaryDTO
+from dtos.user_dtos import Principal, StudentCreateDTO, StudentRegisterResultDTO, StudentSummaryDTO
 from services.student_service import create_student, list_students
-from services.grading_service import get_attempt_result, get_test_attempts, get_test_stats, grade_attempt, override_grade
+from services.grading_service import get_attempt_result, get_test_attempts, get_test_stats, override_grade
 from dtos.stats_dtos import TestStatsDTO
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, BackgroundTasks
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, UploadFile, Query, Response
 from pydantic import BaseModel
-from model.database import engine
-from sqlmodel import SQLModel
+from model.database import async_session_maker, engine, get_pool_stats
 from model.question import Question
-from model.keyword import KeywordHierarchy
+from model.keyword import KeywordClosure, KeywordHierarchy
 from model.course import Course, CourseMaterial
-from dtos.course_dtos import CourseSummaryDTO
+from dtos.course_dtos import CourseSummaryDTO, GradingThresholdsDTO
 from model.user import UserCourseLink, User
 from model.test import UserTestLink, Test
 from model.attempt import TestAttempt, Answer
+from model.stats import QuestionStatsRollup, TestScoreBin, TestStatsRollup
 from parse_materials import parse_document, parse_materials 
-from repositories import KeywordRepository
+from repositories import JobRepository, KeywordRepository, StatsRollupRepository
 from jwt_token import verify_jwt_token, create_jwt_token
+from migrations.runner import run_migrations
 from seed import seed_if_empty
+from hierarchy_cache import hierarchy_cache
+from job_progress import load_job_progress
+from token_store import token_store
+from query_llm import llm
+from llm_cache import llm_cache
+from principal import principal_cache, resolve_principal, token_claims
+from dtos.job_dtos import JobProgressDTO
 
 app = FastAPI()
 app.add_middleware(
@@ -38,24 +46,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor"],
 )
 
-active_tokens: Dict[str, str] = {}
-
 UPLOAD_DIR = "data/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-async def get_current_user(token: str) -> dict:
+async def get_current_user(token: str) -> Principal:
     payload = verify_jwt_token(token)
-    if not payload or payload.get("sub") not in active_tokens or active_tokens[payload["sub"]] != token:
+    if not payload or not await token_store.is_active(payload.get("sub"), token):
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    principal = await resolve_principal(payload)
+    if not principal:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
-    return payload
+    return principal
 
 @app.on_event("startup")
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    await run_migrations(engine)
     await seed_if_empty()
+    # Seeded and pre-existing trees only have parent_id; derive the ancestor index from it once.
+    async with async_session_maker() as session:
+        keyword_repo = KeywordRepository(session)
+        if await keyword_repo.index_is_empty():
+            await keyword_repo.rebuild_keyword_index()
+        # Databases from before the stats rollups have attempts but no rollup rows; build them once.
+        stats_repo = StatsRollupRepository(session)
+        if await stats_repo.needs_backfill():
+            await stats_repo.rebuild()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await llm.aclose()
+
+async def require_professor(token: str) -> Principal:
+    current_user = await get_current_user(token)
+    if current_user.role != "PROFESSOR":
+        raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
+    return current_user
+
+# Pool, cache and queue internals; every route here needs a professor token.
+metrics_router = APIRouter(prefix="/metrics", dependencies=[Depends(require_professor)])
+
+@metrics_router.get("/db-pool")
+async def db_pool_metrics():
+    return get_pool_stats()
+
+@metrics_router.get("/token-store")
+async def token_store_metrics():
+    return token_store.stats()
+
+@metrics_router.get("/principal-cache")
+async def principal_cache_metrics():
+    return principal_cache.stats()
+
+@metrics_router.get("/llm-cache")
+async def llm_cache_metrics():
+    return llm_cache.stats()
+
+@metrics_router.get("/jobs")
+async def job_queue_metrics():
+    async with async_session_maker() as session:
+        return await JobRepository(session).count_by_state()
+
+@metrics_router.get("/hierarchy-cache")
+async def hierarchy_cache_metrics():
+    return hierarchy_cache.stats()
+
+app.include_router(metrics_router)
+
+@app.get("/jobs/{job_id}", response_model=JobProgressDTO)
+async def get_job_progress(job_id: str, token: str):
+    current_user = await get_current_user(token)
+    if current_user.role != "PROFESSOR":
+        raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
+    job = await load_job_progress(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/")
 async def read_root():
@@ -73,6 +141,12 @@ async def create_item(item: Item):
     item_dict["total_price"] = item.price + (item.tax or 0)
     return item_dict
 
+async def _issue_token(user: User) -> str:
+    """Signs a token for the user and records it as their active one; it expires with the JWT."""
+    access_token = create_jwt_token(token_claims(user))
+    await token_store.set(user.email, access_token, expires_at=verify_jwt_token(access_token)["exp"])
+    return access_token
+
 @app.post("/register", response_model=Token)
 async def register_user(user: UserRegistration):
     new_user = await create_user(user)
@@ -80,9 +154,7 @@ async def register_user(user: UserRegistration):
     if not new_user:
         raise HTTPException(status_code=400, detail="Invalid email or email in use")
 
-    token_data = {"sub": new_user.email, "role": new_user.role}
-    access_token = create_jwt_token(token_data)
-    active_tokens[new_user.email] = access_token
+    access_token = await _issue_token(new_user)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -91,9 +163,7 @@ async def login_user(user: UserLogin):
     db_user = await login(user)
     if not db_user:
         raise HTTPException(status_code=400, detail="Invalid email")
-    token_data = {"sub": db_user.email, "role": db_user.role}
-    access_token = create_jwt_token(token_data)
-    active_tokens[db_user.email] = access_token
+    access_token = await _issue_token(db_user)
 
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -104,13 +174,13 @@ async def logout_user(token: str):
         raise HTTPException(status_code=401, detail="Invalid token")
 
     email = payload["sub"]
-    active_tokens.pop(email, None) 
+    await token_store.delete(email)
     return {"detail": "Logged out successfully"}
 
 @app.post("/courses/{course_id}/upload-material")
 async def upload_material(course_id: int, file: UploadFile, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
     
     file_path = os.path.join(UPLOAD_DIR, file.filename)
@@ -127,20 +197,28 @@ async def upload_material(course_id: int, file: UploadFile, token: str):
 @app.post("/courses", response_model=Course)
 async def create_course_endpoint(name: str, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    course = await create_course(name, current_user.get("sub"))
+    course = await create_course(name, current_user)
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
 
     return course
 
 @app.delete("/courses/{course_id}")
-async def delete_course(course_id: int, token: str):
+async def delete_course(course_id: int, token: str, response: Response, background: bool = False):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    
+
+    if background:
+        # Returns right away; worker.py runs the deletion, poll GET /jobs/{job_id} for progress.
+        job = await start_course_deletion(course_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Course not found")
+        response.status_code = 202
+        return job
+
     deleted = await delete_course_from_db(course_id) 
     if not deleted:
         raise HTTPException(status_code=404, detail="Course not found")
@@ -162,7 +240,7 @@ async def get_all_courses_endpoint(token: str):
     current_user = await get_current_user(token)
     if not current_user:
         raise HTTPException(status_code=401, detail="Invalid token")
-    return await get_courses_for_user(current_user.get("sub"))
+    return await get_courses_for_user(current_user)
 
 @app.get("/courses/{course_id}/materials", response_model=List[CourseMaterial])
 async def get_all_materials_for_course_endpoint(course_id: int, token: str):
@@ -171,19 +249,33 @@ async def get_all_materials_for_course_endpoint(course_id: int, token: str):
         raise HTTPException(status_code=401, detail="Invalid token")
     return await get_all_materials_for_course(course_id)
 
+@app.get("/courses/{course_id}/grading-thresholds", response_model=GradingThresholdsDTO)
+async def get_grading_thresholds_endpoint(course_id: int, token: str):
+    current_user = await get_current_user(token)
+    if current_user.role != "PROFESSOR":
+        raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
+    return await get_grading_thresholds(course_id, current_user)
+
+@app.put("/courses/{course_id}/grading-thresholds", response_model=GradingThresholdsDTO)
+async def set_grading_thresholds_endpoint(course_id: int, data: GradingThresholdsDTO, token: str):
+    current_user = await get_current_user(token)
+    if current_user.role != "PROFESSOR":
+        raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
+    return await set_grading_thresholds(course_id, current_user, data)
+
 @app.post("/courses/{course_id}/signup")
 async def get_all_materials_for_course_endpoint(course_id: int, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "STUDENT":
+    if current_user.role != "STUDENT":
         raise HTTPException(status_code=403, detail="Access forbidden: Student only")
-    await signup_to_course(current_user.get("sub"), course_id)
+    await signup_to_course(current_user, course_id)
 
 @app.post("/courses/{course_id}/remove")
 async def get_all_materials_for_course_endpoint(course_id: int, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "STUDENT":
+    if current_user.role != "STUDENT":
         raise HTTPException(status_code=403, detail="Access forbidden: Student only")
-    await remove_from_course(current_user.get("sub"), course_id)
+    await remove_from_course(current_user, course_id)
 
 @app.get("/materials/{material_id}", response_model=CourseMaterial)
 async def get_material_endpoint(material_id: int, token: str):
@@ -202,7 +294,7 @@ async def get_hierarchy_endpoint(hierarchy_id: int, token: str):
 @app.put("/keywords/{keyword_id}", response_model=KeywordNodeDTO)
 async def get_keyword_endpoint(keyword_id: int, update_data: KeywordUpdateDTO, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
     return await update_keyword(keyword_id, update_data)
 
@@ -216,33 +308,38 @@ async def get_hierarchy_keywords_endpoint(hierarchy_id: int, token: str):
 @app.post("/courses/{course_id}/tests", response_model=TestResponseDTO)
 async def create_test_endpoint(course_id: int, test_data: TestCreateDTO, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await create_test(course_id, current_user.get("sub"), test_data)
+    return await create_test(course_id, current_user, test_data)
 
 @app.post("/students", response_model=StudentRegisterResultDTO)
 async def create_student_endpoint(data: StudentCreateDTO, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await create_student(current_user.get("sub"), data)
+    return await create_student(current_user, data)
 
 @app.get("/students", response_model=List[StudentSummaryDTO])
-async def list_students_endpoint(token: str):
+async def list_students_endpoint(token: str, response: Response, q: Optional[str] = None,
+                                 limit: Optional[int] = Query(default=None, ge=1, le=500), cursor: Optional[str] = None):
+    # The body stays a bare list; the next page's cursor (if any) is sent in the X-Next-Cursor header.
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await list_students(current_user.get("sub"))
+    students, next_cursor = await list_students(current_user, prefix=q, limit=limit, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return students
 
 @app.get("/courses/{course_id}/tests")
 async def get_course_tests_endpoint(course_id: int, token: str):
     # Shape is role-dependent (professors see a management list, students a taken-flagged list), so no
     # fixed response_model — FastAPI still serializes whichever DTO list is returned.
     current_user = await get_current_user(token)
-    if current_user.get("role") == "PROFESSOR":
+    if current_user.role == "PROFESSOR":
         return await get_course_tests_for_professor(course_id)
-    if current_user.get("role") == "STUDENT":
-        return await get_course_tests_for_student(course_id, current_user.get("sub"))
+    if current_user.role == "STUDENT":
+        return await get_course_tests_for_student(course_id, current_user)
     raise HTTPException(status_code=403, detail="Access forbidden")
 
 @app.get("/tests/{test_id}")
@@ -250,52 +347,54 @@ async def get_test_endpoint(test_id: int, token: str):
     # Role-dependent shape: professors get the full detail (with correct answers + tested keywords),
     # students get the answer-free StudentTestDTO. No fixed response_model for that reason.
     current_user = await get_current_user(token)
-    if current_user.get("role") == "PROFESSOR":
+    if current_user.role == "PROFESSOR":
         return await get_test_detail_for_professor(test_id)
-    if current_user.get("role") == "STUDENT":
-        return await get_test_for_student(test_id, current_user.get("sub"))
+    if current_user.role == "STUDENT":
+        return await get_test_for_student(test_id, current_user)
     raise HTTPException(status_code=403, detail="Access forbidden")
 
 @app.delete("/tests/{test_id}")
 async def delete_test_endpoint(test_id: int, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
     if not await delete_test_by_id(test_id):
         raise HTTPException(status_code=404, detail="Test not found")
     return {"deleted": True}
 
 @app.post("/tests/{test_id}/submit", response_model=AttemptResultDTO)
-async def submit_test_endpoint(test_id: int, submission: SubmitTestDTO, token: str, background_tasks: BackgroundTasks):
+async def submit_test_endpoint(test_id: int, submission: SubmitTestDTO, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "STUDENT":
+    if current_user.role != "STUDENT":
         raise HTTPException(status_code=403, detail="Access forbidden: Students only")
-    result = await submit_test(test_id, current_user.get("sub"), submission)
-    background_tasks.add_task(grade_attempt, result.attempt_id)
-    return result
+    # Grading is queued in the same transaction and picked up by worker.py.
+    return await submit_test(test_id, current_user, submission)
 
 @app.get("/tests/{test_id}/attempts", response_model=TestAttemptsDTO)
-async def get_test_attempts_endpoint(test_id: int, token: str):
+async def get_test_attempts_endpoint(test_id: int, token: str, sort: AttemptSortField = AttemptSortField.ID, descending: bool = False,
+                                     limit: Optional[int] = Query(default=None, ge=1, le=500), cursor: Optional[str] = None):
+    # Without `limit` every attempt is returned in one page, as before.
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await get_test_attempts(test_id, current_user.get("sub"))
+    return await get_test_attempts(test_id, current_user, sort=sort, descending=descending, limit=limit, cursor=cursor)
 
 @app.get("/tests/{test_id}/stats", response_model=TestStatsDTO)
-async def get_test_stats_endpoint(test_id: int, token: str):
+async def get_test_stats_endpoint(test_id: int, token: str, bands: Optional[List[float]] = Query(default=None)):
+    # `bands` are the lower edges of the score distribution bands, e.g. ?bands=0&bands=50&bands=70.
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await get_test_stats(test_id, current_user.get("sub"))
+    return await get_test_stats(test_id, current_user, bands=bands)
 
 @app.get("/attempts/{attempt_id}/result", response_model=AttemptDetailDTO)
 async def get_attempt_result_endpoint(attempt_id: int, token: str):
     current_user = await get_current_user(token)
-    return await get_attempt_result(attempt_id, current_user.get("sub"))
+    return await get_attempt_result(attempt_id, current_user)
 
 @app.patch("/attempts/{attempt_id}/answers/{answer_id}/grade", response_model=AttemptDetailDTO)
 async def override_grade_endpoint(attempt_id: int, answer_id: int, data: GradeOverrideDTO, token: str):
     current_user = await get_current_user(token)
-    if current_user.get("role") != "PROFESSOR":
+    if current_user.role != "PROFESSOR":
         raise HTTPException(status_code=403, detail="Access forbidden: Professors only")
-    return await override_grade(answer_id, current_user.get("sub"), data)
+    return await override_grade(answer_id, current_user, data)
@@ -0,0 +1,116 @@
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+from parse_keywords import _normalize
+
+# Rough chars-per-token of English prose for Llama tokenizers; good enough to size chunks.
+CHARS_PER_TOKEN = 4
+
+_HEADING = re.compile(r"^#{1,6}\s", re.MULTILINE)
+# Coarsest first: a section too big for a chunk is split on paragraphs, then lines, then sentences, then words.
+_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _sections(text: str) -> List[str]:
+    """Splits markdown at headings; text without headings is one section."""
+    starts = [match.start() for match in _HEADING.finditer(text)]
+    bounds = [0] + [start for start in starts if start > 0] + [len(text)]
+    return [text[start:end].strip() for start, end in zip(bounds, bounds[1:]) if text[start:end].strip()]
+
+def _pack(pieces: List[str], max_tokens: int, joiner: str) -> List[str]:
+    """Greedily joins consecutive pieces into runs of at most `max_tokens`."""
+    packed, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            packed.append(joiner.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        packed.append(joiner.join(current))
+    return packed
+
+def _split_oversized(text: str, max_tokens: int, separators: List[str] = _SEPARATORS) -> List[str]:
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    if not separators:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[start:start + size] for start in range(0, len(text), size)]
+    separator, finer = separators[0], separators[1:]
+    pieces = []
+    for part in text.split(separator):
+        if part.strip():
+            pieces.extend(_split_oversized(part, max_tokens, finer))
+    return _pack(pieces, max_tokens, separator)
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """Splits a parsed document into chunks of about `max_tokens`, cutting at section boundaries.
+
+    Whole sections are packed together while they fit. A section bigger than a chunk is cut at the
+    coarsest boundary that works (paragraph, line, sentence, word), and every piece after the first
+    repeats the section's heading so the model knows what it belongs to.
+    """
+    units = []
+    for section in _sections(text):
+        if estimate_tokens(section) <= max_tokens:
+            units.append(section)
+            continue
+        heading = section.split("\n", 1)[0] if _HEADING.match(section) else None
+        budget = max(1, max_tokens - (estimate_tokens(heading) + 1 if heading else 0))
+        pieces = _split_oversized(section, budget)
+        units.append(pieces[0])
+        units.extend(f"{heading}\n{piece}" if heading else piece for piece in pieces[1:])
+    return _pack(units, max_tokens, "\n\n")
+
+def _merge_into(target: List[dict], items: list, seen: Dict[str, dict]) -> None:
+    for item in items:
+        if not isinstance(item, dict) or not item.get("name"):
+            continue
+        key = _normalize(item["name"])
+        node = seen.get(key)
+        if node is None:
+            node = {"name": item["name"], "definition": item.get("definition"), "children": []}
+            seen[key] = node
+            target.append(node)
+        elif not node["definition"] and item.get("definition"):
+            node["definition"] = item["definition"]
+        _merge_into(node["children"], item.get("children") or [], seen)
+
+def merge_forests(forests: List[list]) -> List[dict]:
+    """Merges per-chunk keyword forests into one.
+
+    A keyword already seen (by normalized name) is not repeated: it keeps its first position, and
+    the children found for it in later chunks are merged under that first copy.
+    """
+    merged: List[dict] = []
+    seen: Dict[str, dict] = {}
+    for forest in forests:
+        _merge_into(merged, forest, seen)
+    return merged
+
+def merge_attachments(results: List[dict]) -> dict:
+    """Merges per-chunk {attach_to, insert_intermediate, keywords} results for parse_keywords.
+
+    Chunks that picked the same attach point (and the same new intermediate node, if any) share one
+    attachment; keywords are deduplicated across all attachments as in merge_forests.
+    """
+    attachments: Dict[Tuple[Optional[int], Optional[str]], dict] = {}
+    seen: Dict[str, dict] = {}
+    for result in results:
+        intermediate = result.get("insert_intermediate")
+        if not isinstance(intermediate, dict) or not intermediate.get("name"):
+            intermediate = None
+        key = (result.get("attach_to"), _normalize(intermediate["name"]) if intermediate else None)
+        attachment = attachments.get(key)
+        if attachment is None:
+            attachment = {"attach_to": key[0], "insert_intermediate": dict(intermediate) if intermediate else None, "keywords": []}
+            attachments[key] = attachment
+        elif intermediate:
+            reparented = attachment["insert_intermediate"].get("reparent_existing_children") or []
+            extra = [child for child in intermediate.get("reparent_existing_children") or [] if child not in reparented]
+            attachment["insert_intermediate"]["reparent_existing_children"] = reparented + extra
+        _merge_into(attachment["keywords"], result.get("keywords") or [], seen)
+    return {"attachments": list(attachments.values())}
@@ -0,0 +1,71 @@
+"""Checks with EXPLAIN that each hot repository lookup can use an index.
+
+Small development tables make the planner prefer sequential scans whatever indexes exist, so the
+check disables them for its transaction: a query that still plans as a Seq Scan has no usable index.
+Exits non-zero if any query falls back to one. Run from back/ after migrating:
+
+    python -m migrations.check_indexes
+"""
+import asyncio
+import sys
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlmodel import select
+
+from model.attempt import Answer, TestAttempt
+from model.course import CourseMaterial
+from model.database import async_session_maker
+from model.keyword import Keyword, KeywordClosure
+from model.question import Question
+from model.stats import QuestionStatsRollup
+from model.test import KeywordTestLink, Test
+from model.user import User, UserCourseLink
+
+# (description, representative statement) for the lookups the repositories run per request.
+HOT_QUERIES = [
+    ("questions of a test", select(Question).where(Question.test_id == 1)),
+    ("answers of an attempt", select(Answer).where(Answer.attempt_id == 1)),
+    ("answers to a question", select(Answer).where(Answer.question_id == 1)),
+    ("attempts of a test", select(TestAttempt).where(TestAttempt.test_id == 1)),
+    ("attempt of a student for a test", select(TestAttempt).where(TestAttempt.student_id == 1, TestAttempt.test_id == 1)),
+    ("attempts of a student", select(TestAttempt).where(TestAttempt.student_id == 1)),
+    ("children of a keyword", select(Keyword).where(Keyword.parent_id == 1)),
+    ("keywords of a hierarchy", select(Keyword).where(Keyword.hierarchy_id == 1)),
+    ("ancestors of a keyword", select(KeywordClosure).where(KeywordClosure.descendant_id == 1)),
+    ("materials of a course", select(CourseMaterial).where(CourseMaterial.course_id == 1)),
+    ("students of a course", select(UserCourseLink).where(UserCourseLink.course_id == 1)),
+    ("tests of a course", select(Test).where(Test.course_id == 1)),
+    ("keywords of a test", select(KeywordTestLink).where(KeywordTestLink.test_id == 1)),
+    ("user by email", select(User).where(User.email == "prof@test.com")),
+    ("question rollups of a test", select(QuestionStatsRollup).where(QuestionStatsRollup.test_id == 1)),
+]
+
+def _scans(plan: dict) -> List[Tuple[str, str]]:
+    """(node type, index name or relation) for every scan node in an EXPLAIN (FORMAT JSON) plan."""
+    scans = []
+    if plan["Node Type"].endswith("Scan"):
+        scans.append((plan["Node Type"], plan.get("Index Name") or plan.get("Relation Name", "")))
+    for child in plan.get("Plans", []):
+        scans.extend(_scans(child))
+    return scans
+
+async def run() -> int:
+    failures = 0
+    async with async_session_maker() as session:
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        for description, statement in HOT_QUERIES:
+            sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = (await session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()[0]["Plan"]
+            scans = _scans(plan)
+            seq_scans = [target for node, target in scans if node == "Seq Scan"]
+            if seq_scans:
+                failures += 1
+            used = ", ".join(f"{node} on {target}" for node, target in scans)
+            print(f"{'FAIL' if seq_scans else 'ok  '} {description:<34} {used}")
+    print(f"{failures} hot quer{'y' if failures == 1 else 'ies'} without a usable index" if failures else "every hot query uses an index")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(run()) else 0)
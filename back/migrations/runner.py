@@ -0,0 +1,61 @@
+"""Versioned schema migrations.
+
+Each module in migrations/versions/ is named NNNN_description.py and defines
+`async def upgrade(conn: AsyncConnection) -> None`. Pending migrations are applied in version order
+and recorded in the schema_migrations table. The app runs them on startup; to run them by hand
+from back/:
+
+    python -m migrations.runner
+
+0001 is the baseline: it creates every table from the current models, so on a fresh database later
+migrations find their changes already in place. Every migration after it must therefore be
+idempotent (IF NOT EXISTS, checkfirst=True, ...).
+"""
+import asyncio
+import importlib
+from pathlib import Path
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+VERSIONS_DIR = Path(__file__).parent / "versions"
+
+# Arbitrary app-wide key; several workers starting at once queue on it instead of racing the DDL.
+MIGRATION_LOCK_KEY = 0x7e571
+
+def discover_migrations() -> List[Tuple[int, str, object]]:
+    migrations = []
+    for path in sorted(VERSIONS_DIR.glob("[0-9][0-9][0-9][0-9]_*.py")):
+        version, name = path.stem.split("_", 1)
+        module = importlib.import_module(f"migrations.versions.{path.stem}")
+        migrations.append((int(version), name, module))
+    return migrations
+
+async def run_migrations(engine: AsyncEngine) -> List[int]:
+    """Applies every pending migration in one transaction and returns the versions applied."""
+    applied_now = []
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        applied = set((await conn.execute(text("SELECT version FROM schema_migrations"))).scalars().all())
+        for version, name, module in discover_migrations():
+            if version in applied:
+                continue
+            print(f"Applying migration {version:04d}_{name}")
+            await module.upgrade(conn)
+            await conn.execute(
+                text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                {"version": version, "name": name},
+            )
+            applied_now.append(version)
+    return applied_now
+
+if __name__ == "__main__":
+    from model.database import engine
+
+    applied = asyncio.run(run_migrations(engine))
+    print(f"Applied {len(applied)} migration(s)" if applied else "Schema is up to date")
@@ -0,0 +1,9 @@
+"""Creates every table in the current models (what on_startup used to do with create_all)."""
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import SQLModel
+
+# Registers every table on SQLModel.metadata, also when run outside the app.
+from model import attempt, course, job, keyword, llm_cache, question, session_token, stats, test, user, verdict  # noqa: F401
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.run_sync(SQLModel.metadata.create_all)
@@ -0,0 +1,7 @@
+"""Adds keyword.hierarchy_id to databases created before it existed."""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.execute(text("ALTER TABLE keyword ADD COLUMN IF NOT EXISTS hierarchy_id INTEGER REFERENCES keywordhierarchy(id)"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_keyword_hierarchy_id ON keyword (hierarchy_id)"))
@@ -0,0 +1,51 @@
+"""Indexes the foreign keys the repositories filter and join on, and adds the attempt/email uniqueness rules.
+
+Index names match what the models' index=True generates, so fresh databases (which get them from the
+baseline) and upgraded ones end up identical. testattempt.student_id has no index of its own: the
+(student_id, test_id) unique constraint's index leads with it.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+FK_INDEXES = [
+    ("question", "test_id"),
+    ("answer", "attempt_id"),
+    ("answer", "question_id"),
+    ("testattempt", "test_id"),
+    ("keyword", "parent_id"),
+    ("coursematerial", "course_id"),
+    ("usercourselink", "course_id"),
+    ("test", "course_id"),
+    ("keywordtestlink", "test_id"),
+]
+
+async def upgrade(conn: AsyncConnection) -> None:
+    for table, column in FK_INDEXES:
+        await conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON "{table}" ({column})'))
+
+    # submit_test refused a second attempt, but two concurrent submits could both get through. Keep the
+    # first attempt per (student, test) and drop the rest before the constraint makes that impossible.
+    duplicates = text(
+        "SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY student_id, test_id ORDER BY id) AS rn "
+        "FROM testattempt WHERE student_id IS NOT NULL AND test_id IS NOT NULL) ranked WHERE rn > 1"
+    )
+    duplicate_ids = list((await conn.execute(duplicates)).scalars().all())
+    if duplicate_ids:
+        await conn.execute(text("DELETE FROM answer WHERE attempt_id = ANY(:ids)"), {"ids": duplicate_ids})
+        await conn.execute(text("DELETE FROM testattempt WHERE id = ANY(:ids)"), {"ids": duplicate_ids})
+        # The rollups counted the dropped attempts; emptying them makes startup rebuild them from scratch.
+        for table in ("questionstatsrollup", "testscorebin", "teststatsrollup"):
+            await conn.execute(text(f"DELETE FROM {table}"))
+    await conn.execute(text(
+        "DO $$ BEGIN "
+        "IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_testattempt_student_test') THEN "
+        "ALTER TABLE testattempt ADD CONSTRAINT uq_testattempt_student_test UNIQUE (student_id, test_id); "
+        "END IF; END $$"
+    ))
+
+    # Duplicate accounts can't be merged automatically, so refuse to continue rather than guess.
+    emails = (await conn.execute(text('SELECT email FROM "user" GROUP BY email HAVING count(*) > 1'))).scalars().all()
+    if emails:
+        raise RuntimeError(f"Cannot make user.email unique; duplicated emails: {', '.join(emails)}")
+    await conn.execute(text("DROP INDEX IF EXISTS ix_user_email"))
+    await conn.execute(text('CREATE UNIQUE INDEX ix_user_email ON "user" (email)'))
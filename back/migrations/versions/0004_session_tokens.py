@@ -0,0 +1,7 @@
+"""Adds the sessiontoken table used by the Postgres token store (TOKEN_STORE=postgres)."""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from model.session_token import SessionToken
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.run_sync(lambda sync_conn: SessionToken.__table__.create(sync_conn, checkfirst=True))
@@ -0,0 +1,7 @@
+"""Adds the llmcacheentry table used by the Postgres LLM response cache (LLM_CACHE=postgres)."""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from model.llm_cache import LLMCacheEntry
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.run_sync(lambda sync_conn: LLMCacheEntry.__table__.create(sync_conn, checkfirst=True))
@@ -0,0 +1,7 @@
+"""Adds the job table behind the durable grading queue (worker.py)."""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from model.job import Job
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.run_sync(lambda sync_conn: Job.__table__.create(sync_conn, checkfirst=True))
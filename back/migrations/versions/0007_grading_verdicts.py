@@ -0,0 +1,7 @@
+"""Adds the gradingverdict table: per-question verdicts reused across identical open answers."""
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from model.verdict import GradingVerdict
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.run_sync(lambda sync_conn: GradingVerdict.__table__.create(sync_conn, checkfirst=True))
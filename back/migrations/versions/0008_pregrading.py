@@ -0,0 +1,9 @@
+"""Adds per-course pre-grading thresholds and records how each answer was graded."""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.execute(text("ALTER TABLE course ADD COLUMN IF NOT EXISTS pregrade_pass_threshold DOUBLE PRECISION"))
+    await conn.execute(text("ALTER TABLE course ADD COLUMN IF NOT EXISTS pregrade_fail_threshold DOUBLE PRECISION"))
+    await conn.execute(text("ALTER TABLE answer ADD COLUMN IF NOT EXISTS graded_by VARCHAR"))
+    await conn.execute(text("ALTER TABLE answer ADD COLUMN IF NOT EXISTS lexical_score DOUBLE PRECISION"))
@@ -0,0 +1,8 @@
+"""Stores job progress on the job row, so background course deletions run on the durable queue."""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+async def upgrade(conn: AsyncConnection) -> None:
+    await conn.execute(text("ALTER TABLE job ADD COLUMN IF NOT EXISTS completed_steps INTEGER NOT NULL DEFAULT 0"))
+    await conn.execute(text("ALTER TABLE job ADD COLUMN IF NOT EXISTS total_steps INTEGER"))
+    await conn.execute(text("ALTER TABLE job ADD COLUMN IF NOT EXISTS current_step VARCHAR"))
@@ -1,14 +1,26 @@
 from enum import Enum
 from typing import List, Optional
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import UniqueConstraint
 
 class AttemptStatus(str, Enum):
     GRADING = "GRADING"
     GRADED = "GRADED"
 
+class GradedBy(str, Enum):
+    """How an answer's verdict was reached."""
+    EXACT_MATCH = "EXACT_MATCH"   # MATCHING question, compared with the correct answer
+    LEXICAL = "LEXICAL"           # decided locally by the lexical pre-grader
+    MEMO = "MEMO"                 # reused from an identical answer to the same question
+    LLM = "LLM"
+    OVERRIDE = "OVERRIDE"         # set by the professor
+
 class TestAttempt(SQLModel, table=True):
+    # One attempt per student per test; the constraint's index also serves lookups by student_id.
+    __table_args__ = (UniqueConstraint("student_id", "test_id", name="uq_testattempt_student_test"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    test_id: Optional[int] = Field(default=None, foreign_key="test.id")
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", index=True)
     student_id: Optional[int] = Field(default=None, foreign_key="user.id")
     status: AttemptStatus = Field(default=AttemptStatus.GRADING)
     score: Optional[float] = Field(default=None)
@@ -17,10 +29,12 @@ class TestAttempt(SQLModel, table=True):
 
 class Answer(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    attempt_id: Optional[int] = Field(default=None, foreign_key="testattempt.id")
-    question_id: Optional[int] = Field(default=None, foreign_key="question.id")
+    attempt_id: Optional[int] = Field(default=None, foreign_key="testattempt.id", index=True)
+    question_id: Optional[int] = Field(default=None, foreign_key="question.id", index=True)
     answer: str
     is_correct: Optional[bool] = Field(default=None)
     feedback: Optional[str] = Field(default=None)
+    graded_by: Optional[str] = Field(default=None)          # a GradedBy value
+    lexical_score: Optional[float] = Field(default=None)    # pre-grader similarity to the reference, 0..1
 
     attempt: Optional[TestAttempt] = Relationship(back_populates="answers")
@@ -11,6 +11,10 @@ class Course(SQLModel, table=True):
 
     keyword_hierarchy_id: Optional[int] = Field(default=None, foreign_key="keywordhierarchy.id")
     keyword_hierarchy: Optional["KeywordHierarchy"] = Relationship()
+
+    # Lexical pre-grading thresholds for this course's OPEN answers; None uses the pregrader.py defaults.
+    pregrade_pass_threshold: Optional[float] = Field(default=None)
+    pregrade_fail_threshold: Optional[float] = Field(default=None)
     
     materials: List["CourseMaterial"] = Relationship(back_populates="course")
 
@@ -18,7 +22,7 @@ class CourseMaterial(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     
-    course_id: Optional[int] = Field(default=None, foreign_key="course.id")
+    course_id: Optional[int] = Field(default=None, foreign_key="course.id", index=True)
     course: Optional[Course] = Relationship(back_populates="materials")
     
     keywords: List["Keyword"] = Relationship(back_populates="materials", link_model=CourseMaterialKeywordLink)
\ No newline at end of file
@@ -0,0 +1,45 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, Index, Text, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+class JobKind(str, Enum):
+    GRADE_ATTEMPT = "grade_attempt"
+    DELETE_COURSE = "delete_course"
+
+class JobState(str, Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+class Job(SQLModel, table=True):
+    """A unit of background work, claimed by worker.py with FOR UPDATE SKIP LOCKED.
+
+    A RUNNING job whose `locked_until` has passed belongs to a worker that died or stalled and can be
+    claimed again. `attempts` counts claims and doubles as a fencing token, so a stale worker can't
+    complete or fail a job that has since been handed to someone else.
+    """
+    __table_args__ = (
+        Index("ix_job_claim", "state", "run_after"),
+        # At most one live job per dedupe key (e.g. one grading job per attempt).
+        Index("uq_job_live_dedupe_key", "dedupe_key", unique=True, postgresql_where=text("state IN ('QUEUED', 'RUNNING')")),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # a JobKind value; kept a plain string so new kinds need no enum migration
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSONB, nullable=False))
+    dedupe_key: Optional[str] = Field(default=None)
+    state: JobState = Field(default=JobState.QUEUED)
+    attempts: int = Field(default=0)
+    max_attempts: int = Field(default=5)
+    run_after: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now()))
+    locked_until: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text))
+    # Progress of long jobs (course deletion), polled through GET /jobs/{id} from any API process.
+    completed_steps: int = Field(default=0)
+    total_steps: Optional[int] = Field(default=None)
+    current_step: Optional[str] = Field(default=None)
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, server_default=func.now()))
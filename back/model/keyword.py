@@ -1,26 +1,41 @@
 from typing import List, Optional
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, ForeignKey, Integer
 from model.course import CourseMaterialKeywordLink
 from model.test import KeywordTestLink
 
 class KeywordHierarchy(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     root_id: Optional[int] = Field(default=None, foreign_key="keyword.id")
-    root: Optional["Keyword"] = Relationship()
+    root: Optional["Keyword"] = Relationship(sa_relationship_kwargs=dict(foreign_keys="KeywordHierarchy.root_id"))
 
-    keywords: List["Keyword"] = Relationship(back_populates="hierarchy")
+    keywords: List["Keyword"] = Relationship(back_populates="hierarchy", sa_relationship_kwargs=dict(foreign_keys="Keyword.hierarchy_id"))
     course: Optional["Course"] = Relationship(back_populates="keyword_hierarchy")
 
+class KeywordClosure(SQLModel, table=True):
+    """Ancestor index for the keyword tree: one row per (ancestor, descendant) pair, plus a depth-0 self row.
+
+    The primary key serves subtree lookups (by ancestor); the descendant index serves ancestor lookups.
+    Maintained by KeywordRepository alongside every parent_id write.
+    """
+    ancestor_id: int = Field(foreign_key="keyword.id", primary_key=True)
+    descendant_id: int = Field(foreign_key="keyword.id", primary_key=True, index=True)
+    depth: int
+
 class Keyword(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     definition: str
 
-    parent_id: Optional[int] = Field(default=None, foreign_key="keyword.id")
+    parent_id: Optional[int] = Field(default=None, foreign_key="keyword.id", index=True)
     parent: Optional["Keyword"] = Relationship(back_populates="children", sa_relationship_kwargs=dict(remote_side="Keyword.id"))
     children: List["Keyword"] = Relationship(back_populates="parent")
 
-    hierarchy: Optional[KeywordHierarchy] = Relationship(back_populates="keywords")
+    # keyword -> keywordhierarchy -> keyword(root) is a cycle, so this FK is added after both tables exist.
+    hierarchy_id: Optional[int] = Field(default=None, sa_column=Column(
+        Integer, ForeignKey("keywordhierarchy.id", use_alter=True, name="keyword_hierarchy_id_fkey"), index=True
+    ))
+    hierarchy: Optional[KeywordHierarchy] = Relationship(back_populates="keywords", sa_relationship_kwargs=dict(foreign_keys="Keyword.hierarchy_id"))
     materials: List["CourseMaterial"] = Relationship(back_populates="keywords", link_model=CourseMaterialKeywordLink)
 
     tests: List["Test"] = Relationship(link_model=KeywordTestLink)
@@ -0,0 +1,11 @@
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, Text
+
+class LLMCacheEntry(SQLModel, table=True):
+    """A cached LLM response for the Postgres backend of llm_cache.py, content-addressed by `key`."""
+    key: str = Field(primary_key=True)       # sha256 of model, prompt name and rendered messages
+    model: str
+    prompt: str = Field(index=True)
+    response: str = Field(sa_column=Column(Text, nullable=False))
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, index=True))
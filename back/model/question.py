@@ -14,7 +14,7 @@ class Question(SQLModel, table=True):
     text: str
     type: QuestionType
     correct_answer: str
-    test_id: Optional[int] = Field(default=None, foreign_key="test.id")
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", index=True)
     choices: List[str] = Field(sa_column=Column(ARRAY(String())), default_factory=list)
 
     test: Optional["Test"] = Relationship(back_populates="questions")
\ No newline at end of file
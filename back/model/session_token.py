@@ -0,0 +1,9 @@
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime
+
+class SessionToken(SQLModel, table=True):
+    """The active login token of a user (by email) for the Postgres token store; one row per user."""
+    subject: str = Field(primary_key=True)
+    token: str
+    expires_at: datetime = Field(sa_column=Column(DateTime(timezone=True), nullable=False, index=True))
@@ -0,0 +1,23 @@
+from typing import Optional
+from sqlmodel import SQLModel, Field
+
+# Rollups are maintained incrementally by StatsRollupRepository in the same transaction as the
+# attempt/answer writes they summarize, and can be rebuilt from the base tables with rebuild_stats.py.
+
+class TestStatsRollup(SQLModel, table=True):
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", primary_key=True)
+    attempt_count: int = Field(default=0)
+    graded_count: int = Field(default=0)
+    score_sum: float = Field(default=0.0)    # over graded attempts
+
+class TestScoreBin(SQLModel, table=True):
+    """Number of graded attempts of a test with exactly this score (scores are rounded to 0.1)."""
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", primary_key=True)
+    score: float = Field(primary_key=True)
+    count: int = Field(default=0)
+
+class QuestionStatsRollup(SQLModel, table=True):
+    question_id: Optional[int] = Field(default=None, foreign_key="question.id", primary_key=True)
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", index=True)
+    answered_count: int = Field(default=0)   # graded answers (is_correct not None)
+    correct_count: int = Field(default=0)
@@ -9,13 +9,13 @@ class UserTestLink(SQLModel, table=True):
 
 class KeywordTestLink(SQLModel, table=True):
     keyword_id: Optional[int] = Field(default=None, foreign_key="keyword.id", primary_key=True)
-    test_id: Optional[int] = Field(default=None, foreign_key="test.id", primary_key=True)
+    test_id: Optional[int] = Field(default=None, foreign_key="test.id", primary_key=True, index=True)
 
 class Test(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     creator_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    course_id: Optional[int] = Field(default=None, foreign_key="course.id")
+    course_id: Optional[int] = Field(default=None, foreign_key="course.id", index=True)
 
     takers: List["User"] = Relationship(link_model=UserTestLink)
     questions: List[Question] = Relationship(back_populates="test")
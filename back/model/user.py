@@ -8,12 +8,13 @@ class UserRole(str, Enum):
 
 class UserCourseLink(SQLModel, table=True):
     user_id: Optional[int] = Field(default=None, foreign_key="user.id", primary_key=True)
-    course_id: Optional[int] = Field(default=None, foreign_key="course.id", primary_key=True)
+    # The primary key (user_id, course_id) covers per-user lookups; course_id needs its own index for rosters.
+    course_id: Optional[int] = Field(default=None, foreign_key="course.id", primary_key=True, index=True)
 
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    email: str = Field(index=True)
+    email: str = Field(index=True, unique=True)
     password: str
     name: str
     lastname: str
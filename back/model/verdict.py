@@ -0,0 +1,15 @@
+from typing import Optional
+from sqlmodel import SQLModel, Field
+
+class GradingVerdict(SQLModel, table=True):
+    """A grading decision for one normalized answer to one question, reused for every identical answer.
+
+    `answer_key` also covers the question's text and reference answer, so editing the question
+    stops old verdicts from matching. An overridden verdict came from the professor; LLM verdicts
+    never replace it.
+    """
+    question_id: int = Field(foreign_key="question.id", primary_key=True)
+    answer_key: str = Field(primary_key=True)
+    is_correct: bool
+    feedback: Optional[str] = Field(default=None)
+    overridden: bool = Field(default=False)
@@ -0,0 +1,31 @@
+import base64
+import json
+from typing import Any, Callable, List, Optional
+
+from fastapi import HTTPException
+
+def encode_cursor(values: List) -> str:
+    """Opaque keyset cursor: the sort-key values of the last row on a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def decode_cursor(cursor: str, shape: Optional[List[Callable[[Any], bool]]] = None) -> List:
+    """Decodes a cursor; with `shape`, it must have one value per check and every check must pass.
+
+    Cursors come from the client, so a value of the wrong type is a 400 here rather than a type
+    error from Postgres when it's compared against a column.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if shape is not None and (len(values) != len(shape) or not all(check(value) for check, value in zip(shape, values))):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
@@ -1,23 +1,11 @@
 from model.course import Course
 from repositories import CourseRepository, KeywordRepository
-from model.keyword import Keyword, KeywordHierarchy
+from model.database import async_session_maker
+from model.keyword import KeywordHierarchy
+from hierarchy_cache import hierarchy_cache
 import json
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
 from typing import List, Optional, Union
-import os
-from dotenv import load_dotenv
-
-
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-# Async session factory
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+from dtos.keyword_dtos import KeywordNodeDTO
 
 def _normalize(name: str) -> str:
     normalized = name.strip().casefold()
@@ -34,26 +22,29 @@ def _parse_legacy_array(json_string: str) -> list:
         raise ValueError("JSON array not found in the response.")
     return json.loads(json_string[json_start:json_end + 1])
 
-async def parse_keywords(response: Union[str, dict], course: Course, existing_hierarchy: Optional[KeywordHierarchy] = None) -> List[Keyword]:
+async def parse_keywords(response: Union[str, list, dict], course: Course, existing_hierarchy: Optional[KeywordHierarchy] = None, material_title: Optional[str] = None) -> List[KeywordNodeDTO]:
     """Parses extracted keywords and grafts them onto the course's keyword hierarchy.
 
-    If the course has no hierarchy yet, `response` is the bare extraction array (legacy shape) and a
-    new root/hierarchy is created. If a hierarchy already exists, `response` is the richer
-    {"attach_to", "insert_intermediate", "keywords"} shape: new keywords attach under the LLM's chosen
-    existing node (optionally behind one new intermediate node) instead of always landing under root,
-    and any extracted keyword that duplicates one already in the tree (by normalized name) is reused
-    instead of creating a second copy.
+    If the course has no hierarchy yet, `response` is the bare extraction array (legacy shape, raw or
+    already parsed) and a new root/hierarchy is created. If a hierarchy already exists, `response` is
+    the richer {"attach_to", "insert_intermediate", "keywords"} shape, or {"attachments": [...]} of
+    several of them (merged chunk results, see material_chunks.py): new keywords attach under the
+    LLM's chosen existing node (optionally behind one new intermediate node) instead of always
+    landing under root, and any extracted keyword that duplicates one already in the tree (by
+    normalized name) is reused instead of creating a second copy.
+
+    The whole graft is one transaction: each level of the extracted forest is a single multi-row
+    INSERT, and when `material_title` is given the material row and all its keyword links are written
+    in the same commit, so a failure never leaves a half-written tree behind.
     """
-    if isinstance(response, str):
-        data = _parse_legacy_array(response)
-        attach_to_id = None
-        insert_intermediate = None
+    if isinstance(response, (str, list)):
+        legacy_forest = _parse_legacy_array(response) if isinstance(response, str) else response
+        attachments = []
     else:
-        data = response.get("keywords", []) or []
-        attach_to_id = response.get("attach_to")
-        insert_intermediate = response.get("insert_intermediate")
+        legacy_forest = []
+        attachments = response["attachments"] if "attachments" in response else [response]
 
-    keywords = []
+    keywords: List[KeywordNodeDTO] = []
 
     async with async_session_maker() as session:
         keyword_repo = KeywordRepository(session)
@@ -63,73 +54,81 @@ async def parse_keywords(response: Union[str, dict], course: Course, existing_hi
             course_root_keyword = await keyword_repo.create_keyword(
                 name=course.name,
                 definition=f"Root for course: {course.name}",
-                parent_id=None
+                parent_id=None,
+                commit=False,
             )
-            hierarchy = await keyword_repo.create_hierarchy(root_id=course_root_keyword.id)
-            keywords.append(course_root_keyword)
-            root_id = course_root_keyword.id
+            hierarchy = await keyword_repo.create_hierarchy(root_id=course_root_keyword.id, commit=False)
+            keywords.append(KeywordNodeDTO(id=course_root_keyword.id, name=course_root_keyword.name, definition=course_root_keyword.definition))
             existing_by_name = {}
+            level = [(item, course_root_keyword.id) for item in legacy_forest]
         else:
+            hierarchy = existing_hierarchy
             root_id = existing_hierarchy.root_id
-            root = await keyword_repo.get_keyword_by_id(root_id)
-            descendants = await keyword_repo.get_all_descendant_keywords(root_id)
-            all_existing = [root] + descendants
+            all_existing = await keyword_repo.get_hierarchy_nodes(existing_hierarchy.id) or []
             existing_ids = {node.id for node in all_existing}
             existing_by_name = {_normalize(node.name): node for node in all_existing}
 
-            # Only trust an attach point that's actually part of this course's hierarchy.
-            parent_id = attach_to_id if attach_to_id in existing_ids else root_id
-
-            if insert_intermediate and attach_to_id in existing_ids:
-                new_node = await keyword_repo.create_keyword(
-                    name=insert_intermediate["name"],
-                    definition=insert_intermediate["definition"],
-                    parent_id=attach_to_id,
-                )
-                current_children_ids = {node.id for node in all_existing if node.parent_id == attach_to_id}
-                requested_ids = set(insert_intermediate.get("reparent_existing_children", []) or [])
-                for child_id in current_children_ids & requested_ids:
-                    await keyword_repo.reparent_keyword(child_id, new_node.id)
-                parent_id = new_node.id
-
-            root_id = parent_id
-
-        async def process_keyword(item, parent_id=None):
-            """Recursively processes a keyword, reusing an existing node of the same name if one exists.
-
-            Skips an item missing 'name'/'definition' — the extraction LLM occasionally emits a
-            malformed item, and one bad item shouldn't fail the whole upload.
-            """
-            name = item.get("name")
-            if not name:
-                return
-            actual_parent_id = parent_id or root_id
-            name_key = _normalize(name)
-            existing = existing_by_name.get(name_key)
-
-            if existing:
-                keyword = existing
-                keywords.append(keyword)
-            else:
-                definition = item.get("definition")
-                if not definition:
-                    return
-                keyword = await keyword_repo.create_keyword(
-                    name=name,
-                    definition=definition,
-                    parent_id=actual_parent_id
-                )
-                keywords.append(keyword)
-
-            for child in item.get("children", []) or []:
-                await process_keyword(child, parent_id=keyword.id)
-
-        for item in data:
-            await process_keyword(item)
+            level = []
+            for attachment in attachments:
+                attach_to_id = attachment.get("attach_to")
+                insert_intermediate = attachment.get("insert_intermediate")
+                # Only trust an attach point that's actually part of this course's hierarchy.
+                parent_id = attach_to_id if attach_to_id in existing_ids else root_id
+
+                if insert_intermediate and attach_to_id in existing_ids:
+                    new_node = await keyword_repo.create_keyword(
+                        name=insert_intermediate["name"],
+                        definition=insert_intermediate["definition"],
+                        parent_id=attach_to_id,
+                        hierarchy_id=hierarchy.id,
+                        commit=False,
+                    )
+                    current_children_ids = {node.id for node in all_existing if node.parent_id == attach_to_id}
+                    requested_ids = set(insert_intermediate.get("reparent_existing_children", []) or [])
+                    for child_id in current_children_ids & requested_ids:
+                        await keyword_repo.reparent_keyword(child_id, new_node.id, commit=False)
+                    parent_id = new_node.id
+
+                level.extend((item, parent_id) for item in attachment.get("keywords", []) or [])
+
+        # Walk the extracted forest breadth-first so every level is written with one INSERT ... RETURNING.
+        # An existing node of the same name is reused instead of inserted. Items missing 'name'/'definition'
+        # are skipped (with their children) — the extraction LLM occasionally emits a malformed item, and
+        # one bad item shouldn't fail the whole upload.
+        while level:
+            next_level = []
+            new_items = []
+            for item, parent_id in level:
+                name = item.get("name")
+                if not name:
+                    continue
+                existing = existing_by_name.get(_normalize(name))
+                if existing:
+                    keywords.append(existing)
+                    next_level.extend((child, existing.id) for child in item.get("children", []) or [])
+                elif item.get("definition"):
+                    new_items.append((item, parent_id))
+
+            rows = [
+                {"name": item["name"], "definition": item["definition"], "parent_id": parent_id, "hierarchy_id": hierarchy.id}
+                for item, parent_id in new_items
+            ]
+            new_ids = await keyword_repo.create_keywords_bulk(rows)
+            for (item, parent_id), keyword_id in zip(new_items, new_ids):
+                keywords.append(KeywordNodeDTO(id=keyword_id, name=item["name"], definition=item["definition"], parent_id=parent_id))
+                next_level.extend((child, keyword_id) for child in item.get("children", []) or [])
+            level = next_level
+
+        if material_title is not None:
+            material = await course_repo.create_course_material(material_title, course.id, commit=False)
+            await course_repo.link_keywords_to_material(material.id, [keyword.id for keyword in keywords])
 
         if not existing_hierarchy:
-            updated_course = await course_repo.update_course(course.id, None, hierarchy.id)
+            updated_course = await course_repo.update_course(course.id, None, hierarchy.id, commit=False)
             if not updated_course:
                 raise ValueError("Course not found or could not be updated.")
 
+        await session.commit()
+
+    hierarchy_cache.invalidate(hierarchy.id)
     return keywords
@@ -1,33 +1,40 @@
+import asyncio
+import math
 import os
-from typing import List
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from dtos.keyword_dtos import KeywordNodeDTO
 from model.course import Course
 from model.keyword import Keyword, KeywordHierarchy
 from repositories import CourseRepository, KeywordRepository
-from parse_keywords import parse_keywords
+from model.database import async_session_maker
+from material_chunks import estimate_tokens, merge_attachments, merge_forests, split_into_chunks
+from parse_keywords import _parse_legacy_array, parse_keywords
 from dotenv import load_dotenv
 from llama_parse import LlamaParse
 from llama_index.core import SimpleDirectoryReader, Document, VectorStoreIndex
 from fastapi import Depends, HTTPException, UploadFile, File
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from text_terms import tokenize
 from query_llm import query_llm, extract_keywords_with_attachment
 
 load_dotenv()
 
 API_KEY = os.getenv("LLAMA_CLOUD_API_KEY")
+# Documents are extracted in chunks of about this many tokens, so long materials neither overflow
+# the context window nor get their JSON reply truncated.
+EXTRACTION_CHUNK_TOKENS = max(200, int(os.getenv("EXTRACTION_CHUNK_TOKENS", "3000")))
+# Chunk extractions in flight at once, across all uploads this worker is processing.
+EXTRACTION_CONCURRENCY = max(1, int(os.getenv("EXTRACTION_CONCURRENCY", "4")))
+_extraction_slots = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+# Token budget for the existing hierarchy in an extraction_with_attachment prompt. Larger trees are
+# cut down to the nodes most relevant to the chunk being extracted (plus their ancestors).
+HIERARCHY_CONTEXT_TOKENS = max(100, int(os.getenv("HIERARCHY_CONTEXT_TOKENS", "1500")))
 
 extensions = {
     "text": ".txt",
     "markdown": ".md"
 }
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
-
 async def parse_materials(course_id: int, doc_path: str) -> None:
     async with async_session_maker() as session:
         course_repo = CourseRepository(session)
@@ -37,32 +44,104 @@ async def parse_materials(course_id: int, doc_path: str) -> None:
             raise HTTPException(status_code=404, detail="Course not found")
         
         hierarchy = await course_repo.get_hierarchy_for_course(course_id)
-        
-        new_material = await course_repo.create_course_material(doc_path, course.id)
 
-        keywords = await parse_document(doc_path, course, hierarchy)
-        await course_repo.add_keywords_to_material(new_material.id, keywords)
+    # The session is closed before the slow parse/LLM calls; the material row, the new keywords and
+    # the material-keyword links are then written in a single transaction by parse_keywords.
+    await parse_document(doc_path, course, hierarchy, material_title=doc_path)
 
-def _format_hierarchy(root: Keyword, descendants: List[Keyword]) -> str:
-    """Renders the existing keyword tree as an indented outline for the extraction prompt."""
-    children_by_parent = {}
-    for node in [root] + descendants:
-        if node.parent_id is not None:
-            children_by_parent.setdefault(node.parent_id, []).append(node)
+def _format_hierarchy(root: KeywordNodeDTO, descendants: List[KeywordNodeDTO], include: Optional[Set[int]] = None) -> str:
+    """Renders the existing keyword tree as an indented outline for the extraction prompt.
 
+    With `include`, only those nodes are rendered (it must be closed under ancestors). Child ids are
+    always listed in full, so `reparent_existing_children` can still name any real child.
+    """
+    children_by_parent = _children_by_parent(root, descendants)
     lines = []
 
-    def visit(node: Keyword, depth: int) -> None:
-        children = children_by_parent.get(node.id, [])
-        children_note = f"children: {', '.join(str(child.id) for child in children)}" if children else "children: none"
-        lines.append(f"{'  ' * depth}{node.id}: {node.name} — {node.definition} ({children_note})")
-        for child in children:
-            visit(child, depth + 1)
+    def visit(node: KeywordNodeDTO, depth: int) -> None:
+        lines.append(_outline_line(node, children_by_parent.get(node.id, []), depth))
+        for child in children_by_parent.get(node.id, []):
+            if include is None or child.id in include:
+                visit(child, depth + 1)
 
     visit(root, 0)
     return "\n".join(lines)
 
-async def parse_document(doc_path: str, course: Course, hierarchy: KeywordHierarchy, result_type: str = "text") -> List[Keyword]:
+def _children_by_parent(root: KeywordNodeDTO, descendants: List[KeywordNodeDTO]) -> Dict[int, List[KeywordNodeDTO]]:
+    children_by_parent: Dict[int, List[KeywordNodeDTO]] = {}
+    for node in [root] + descendants:
+        if node.parent_id is not None:
+            children_by_parent.setdefault(node.parent_id, []).append(node)
+    return children_by_parent
+
+def _outline_line(node: KeywordNodeDTO, children: List[KeywordNodeDTO], depth: int) -> str:
+    children_note = f"children: {', '.join(str(child.id) for child in children)}" if children else "children: none"
+    return f"{'  ' * depth}{node.id}: {node.name} — {node.definition} ({children_note})"
+
+def _hierarchy_context(root: KeywordNodeDTO, descendants: List[KeywordNodeDTO], text: str, budget: int) -> str:
+    """The hierarchy outline for one chunk of material, cut down to `budget` tokens if it doesn't fit.
+
+    Nodes are ranked by term overlap with the chunk: each shared term counts by its frequency in the
+    chunk (log-damped) and its rarity across the tree, and terms in a node's name count double. The
+    best nodes are added with their whole ancestor chain while the budget lasts, so every rendered
+    node hangs off the root and its id is a valid `attach_to`. Ties, including nodes that share
+    nothing with the chunk, go to the shallower node, so leftover budget shows the tree's top levels.
+    """
+    nodes = [root] + descendants
+    children_by_parent = _children_by_parent(root, descendants)
+    by_id = {node.id: node for node in nodes}
+    # Walk down from the root; anything not reachable from it is never rendered.
+    depth, reachable = {root.id: 0}, [root]
+    for node in reachable:
+        for child in children_by_parent.get(node.id, []):
+            depth[child.id] = depth[node.id] + 1
+            reachable.append(child)
+    cost = {node.id: estimate_tokens(_outline_line(node, children_by_parent.get(node.id, []), depth[node.id])) for node in reachable}
+    if sum(cost.values()) <= budget:
+        return _format_hierarchy(root, descendants)
+
+    name_terms = {node.id: set(tokenize(node.name)) for node in nodes}
+    node_terms = {node.id: name_terms[node.id] | set(tokenize(node.definition or "")) for node in nodes}
+    document_frequency = Counter(term for terms in node_terms.values() for term in terms)
+    chunk_terms = Counter(tokenize(text))
+
+    def relevance(node: KeywordNodeDTO) -> float:
+        return sum(
+            math.log1p(chunk_terms[term]) * math.log(len(nodes) / document_frequency[term]) * (2 if term in name_terms[node.id] else 1)
+            for term in node_terms[node.id]
+            if term in chunk_terms
+        )
+
+    include = {root.id}
+    spent = cost[root.id]
+    for node in sorted(reachable[1:], key=lambda node: (-relevance(node), depth[node.id])):
+        chain, current = [], node
+        while current.id not in include:
+            chain.append(current.id)
+            current = by_id[current.parent_id]
+        extra = sum(cost[node_id] for node_id in chain)
+        if spent + extra <= budget:
+            include.update(chain)
+            spent += extra
+    return _format_hierarchy(root, descendants, include)
+
+async def _extract_chunks(chunks: List[str], extract: Callable[[str], Awaitable]) -> list:
+    """Runs `extract` on every chunk concurrently (bounded by the extraction slots).
+
+    A chunk whose extraction fails is dropped so one bad reply doesn't sink a long upload; only if
+    every chunk fails is the first error raised.
+    """
+    async def run(chunk: str):
+        async with _extraction_slots:
+            return await extract(chunk)
+
+    results = await asyncio.gather(*(run(chunk) for chunk in chunks), return_exceptions=True)
+    extracted = [result for result in results if not isinstance(result, BaseException)]
+    if not extracted:
+        raise results[0]
+    return extracted
+
+async def parse_document(doc_path: str, course: Course, hierarchy: KeywordHierarchy, result_type: str = "text", material_title: Optional[str] = None) -> List[KeywordNodeDTO]:
     """Parses a document and processes keywords and their hierarchy."""
     parser = LlamaParse(
         api_key=API_KEY,
@@ -80,18 +159,29 @@ async def parse_document(doc_path: str, course: Course, hierarchy: KeywordHierar
         ".md": parser,
     }
 
-    documents = SimpleDirectoryReader(input_files=[doc_path], file_extractor=file_extractor).load_data()
+    # LlamaParse's loader is synchronous (it runs its own event loop), so it gets a worker thread.
+    reader = SimpleDirectoryReader(input_files=[doc_path], file_extractor=file_extractor)
+    documents = await asyncio.to_thread(reader.load_data)
 
     combined_markdown = "\n\n".join([doc.text for doc in documents if isinstance(doc, Document)])
 
+    # Map: extract each chunk on its own, concurrently. Reduce: merge the chunk results into one
+    # deduplicated forest, which parse_keywords grafts in a single transaction.
+    chunks = split_into_chunks(combined_markdown, EXTRACTION_CHUNK_TOKENS) or [combined_markdown]
     if hierarchy:
         async with async_session_maker() as session:
             keyword_repo = KeywordRepository(session)
-            root = await keyword_repo.get_keyword_by_id(hierarchy.root_id)
-            descendants = await keyword_repo.get_all_descendant_keywords(hierarchy.root_id)
-        hierarchy_outline = _format_hierarchy(root, descendants)
-        res = extract_keywords_with_attachment(combined_markdown, course.name, hierarchy_outline)
+            nodes = await keyword_repo.get_hierarchy_nodes(hierarchy.id)
+        # Each chunk sees the part of the hierarchy relevant to it, within HIERARCHY_CONTEXT_TOKENS.
+        results = await _extract_chunks(chunks, lambda chunk: extract_keywords_with_attachment(
+            chunk, course.name, _hierarchy_context(nodes[0], nodes[1:], chunk, HIERARCHY_CONTEXT_TOKENS)
+        ))
+        res = merge_attachments(results)
     else:
-        res = query_llm(combined_markdown, course=course.name)
+        async def extract_forest(chunk: str) -> list:
+            # Parsed inside the call, so a malformed reply raises before it can reach the LLM cache.
+            return await query_llm(chunk, course=course.name, parse=_parse_legacy_array)
+
+        res = merge_forests(await _extract_chunks(chunks, extract_forest))
 
-    return await parse_keywords(res, course, existing_hierarchy=hierarchy)
+    return await parse_keywords(res, course, existing_hierarchy=hierarchy, material_title=material_title)
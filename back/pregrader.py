@@ -0,0 +1,103 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from dotenv import load_dotenv
+from text_terms import tokenize
+
+load_dotenv()
+
+# Local lexical pre-grading of OPEN answers before the LLM: "on" or "off".
+PREGRADE = os.getenv("PREGRADE", "on") != "off"
+# Default thresholds on the answer/definition similarity (0..1), overridable per course. An answer
+# scoring at least the pass threshold passes locally, one below the fail threshold fails locally,
+# and everything in between goes to the LLM. Without stemming or synonyms, a correct paraphrase can
+# share no words with the definition, so the default fail threshold of 0 never fails a non-blank
+# answer locally; a course can opt in to local fails with a higher one.
+PREGRADE_PASS_THRESHOLD = float(os.getenv("PREGRADE_PASS_THRESHOLD", "0.85"))
+PREGRADE_FAIL_THRESHOLD = float(os.getenv("PREGRADE_FAIL_THRESHOLD", "0"))
+
+BLANK_FEEDBACK = "No answer given."
+PASS_FEEDBACK = "Matches the reference definition."
+FAIL_FEEDBACK = "Does not match the reference definition closely enough."
+
+# A negated answer can echo the definition word for word and still be wrong, so it never passes locally.
+_NEGATION = re.compile(r"\b(?:not|no|never|none|nothing|neither|nor|cannot|without)\b|n't\b|\b(?:isnt|arent|doesnt|dont|cant|wont)\b")
+
+def _reference_terms(question: str, definition: str) -> List[str]:
+    asked = set(tokenize(question))
+    return [term for term in tokenize(definition) if term not in asked]
+
+def _is_negated(answer: str) -> bool:
+    return bool(_NEGATION.search(answer.casefold().replace("’", "'")))
+
+def _term_matrix(documents: List[List[str]], vocabulary: Dict[str, int]) -> np.ndarray:
+    counts = np.zeros((len(documents), len(vocabulary)))
+    for row, terms in enumerate(documents):
+        np.add.at(counts[row], [vocabulary[term] for term in terms], 1)
+    return counts
+
+def lexical_scores(items: List[Tuple[str, str, str]], corpus: Optional[List[str]] = None) -> np.ndarray:
+    """TF-IDF cosine similarity of each (question, definition, answer)'s answer to its definition.
+
+    Term frequencies are sublinear (1 + log tf) and IDF comes from the distinct documents of
+    `corpus` (by default the definitions in `items`; pass all of a test's definitions), so terms
+    most definitions share count for little. Terms of the question itself are dropped, so
+    restating the question earns nothing.
+    """
+    references, answers = [], []
+    for question, definition, answer in items:
+        asked = set(tokenize(question))
+        references.append(_reference_terms(question, definition))
+        answers.append([term for term in tokenize(answer) if term not in asked])
+    vocabulary: Dict[str, int] = {}
+    for terms in references + answers:
+        for term in terms:
+            vocabulary.setdefault(term, len(vocabulary))
+    if not vocabulary:
+        return np.zeros(len(items))
+
+    reference_counts = _term_matrix(references, vocabulary)
+    answer_counts = _term_matrix(answers, vocabulary)
+    documents = {frozenset(tokenize(text)) for text in corpus} if corpus else {frozenset(terms) for terms in references}
+    document_frequency = np.zeros(len(vocabulary))
+    for terms in documents:
+        known = [vocabulary[term] for term in terms if term in vocabulary]
+        document_frequency[known] += 1
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+    def weigh(counts: np.ndarray) -> np.ndarray:
+        weights = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0) * idf
+        norms = np.linalg.norm(weights, axis=1, keepdims=True)
+        return np.divide(weights, norms, out=np.zeros_like(weights), where=norms > 0)
+
+    return np.clip((weigh(reference_counts) * weigh(answer_counts)).sum(axis=1), 0.0, 1.0)
+
+def thresholds_for(course) -> Tuple[float, float]:
+    """(pass, fail) thresholds for a course, falling back to the defaults."""
+    pass_threshold = course.pregrade_pass_threshold if course and course.pregrade_pass_threshold is not None else PREGRADE_PASS_THRESHOLD
+    fail_threshold = course.pregrade_fail_threshold if course and course.pregrade_fail_threshold is not None else PREGRADE_FAIL_THRESHOLD
+    return pass_threshold, fail_threshold
+
+def pregrade(items: List[Tuple[str, str, str]], pass_threshold: float, fail_threshold: float, corpus: Optional[List[str]] = None) -> List[Tuple[Optional[dict], Optional[float]]]:
+    """(verdict, similarity) per item; the verdict is None where the answer needs the LLM.
+
+    Blank answers fail without a score. Clear passes and clear fails get a {correct, feedback}
+    verdict like the LLM's. Answers are left to the LLM, unscored, when the definition has no terms
+    beyond the question's own (there's nothing to compare against), and negated answers never pass.
+    """
+    scores = lexical_scores(items, corpus)
+    results: List[Tuple[Optional[dict], Optional[float]]] = []
+    for (question, definition, answer), score in zip(items, scores):
+        score = round(float(score), 3)
+        if not answer.strip():
+            results.append(({"correct": False, "feedback": BLANK_FEEDBACK}, None))
+        elif not _reference_terms(question, definition):
+            results.append((None, None))
+        elif score >= pass_threshold and not _is_negated(answer):
+            results.append(({"correct": True, "feedback": PASS_FEEDBACK}, score))
+        elif score < fail_threshold:
+            results.append(({"correct": False, "feedback": FAIL_FEEDBACK}, score))
+        else:
+            results.append((None, score))
+    return results
@@ -0,0 +1,76 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from dotenv import load_dotenv
+from dtos.user_dtos import Principal
+from model.database import async_session_maker
+from repositories import UserRepository
+
+load_dotenv()
+
+# Only tokens issued before the uid claim existed need a database lookup; those results are kept
+# this long, so a deleted or re-roled user is picked up within the TTL.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+class PrincipalCache:
+    """Short-lived LRU of principals resolved from the database, keyed by email."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self.from_claims = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, email: str) -> Optional[Principal]:
+        entry = self._entries.get(email)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        self._entries.move_to_end(email)
+        return entry[1]
+
+    def put(self, principal: Principal) -> None:
+        self._entries[principal.email] = (time.monotonic(), principal)
+        self._entries.move_to_end(principal.email)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, email: str) -> None:
+        self._entries.pop(email, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "from_claims": self.from_claims,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL)
+
+def token_claims(user) -> dict:
+    """Claims that let a token be resolved to a Principal without touching the database."""
+    return {"sub": user.email, "uid": user.id, "role": user.role}
+
+async def resolve_principal(payload: dict) -> Optional[Principal]:
+    """Turns a verified token payload into a Principal; None if its user no longer exists."""
+    email = payload.get("sub")
+    if payload.get("uid") is not None and payload.get("role"):
+        principal_cache.from_claims += 1
+        return Principal(id=payload["uid"], email=email, role=payload["role"])
+
+    principal = principal_cache.get(email)
+    if principal is not None:
+        principal_cache.hits += 1
+        return principal
+    principal_cache.misses += 1
+    async with async_session_maker() as session:
+        user = await UserRepository(session).get_user_by_email(email)
+    if not user:
+        return None
+    principal = Principal(id=user.id, email=user.email, role=user.role)
+    principal_cache.put(principal)
+    return principal
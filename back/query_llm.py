@@ -1,26 +1,101 @@
+import asyncio
 import json
 import os
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq
+from llm_cache import cache_key, llm_cache
 from utils import load_prompts
 
 load_dotenv()
 prompts = load_prompts('prompts.yaml')
 
-client = Groq(
-    api_key=os.getenv("GROQ_API_KEY"),
-)
-
 MODEL = "llama-3.1-8b-instant"
 
+# Deadline for one LLM call in seconds, SDK retries included. Callers can pass their own per call.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Size of the shared HTTP connection pool (per worker process).
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+
+class LLMGateway:
+    """Async chat completions over one pooled HTTP client shared by the whole process.
+
+    Every call runs under a deadline and is cancellable: if the awaiting task is cancelled (client
+    disconnected, background task shut down) or the deadline passes, the in-flight HTTP request is
+    aborted instead of being left to finish in a thread.
+    """
+
+    def __init__(self, api_key: Optional[str], model: str, timeout: float, max_retries: int, max_connections: int):
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self._client: Optional[AsyncGroq] = None
+        # Tokens actually sent/received per prompt key (cache hits cost nothing and aren't counted).
+        self.usage: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def client(self) -> AsyncGroq:
+        # Created on first use so the pool binds to the running event loop, not to import time.
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+            self._client = AsyncGroq(api_key=self.api_key, max_retries=self.max_retries, http_client=http_client)
+        return self._client
+
+    async def complete(self, messages: list, prompt: Optional[str] = None, timeout: Optional[float] = None, parse: Optional[Callable[[str], Any]] = None, json_mode: bool = False) -> Any:
+        """Returns the completion text, or `parse(text)` if given.
+
+        With `prompt` (its prompts.yaml key) the response goes through llm_cache unless that prompt
+        sets `cache: false`. A response is only stored once `parse` accepted it, so a malformed reply
+        is never replayed from the cache. `json_mode` asks the API for a syntactically valid JSON object.
+        """
+        key = cache_key(self.model, prompt, messages) if prompt and prompts.get(prompt, {}).get("cache", True) else None
+        if key:
+            cached = await llm_cache.get(key, prompt)
+            if cached is not None:
+                return parse(cached) if parse else cached
+
+        deadline = timeout if timeout is not None else self.timeout
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        chat_completion = await asyncio.wait_for(
+            self.client.chat.completions.create(messages=messages, model=self.model, timeout=deadline, **extra),
+            deadline,
+        )
+        self._record_usage(prompt, chat_completion.usage)
+        content = chat_completion.choices[0].message.content
+        result = parse(content) if parse else content
+        if key:
+            await llm_cache.put(key, self.model, prompt, content)
+        return result
+
+    def _record_usage(self, prompt: Optional[str], usage) -> None:
+        if usage is None:
+            return
+        totals = self.usage.setdefault(prompt or "unnamed", {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += usage.prompt_tokens or 0
+        totals["completion_tokens"] += usage.completion_tokens or 0
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+llm = LLMGateway(os.getenv("GROQ_API_KEY"), MODEL, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_MAX_CONNECTIONS)
+
 def build_llm_messages(version: str, message: str, course: str) -> list:
     """
     Fetch the appropriate prompt version and format the LLM messages.
     """
     if version not in prompts:
         raise ValueError(f"Prompt version '{version}' not found in the loaded prompts.")
-    
+
     system_prompt = prompts[version]['system']
     user_prompt = prompts[version]['user'].format(message=message, course=course)
 
@@ -29,19 +104,12 @@ def build_llm_messages(version: str, message: str, course: str) -> list:
         {"role": "user", "content": user_prompt},
     ]
 
-def query_llm(message: str, course:str = "History", version:str = "v3") -> str:
+async def query_llm(message: str, course:str = "History", version:str = "v3", timeout: Optional[float] = None, parse: Optional[Callable[[str], Any]] = None) -> Any:
+    """Runs a legacy extraction prompt; pass `parse` so a reply is validated before it's cached."""
     messages = build_llm_messages(version, message, course)
+    return await llm.complete(messages, prompt=version, timeout=timeout, parse=parse)
 
-    chat_completion = client.chat.completions.create(
-        messages=messages,
-        model=MODEL,
-    )
-
-    res = chat_completion.choices[0].message.content
-
-    return res
-
-def generate_distractor_topics(course: str, existing_topics: List[str], count: int) -> List[str]:
+async def generate_distractor_topics(course: str, existing_topics: List[str], count: int, timeout: Optional[float] = None) -> List[str]:
     """Ask the LLM for `count` plausible-but-incorrect topic names for the given course."""
     prompt = prompts["distractors"]
     messages = [
@@ -51,9 +119,9 @@ def generate_distractor_topics(course: str, existing_topics: List[str], count: i
         )},
     ]
 
-    chat_completion = client.chat.completions.create(messages=messages, model=MODEL)
-    content = chat_completion.choices[0].message.content
+    return await llm.complete(messages, prompt="distractors", timeout=timeout, parse=_parse_topics)
 
+def _parse_topics(content: str) -> List[str]:
     start, end = content.find("["), content.rfind("]") + 1
     if start == -1 or end == 0:
         return []
@@ -61,7 +129,7 @@ def generate_distractor_topics(course: str, existing_topics: List[str], count: i
     topics = json.loads(content[start:end])
     return [topic for topic in topics if isinstance(topic, str)]
 
-def extract_keywords_with_attachment(text: str, course: str, existing_hierarchy: str) -> dict:
+async def extract_keywords_with_attachment(text: str, course: str, existing_hierarchy: str, timeout: Optional[float] = None) -> dict:
     """Extract keywords from material, given the course's existing hierarchy as context.
 
     Retries once on a malformed response — the model occasionally emits invalid JSON for this prompt.
@@ -76,27 +144,24 @@ def extract_keywords_with_attachment(text: str, course: str, existing_hierarchy:
 
     last_error = None
     for _ in range(2):
-        chat_completion = client.chat.completions.create(messages=messages, model=MODEL)
-        content = chat_completion.choices[0].message.content
-
-        start, end = content.find("{"), content.rfind("}") + 1
-        if start == -1 or end == 0:
-            last_error = ValueError("JSON object not found in the response.")
-            continue
         try:
-            data = json.loads(content[start:end])
-        except json.JSONDecodeError as e:
+            return await llm.complete(messages, prompt="extraction_with_attachment", timeout=timeout, parse=_parse_extraction)
+        except ValueError as e:  # includes json.JSONDecodeError
             last_error = e
-            continue
-
-        return {
-            "attach_to": data.get("attach_to"),
-            "insert_intermediate": data.get("insert_intermediate"),
-            "keywords": data.get("keywords", []),
-        }
     raise last_error
 
-def grade_open_answer(question: str, definition: str, answer: str) -> dict:
+def _parse_extraction(content: str) -> dict:
+    start, end = content.find("{"), content.rfind("}") + 1
+    if start == -1 or end == 0:
+        raise ValueError("JSON object not found in the response.")
+    data = json.loads(content[start:end])
+    return {
+        "attach_to": data.get("attach_to"),
+        "insert_intermediate": data.get("insert_intermediate"),
+        "keywords": data.get("keywords", []),
+    }
+
+async def grade_open_answer(question: str, definition: str, answer: str, timeout: Optional[float] = None) -> dict:
     """Ask the LLM whether the student's answer matches the reference definition. Returns {correct, feedback}."""
     prompt = prompts["grading"]
     messages = [
@@ -106,9 +171,47 @@ def grade_open_answer(question: str, definition: str, answer: str) -> dict:
         )},
     ]
 
-    chat_completion = client.chat.completions.create(messages=messages, model=MODEL)
-    content = chat_completion.choices[0].message.content
+    return await llm.complete(messages, prompt="grading", timeout=timeout, parse=_parse_verdict)
 
+def _parse_verdict(content: str) -> dict:
     start, end = content.find("{"), content.rfind("}") + 1
     data = json.loads(content[start:end])
-    return {"correct": bool(data["correct"]), "feedback": str(data.get("feedback", ""))}
\ No newline at end of file
+    return {"correct": bool(data["correct"]), "feedback": str(data.get("feedback", ""))}
+
+async def grade_open_answers_batch(items: List[Tuple[str, str, str]], timeout: Optional[float] = None) -> List[Optional[dict]]:
+    """Grades several (question, definition, answer) triples with one request.
+
+    Returns one {correct, feedback} per item, in order, or None for an item whose verdict is missing
+    or malformed — callers grade those with `grade_open_answer`. Raises if the reply isn't JSON at all.
+    """
+    prompt = prompts["grading_batch"]
+    rendered = "\n\n".join(
+        f"Item {number}\nQuestion: {question}\nReference definition: {definition}\nStudent answer: {answer}"
+        for number, (question, definition, answer) in enumerate(items, start=1)
+    )
+    messages = [
+        {"role": "system", "content": prompt["system"]},
+        {"role": "user", "content": prompt["user"].format(items=rendered)},
+    ]
+
+    return await llm.complete(
+        messages, prompt="grading_batch", timeout=timeout, json_mode=True,
+        parse=lambda content: _parse_batch_verdicts(content, len(items)),
+    )
+
+def _parse_batch_verdicts(content: str, count: int) -> List[Optional[dict]]:
+    start, end = content.find("{"), content.rfind("}") + 1
+    if start == -1 or end == 0:
+        raise ValueError("JSON object not found in the response.")
+    results = json.loads(content[start:end]).get("results")
+    if not isinstance(results, list):
+        raise ValueError("No results list in the response.")
+
+    verdicts: List[Optional[dict]] = [None] * count
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        number = result.get("id")
+        if isinstance(number, int) and 1 <= number <= count and isinstance(result.get("correct"), bool):
+            verdicts[number - 1] = {"correct": result["correct"], "feedback": str(result.get("feedback", ""))}
+    return verdicts
@@ -0,0 +1,80 @@
+"""Rebuilds the test/question stats rollups from the attempt and answer tables.
+
+The rollups are kept up to date as attempts are submitted, graded and overridden; this is the repair
+path for when they've drifted (manual SQL edits, restored backups). Run from back/:
+
+    python rebuild_stats.py                      # every test
+    python rebuild_stats.py --test-id 3 --test-id 7
+    python rebuild_stats.py --check              # report drift without rewriting anything
+"""
+import argparse
+import asyncio
+import math
+from typing import List, Optional
+
+from sqlmodel import select
+
+from model.database import async_session_maker
+from model.test import Test
+from repositories import AttemptRepository, StatsRollupRepository
+
+def _drift(live: dict, rollup: dict) -> List[str]:
+    """Names of the fields whose rollup value differs from the live one, with both values."""
+    drifted = []
+    for field, expected in live.items():
+        actual = rollup[field]
+        if field == "score_sum":
+            same = math.isclose(expected, actual, abs_tol=1e-6)
+        else:
+            same = expected == actual
+        if not same:
+            drifted.append(f"{field} live={expected} rollup={actual}")
+    return drifted
+
+async def _check(test_ids: Optional[List[int]]) -> int:
+    """Compares every rollup against a live aggregate over the base tables; returns the number of drifted tests."""
+    drifted = 0
+    async with async_session_maker() as session:
+        attempt_repo = AttemptRepository(session)
+        rollups = StatsRollupRepository(session)
+        if test_ids is None:
+            test_ids = list((await session.execute(select(Test.id).order_by(Test.id))).scalars().all())
+        for test_id in test_ids:
+            summary = await attempt_repo.get_score_summary(test_id)
+            rollup = await rollups.get_test_rollup(test_id)
+            live = {
+                "attempt_count": summary["attempt_count"],
+                "graded_count": summary["graded_count"],
+                "score_sum": float(summary["score_sum"]),
+                # Exact per-score counts: any difference here also shows up in every band of the distribution.
+                "score_bins": [(float(score), count) for score, count in await attempt_repo.get_score_counts(test_id)],
+                "questions": [(q.id, answered, correct) for q, answered, correct in await attempt_repo.get_question_stats(test_id)],
+            }
+            stored = {
+                "attempt_count": rollup.attempt_count if rollup else 0,
+                "graded_count": rollup.graded_count if rollup else 0,
+                "score_sum": float(rollup.score_sum) if rollup else 0.0,
+                "score_bins": [(float(score), count) for score, count in await rollups.get_score_bins(test_id)],
+                "questions": [(q.id, answered, correct) for q, answered, correct in await rollups.get_question_rollups(test_id)],
+            }
+            fields = _drift(live, stored)
+            if fields:
+                drifted += 1
+                print(f"test {test_id}: " + "; ".join(fields))
+    return drifted
+
+async def run(test_ids: Optional[List[int]], check: bool) -> None:
+    if check:
+        drifted = await _check(test_ids)
+        print(f"{drifted} test(s) drifted" if drifted else "rollups are consistent")
+        return
+    async with async_session_maker() as session:
+        await StatsRollupRepository(session).rebuild(test_ids)
+    print("rebuilt rollups for " + (f"tests {test_ids}" if test_ids else "all tests"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--test-id", type=int, action="append", dest="test_ids")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.test_ids, args.check))
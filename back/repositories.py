@@ -1,14 +1,25 @@
 import os
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from sqlmodel import Session, select
-from sqlalchemy import delete, update
+from sqlalchemy import ARRAY, Float, String, all_, and_, bindparam, cast, delete, exists, func, insert, literal, or_, text, tuple_, union_all, update
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array as pg_array, insert as pg_insert
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import Executable
 from model.question import Question, QuestionType
-from model.keyword import Keyword, KeywordHierarchy
+from model.keyword import Keyword, KeywordClosure, KeywordHierarchy
 from model.course import Course, CourseMaterial, CourseMaterialKeywordLink
 from model.user import UserCourseLink, User, UserRole
 from model.test import UserTestLink, KeywordTestLink, Test
-from model.attempt import TestAttempt, Answer
+from model.attempt import AttemptStatus, TestAttempt, Answer
+from model.stats import QuestionStatsRollup, TestScoreBin, TestStatsRollup
+from model.session_token import SessionToken
+from model.llm_cache import LLMCacheEntry
+from model.job import Job, JobKind, JobState
+from model.verdict import GradingVerdict
 from dtos.attempt_dtos import AnswerSubmitDTO
+from dtos.keyword_dtos import KeywordNodeDTO
+from hierarchy_cache import hierarchy_cache
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
 class KeywordRepository:
@@ -17,14 +28,54 @@ class KeywordRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def create_keyword(self, name: str, definition: str, parent_id: Optional[int] = None) -> Keyword:
-        """Creates a new keyword."""
-        keyword = Keyword(name=name, definition=definition, parent_id=parent_id)
+    async def create_keyword(self, name: str, definition: str, parent_id: Optional[int] = None, hierarchy_id: Optional[int] = None, commit: bool = True) -> Keyword:
+        """Creates a new keyword and its ancestor-index rows. hierarchy_id defaults to the parent's.
+
+        With commit=False the row is only flushed; the caller commits and invalidates the hierarchy cache.
+        """
+        if hierarchy_id is None and parent_id is not None:
+            result = await self.session.execute(select(Keyword.hierarchy_id).where(Keyword.id == parent_id))
+            hierarchy_id = result.scalar_one_or_none()
+        keyword = Keyword(name=name, definition=definition, parent_id=parent_id, hierarchy_id=hierarchy_id)
         self.session.add(keyword)
-        await self.session.commit()
-        await self.session.refresh(keyword)
+        await self.session.flush()
+        await self._index_new_keywords([keyword.id])
+        if commit:
+            await self.session.commit()
+            hierarchy_cache.invalidate(hierarchy_id)
+            await self.session.refresh(keyword)
         return keyword
 
+    async def create_keywords_bulk(self, rows: List[dict]) -> List[int]:
+        """Inserts many keywords with one multi-row INSERT ... RETURNING and indexes them. Caller commits.
+
+        Each row is a dict of name/definition/parent_id/hierarchy_id. Parents must already exist, so a tree
+        is written one level per call. Returns the new ids in the order of `rows`.
+        """
+        if not rows:
+            return []
+        statement = insert(Keyword).returning(Keyword.id, sort_by_parameter_order=True)
+        result = await self.session.execute(statement, rows)
+        keyword_ids = list(result.scalars().all())
+        await self._index_new_keywords(keyword_ids)
+        return keyword_ids
+
+    async def _index_new_keywords(self, keyword_ids: List[int]) -> None:
+        """Adds closure rows for freshly inserted keywords whose parents are already indexed."""
+        new = aliased(Keyword)
+        self_rows = select(
+            new.id.label("ancestor_id"), new.id.label("descendant_id"), literal(0).label("depth")
+        ).where(new.id.in_(keyword_ids))
+        ancestor_rows = (
+            select(KeywordClosure.ancestor_id, new.id, KeywordClosure.depth + 1)
+            .select_from(new)
+            .join(KeywordClosure, KeywordClosure.descendant_id == new.parent_id)
+            .where(new.id.in_(keyword_ids))
+        )
+        await self.session.execute(
+            insert(KeywordClosure).from_select(["ancestor_id", "descendant_id", "depth"], union_all(self_rows, ancestor_rows))
+        )
+
     async def get_keyword_by_id(self, keyword_id: int) -> Optional[Keyword]:
         """Fetches a keyword by its ID."""
         statement = select(Keyword).where(Keyword.id == keyword_id)
@@ -38,26 +89,114 @@ class KeywordRepository:
         return result.scalars().all()
     
     async def get_root_by_hierarchy_id(self, hierarchy_id: int) -> Keyword:
-        """Fetches all keywords for a specific hierarchy ID."""
+        """Fetches the root keyword of a hierarchy."""
         statement = (
             select(Keyword)
-            .join(KeywordHierarchy, Keyword.hierarchy)
+            .join(KeywordHierarchy, KeywordHierarchy.root_id == Keyword.id)
             .where(KeywordHierarchy.id == hierarchy_id)
         )
         result = await self.session.execute(statement)
         return result.scalars().first()
 
     async def get_all_descendant_keywords(self, root_id: int) -> List[Keyword]:
-        """Fetches every keyword under root_id (excluding the root itself), level by level."""
-        all_keywords: List[Keyword] = []
-        current_level_ids = [root_id]
-        while current_level_ids:
-            statement = select(Keyword).where(Keyword.parent_id.in_(current_level_ids))
-            result = await self.session.execute(statement)
-            children = result.scalars().all()
-            all_keywords.extend(children)
-            current_level_ids = [keyword.id for keyword in children]
-        return all_keywords
+        """Fetches every keyword under root_id (excluding the root itself), shallowest levels first."""
+        return await self.get_subtree(root_id)
+
+    async def get_subtree(self, root_id: int, include_root: bool = False, max_depth: Optional[int] = None) -> List[Keyword]:
+        """Fetches the subtree under root_id with one indexed closure-table lookup, ordered by depth."""
+        statement = (
+            select(Keyword)
+            .join(KeywordClosure, KeywordClosure.descendant_id == Keyword.id)
+            .where(KeywordClosure.ancestor_id == root_id)
+            .order_by(KeywordClosure.depth, Keyword.id)
+        )
+        if not include_root:
+            statement = statement.where(KeywordClosure.depth > 0)
+        if max_depth is not None:
+            statement = statement.where(KeywordClosure.depth <= max_depth)
+        result = await self.session.execute(statement)
+        return result.scalars().all()
+
+    async def get_hierarchy_nodes(self, hierarchy_id: int) -> Optional[List[KeywordNodeDTO]]:
+        """Returns the whole tree of a hierarchy (root first, then by depth) through the hierarchy cache.
+
+        None if the hierarchy doesn't exist. The nodes are shared with other readers — don't mutate them.
+        """
+        cached = hierarchy_cache.get(hierarchy_id)
+        if cached is not None:
+            return cached
+        version = hierarchy_cache.version(hierarchy_id)
+        hierarchy = await self.get_hierarchy_by_id(hierarchy_id)
+        if not hierarchy:
+            return None
+        keywords = await self.get_subtree(hierarchy.root_id, include_root=True) if hierarchy.root_id else []
+        nodes = [
+            KeywordNodeDTO(id=k.id, name=k.name, definition=k.definition, parent_id=k.parent_id)
+            for k in keywords
+        ]
+        hierarchy_cache.put(hierarchy_id, version, nodes)
+        return nodes
+
+    async def get_ancestors(self, keyword_id: int) -> List[Keyword]:
+        """Fetches the ancestors of keyword_id (excluding itself), from the hierarchy root down."""
+        statement = (
+            select(Keyword)
+            .join(KeywordClosure, KeywordClosure.ancestor_id == Keyword.id)
+            .where(KeywordClosure.descendant_id == keyword_id, KeywordClosure.depth > 0)
+            .order_by(KeywordClosure.depth.desc())
+        )
+        result = await self.session.execute(statement)
+        return result.scalars().all()
+
+    async def get_keywords_for_hierarchy(self, hierarchy_id: int) -> List[Keyword]:
+        """Fetches every keyword of a hierarchy, root included."""
+        statement = select(Keyword).where(Keyword.hierarchy_id == hierarchy_id)
+        result = await self.session.execute(statement)
+        return result.scalars().all()
+
+    async def is_in_hierarchy(self, keyword_id: int, hierarchy_id: int) -> bool:
+        statement = select(Keyword.id).where(Keyword.id == keyword_id, Keyword.hierarchy_id == hierarchy_id)
+        result = await self.session.execute(statement)
+        return result.first() is not None
+
+    async def is_descendant(self, keyword_id: int, ancestor_id: int) -> bool:
+        statement = select(KeywordClosure.depth).where(
+            KeywordClosure.ancestor_id == ancestor_id, KeywordClosure.descendant_id == keyword_id
+        )
+        result = await self.session.execute(statement)
+        return result.first() is not None
+
+    async def get_subtree_with_paths(self, root_id: int, include_root: bool = False, max_depth: Optional[int] = None) -> List[Tuple[Keyword, int, List[int]]]:
+        """Fetches the subtree under root_id with one WITH RECURSIVE query.
+
+        Each row is (keyword, depth, path): depth is 0 for root_id itself and path is the list of ids
+        from root_id down to the keyword. max_depth stops the recursion that many levels below root_id.
+        """
+        subtree = (
+            select(Keyword.id.label("id"), literal(0).label("depth"), pg_array([Keyword.id]).label("path"))
+            .where(Keyword.id == root_id)
+            .cte("subtree", recursive=True)
+        )
+        child = aliased(Keyword)
+        step = (
+            select(child.id, subtree.c.depth + 1, func.array_append(subtree.c.path, child.id))
+            .join(subtree, child.parent_id == subtree.c.id)
+            # Guards against a corrupted parent_id cycle recursing forever.
+            .where(child.id != all_(subtree.c.path))
+        )
+        if max_depth is not None:
+            step = step.where(subtree.c.depth < max_depth)
+        subtree = subtree.union_all(step)
+
+        statement = (
+            select(Keyword, subtree.c.depth, subtree.c.path)
+            .join(subtree, Keyword.id == subtree.c.id)
+            .order_by(subtree.c.depth, Keyword.id)
+        )
+        if not include_root:
+            statement = statement.where(subtree.c.depth > 0)
+        result = await self.session.execute(statement)
+        return [(keyword, depth, list(path)) for keyword, depth, path in result.all()]
 
     async def update_keyword(self, keyword_id: int, name: Optional[str] = None, definition: Optional[str] = None) -> Optional[Keyword]:
         """Updates an existing keyword."""
@@ -70,18 +209,45 @@ class KeywordRepository:
             keyword.definition = definition
         self.session.add(keyword)
         await self.session.commit()
+        hierarchy_cache.invalidate(keyword.hierarchy_id)
         await self.session.refresh(keyword)
         return keyword
 
-    async def reparent_keyword(self, keyword_id: int, new_parent_id: int) -> Optional[Keyword]:
-        """Moves an existing keyword under a new parent, leaving its name/definition untouched."""
+    async def reparent_keyword(self, keyword_id: int, new_parent_id: int, commit: bool = True) -> Optional[Keyword]:
+        """Moves an existing keyword (and its subtree) under a new parent, leaving its name/definition untouched."""
         keyword = await self.get_keyword_by_id(keyword_id)
         if not keyword:
             return None
+        old_hierarchy_id = keyword.hierarchy_id
         keyword.parent_id = new_parent_id
         self.session.add(keyword)
-        await self.session.commit()
-        await self.session.refresh(keyword)
+        await self.session.flush()
+
+        # Aliases keep these subqueries from auto-correlating with the UPDATE/DELETE target tables.
+        subtree = aliased(KeywordClosure)
+        subtree_ids = select(subtree.descendant_id).where(subtree.ancestor_id == keyword_id)
+        # Detach the subtree from its old ancestors, then link it under every ancestor of the new parent.
+        await self.session.execute(delete(KeywordClosure).where(
+            KeywordClosure.descendant_id.in_(subtree_ids),
+            KeywordClosure.ancestor_id.not_in(subtree_ids),
+        ))
+        above = aliased(KeywordClosure)
+        below = aliased(KeywordClosure)
+        await self.session.execute(insert(KeywordClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .where(above.descendant_id == new_parent_id, below.ancestor_id == keyword_id),
+        ))
+        parent = aliased(Keyword)
+        new_hierarchy_id = select(parent.hierarchy_id).where(parent.id == new_parent_id).scalar_subquery()
+        await self.session.execute(
+            update(Keyword).where(Keyword.id.in_(subtree_ids)).values(hierarchy_id=new_hierarchy_id)
+        )
+        if commit:
+            await self.session.commit()
+            await self.session.refresh(keyword)
+            hierarchy_cache.invalidate(old_hierarchy_id)
+            hierarchy_cache.invalidate(keyword.hierarchy_id)
         return keyword
 
     async def delete_keyword(self, keyword_id: int) -> bool:
@@ -89,18 +255,26 @@ class KeywordRepository:
         keyword = await self.get_keyword_by_id(keyword_id)
         if not keyword:
             return False
+        await self.session.execute(delete(KeywordClosure).where(
+            (KeywordClosure.ancestor_id == keyword_id) | (KeywordClosure.descendant_id == keyword_id)
+        ))
         await self.session.delete(keyword)
         await self.session.commit()
+        hierarchy_cache.invalidate(keyword.hierarchy_id)
         return True
 
     # --- KeywordHierarchy CRUD Operations ---
 
-    async def create_hierarchy(self, root_id: Optional[int] = None) -> KeywordHierarchy:
-        """Creates a new keyword hierarchy."""
+    async def create_hierarchy(self, root_id: Optional[int] = None, commit: bool = True) -> KeywordHierarchy:
+        """Creates a new keyword hierarchy, stamping the root keyword with its id."""
         hierarchy = KeywordHierarchy(root_id=root_id)
         self.session.add(hierarchy)
-        await self.session.commit()
-        await self.session.refresh(hierarchy)
+        await self.session.flush()
+        if root_id is not None:
+            await self.session.execute(update(Keyword).where(Keyword.id == root_id).values(hierarchy_id=hierarchy.id))
+        if commit:
+            await self.session.commit()
+            await self.session.refresh(hierarchy)
         return hierarchy
 
     async def get_hierarchy_by_id(self, hierarchy_id: int) -> Optional[KeywordHierarchy]:
@@ -124,6 +298,7 @@ class KeywordRepository:
         hierarchy.keywords.append(keyword)
         self.session.add(hierarchy)
         await self.session.commit()
+        hierarchy_cache.invalidate(hierarchy_id)
         await self.session.refresh(hierarchy)
         return hierarchy
 
@@ -134,7 +309,35 @@ class KeywordRepository:
             return False
         await self.session.delete(hierarchy)
         await self.session.commit()
+        hierarchy_cache.invalidate(hierarchy_id)
         return True
+
+    async def index_is_empty(self) -> bool:
+        """True when keywords exist but the ancestor index has never been built (pre-closure databases)."""
+        has_keywords = (await self.session.execute(select(Keyword.id).limit(1))).first() is not None
+        has_index = (await self.session.execute(select(KeywordClosure.ancestor_id).limit(1))).first() is not None
+        return has_keywords and not has_index
+
+    async def rebuild_keyword_index(self) -> None:
+        """Recomputes the closure table and every keyword's hierarchy_id from parent_id alone."""
+        await self.session.execute(delete(KeywordClosure))
+        await self.session.execute(text("""
+            INSERT INTO keywordclosure (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE pairs(ancestor_id, descendant_id, depth) AS (
+                SELECT id, id, 0 FROM keyword
+                UNION ALL
+                SELECT pairs.ancestor_id, keyword.id, pairs.depth + 1
+                FROM pairs JOIN keyword ON keyword.parent_id = pairs.descendant_id
+            )
+            SELECT ancestor_id, descendant_id, depth FROM pairs
+        """))
+        await self.session.execute(text("""
+            UPDATE keyword SET hierarchy_id = keywordhierarchy.id
+            FROM keywordclosure JOIN keywordhierarchy ON keywordhierarchy.root_id = keywordclosure.ancestor_id
+            WHERE keywordclosure.descendant_id = keyword.id
+        """))
+        await self.session.commit()
+        hierarchy_cache.clear()
        
 class CourseRepository:
     """Handles CRUD operations for the Course and CourseMaterials models."""
@@ -161,7 +364,7 @@ class CourseRepository:
         result = await self.session.execute(statement)
         return result.scalars().all()
 
-    async def update_course(self, course_id: int, name: Optional[str] = None, keyword_hierarchy_id: Optional[int] = None) -> Optional[Course]:
+    async def update_course(self, course_id: int, name: Optional[str] = None, keyword_hierarchy_id: Optional[int] = None, commit: bool = True) -> Optional[Course]:
         course = await self.get_course_by_id(course_id)
         if not course:
             return None
@@ -170,8 +373,11 @@ class CourseRepository:
         if keyword_hierarchy_id is not None:
             course.keyword_hierarchy_id = keyword_hierarchy_id
         self.session.add(course)
-        await self.session.commit()
-        await self.session.refresh(course)
+        if commit:
+            await self.session.commit()
+            await self.session.refresh(course)
+        else:
+            await self.session.flush()
         return course
 
     async def add_material_to_course(self, course_id: int, material: CourseMaterial) -> Optional[Course]:
@@ -184,29 +390,49 @@ class CourseRepository:
         await self.session.refresh(course)
         return course
 
-    async def delete_course(self, course_id: int, hierarchy_id: Optional[int] = None, keyword_ids: Optional[List[int]] = None) -> bool:
+    async def delete_course(self, course_id: int, hierarchy_id: Optional[int] = None, on_progress: Optional[Callable[[str, int, int], Awaitable[None]]] = None) -> bool:
+        """Deletes a course with its tests, materials, enrollments and keyword tree in one transaction.
+
+        Every dependent set is removed by a statement keyed on the course (or its hierarchy) id, so
+        the statement count doesn't depend on how many tests or keywords the course has.
+        `on_progress(step, completed, total)` is awaited before each statement.
+        """
         course = await self.get_course_by_id(course_id)
         if not course:
             return False
-        # None of these FKs have ON DELETE CASCADE, so remove dependents in FK-safe order.
-        # (Tests are deleted by the caller first, via TestRepository.delete_test.)
-        await self.session.execute(delete(UserCourseLink).where(UserCourseLink.course_id == course_id))
-        await self.session.execute(delete(CourseMaterialKeywordLink).where(
-            CourseMaterialKeywordLink.coursematerial_id.in_(
-                select(CourseMaterial.id).where(CourseMaterial.course_id == course_id))))
-        await self.session.execute(delete(CourseMaterial).where(CourseMaterial.course_id == course_id))
-        # Break the Course -> hierarchy FK so the hierarchy row can be deleted.
-        course.keyword_hierarchy_id = None
-        self.session.add(course)
-        await self.session.flush()
+        # Aliased so the subquery doesn't correlate with the DELETE FROM test it feeds.
+        course_tests = aliased(Test)
+        steps = _test_teardown_statements(select(course_tests.id).where(course_tests.course_id == course_id))
+        steps += [
+            ("enrollments", delete(UserCourseLink).where(UserCourseLink.course_id == course_id)),
+            ("material keyword links", delete(CourseMaterialKeywordLink).where(
+                CourseMaterialKeywordLink.coursematerial_id.in_(
+                    select(CourseMaterial.id).where(CourseMaterial.course_id == course_id)))),
+            ("materials", delete(CourseMaterial).where(CourseMaterial.course_id == course_id)),
+            # Break the Course -> hierarchy FK so the hierarchy row can be deleted.
+            ("course hierarchy link", update(Course).where(Course.id == course_id).values(keyword_hierarchy_id=None)),
+        ]
         if hierarchy_id:
-            await self.session.execute(delete(KeywordHierarchy).where(KeywordHierarchy.id == hierarchy_id))
-        if keyword_ids:
-            # Break the self-referential parent_id before deleting the keyword rows.
-            await self.session.execute(update(Keyword).where(Keyword.id.in_(keyword_ids)).values(parent_id=None))
-            await self.session.execute(delete(Keyword).where(Keyword.id.in_(keyword_ids)))
-        await self.session.delete(course)
+            keyword_ids = select(Keyword.id).where(Keyword.hierarchy_id == hierarchy_id)
+            steps += [
+                # hierarchy.root_id and keyword.hierarchy_id point at each other; break the root side first.
+                ("hierarchy root", update(KeywordHierarchy).where(KeywordHierarchy.id == hierarchy_id).values(root_id=None)),
+                ("keyword index", delete(KeywordClosure).where(KeywordClosure.descendant_id.in_(keyword_ids))),
+                # Break the self-referential parent_id before deleting the keyword rows.
+                ("keyword parents", update(Keyword).where(Keyword.hierarchy_id == hierarchy_id).values(parent_id=None)),
+                ("keywords", delete(Keyword).where(Keyword.hierarchy_id == hierarchy_id)),
+                ("hierarchy", delete(KeywordHierarchy).where(KeywordHierarchy.id == hierarchy_id)),
+            ]
+        steps.append(("course", delete(Course).where(Course.id == course_id)))
+
+        for completed, (step, statement) in enumerate(steps):
+            if on_progress:
+                await on_progress(step, completed, len(steps))
+            await self.session.execute(statement)
         await self.session.commit()
+        if on_progress:
+            await on_progress("done", len(steps), len(steps))
+        hierarchy_cache.invalidate(hierarchy_id)
         return True
     
     async def get_all_materials_for_course(self, course_id: int) -> List[CourseMaterial]:
@@ -231,11 +457,14 @@ class CourseRepository:
 
     # --- CourseMaterial CRUD Operations ---
 
-    async def create_course_material(self, title: str, course_id: Optional[int] = None) -> CourseMaterial:
+    async def create_course_material(self, title: str, course_id: Optional[int] = None, commit: bool = True) -> CourseMaterial:
         material = CourseMaterial(title=title, course_id=course_id)
         self.session.add(material)
-        await self.session.commit()
-        await self.session.refresh(material)
+        if commit:
+            await self.session.commit()
+            await self.session.refresh(material)
+        else:
+            await self.session.flush()
         return material
 
     async def get_course_material_by_id(self, material_id: int) -> Optional[CourseMaterial]:
@@ -255,29 +484,57 @@ class CourseRepository:
         return material
     
     async def add_keywords_to_material(self, new_material_id:str, keywords: List[Keyword]) -> None:
+        await self.link_keywords_to_material(new_material_id, [keyword.id for keyword in keywords])
+        await self.session.commit()
+
+    async def link_keywords_to_material(self, material_id: int, keyword_ids: List[int]) -> None:
+        """Writes all material-keyword links in one INSERT. Caller commits."""
         # A keyword can appear more than once in the extracted list (e.g. reused/deduped under two
         # branches in the same response) — dedupe by id so we don't insert the same link twice.
-        unique_keywords = {keyword.id: keyword for keyword in keywords}.values()
-        for keyword in unique_keywords:
-            material_keyword_link = CourseMaterialKeywordLink(
-                coursematerial_id=new_material_id,
-                keyword_id=keyword.id
-            )
-            self.session.add(material_keyword_link)
-
-        await self.session.commit()
+        unique_ids = list(dict.fromkeys(keyword_ids))
+        if not unique_ids:
+            return
+        await self.session.execute(
+            pg_insert(CourseMaterialKeywordLink)
+            .values([{"coursematerial_id": material_id, "keyword_id": keyword_id} for keyword_id in unique_ids])
+            .on_conflict_do_nothing()
+        )
     
+def _test_teardown_statements(test_ids) -> List[Tuple[str, Executable]]:
+    """(label, DELETE) pairs removing the given tests and everything that hangs off them.
+
+    `test_ids` is a list or a SELECT of test ids, so a whole course's tests go in the same fixed
+    number of statements as a single test. Order matters — none of these FKs have ON DELETE CASCADE,
+    and answers reference both attempts and questions, so they go first.
+    """
+    attempt_ids = select(TestAttempt.id).where(TestAttempt.test_id.in_(test_ids))
+    return [
+        ("answers", delete(Answer).where(Answer.attempt_id.in_(attempt_ids))),
+        ("attempts", delete(TestAttempt).where(TestAttempt.test_id.in_(test_ids))),
+        ("test keyword links", delete(KeywordTestLink).where(KeywordTestLink.test_id.in_(test_ids))),
+        ("test takers", delete(UserTestLink).where(UserTestLink.test_id.in_(test_ids))),
+        ("question stats", delete(QuestionStatsRollup).where(QuestionStatsRollup.test_id.in_(test_ids))),
+        ("grading verdicts", delete(GradingVerdict).where(GradingVerdict.question_id.in_(select(Question.id).where(Question.test_id.in_(test_ids))))),
+        ("score bins", delete(TestScoreBin).where(TestScoreBin.test_id.in_(test_ids))),
+        ("test stats", delete(TestStatsRollup).where(TestStatsRollup.test_id.in_(test_ids))),
+        ("questions", delete(Question).where(Question.test_id.in_(test_ids))),
+        ("tests", delete(Test).where(Test.id.in_(test_ids))),
+    ]
+
 class TestRepository:
     """Handles CRUD operations for the Test model."""
 
     def __init__(self, session: Session):
         self.session = session
     
-    async def create_test(self, title: str, creator_id: Optional[int] = None, course_id: Optional[int] = None) -> Test:
+    async def create_test(self, title: str, creator_id: Optional[int] = None, course_id: Optional[int] = None, commit: bool = True) -> Test:
         test = Test(title=title, creator_id=creator_id, course_id=course_id)
         self.session.add(test)
-        await self.session.commit()
-        await self.session.refresh(test)
+        if commit:
+            await self.session.commit()
+            await self.session.refresh(test)
+        else:
+            await self.session.flush()
         return test
 
     async def get_test_by_id(self, test_id: int) -> Optional[Test]:
@@ -324,11 +581,58 @@ class TestRepository:
         return await self.get_test_by_id(test_id)
 
     async def add_keywords_to_test(self, test_id: int, keywords: List[Keyword]) -> None:
-        for keyword in keywords:
-            link = KeywordTestLink(test_id=test_id, keyword_id=keyword.id)
-            self.session.add(link)
+        await self.link_keywords_to_test(test_id, [keyword.id for keyword in keywords])
         await self.session.commit()
 
+    async def link_keywords_to_test(self, test_id: int, keyword_ids: List[int]) -> None:
+        """Writes all test-keyword links in one INSERT. Caller commits."""
+        unique_ids = list(dict.fromkeys(keyword_ids))
+        if not unique_ids:
+            return
+        await self.session.execute(
+            pg_insert(KeywordTestLink)
+            .values([{"test_id": test_id, "keyword_id": keyword_id} for keyword_id in unique_ids])
+            .on_conflict_do_nothing()
+        )
+
+    async def get_course_test_summaries(self, course_id: int, student_id: Optional[int] = None) -> List[Tuple[Test, int, int, Optional[TestAttempt]]]:
+        """Lists a course's tests with question and attempt counts in one grouped query.
+
+        Each row is (test, num_questions, attempt_count, attempt); attempt is student_id's own attempt
+        on that test, or None (always None when no student_id is given).
+        """
+        question_counts = (
+            select(Question.test_id, func.count(Question.id).label("total"))
+            .join(Test, Test.id == Question.test_id)
+            .where(Test.course_id == course_id)
+            .group_by(Question.test_id)
+            .subquery()
+        )
+        attempt_counts = (
+            select(TestAttempt.test_id, func.count(TestAttempt.id).label("total"))
+            .join(Test, Test.id == TestAttempt.test_id)
+            .where(Test.course_id == course_id)
+            .group_by(TestAttempt.test_id)
+            .subquery()
+        )
+        columns = [Test, func.coalesce(question_counts.c.total, 0), func.coalesce(attempt_counts.c.total, 0)]
+        if student_id is not None:
+            columns.append(TestAttempt)
+        statement = (
+            select(*columns)
+            .outerjoin(question_counts, question_counts.c.test_id == Test.id)
+            .outerjoin(attempt_counts, attempt_counts.c.test_id == Test.id)
+        )
+        if student_id is not None:
+            statement = statement.outerjoin(
+                TestAttempt, (TestAttempt.test_id == Test.id) & (TestAttempt.student_id == student_id)
+            )
+        statement = statement.where(Test.course_id == course_id).order_by(Test.id)
+        result = await self.session.execute(statement)
+        if student_id is None:
+            return [(test, num_questions, attempt_count, None) for test, num_questions, attempt_count in result.all()]
+        return [tuple(row) for row in result.all()]
+
     async def get_keywords_for_test(self, test_id: int) -> List[Keyword]:
         statement = select(Keyword).join(KeywordTestLink, KeywordTestLink.keyword_id == Keyword.id).where(KeywordTestLink.test_id == test_id)
         result = await self.session.execute(statement)
@@ -338,16 +642,8 @@ class TestRepository:
         test = await self.get_test_by_id(test_id)
         if not test:
             return False
-        # Order matters — none of these FKs have ON DELETE CASCADE.
-        # Answers reference both attempts and questions, so they go first.
-        await self.session.execute(
-            delete(Answer).where(Answer.attempt_id.in_(select(TestAttempt.id).where(TestAttempt.test_id == test_id)))
-        )
-        await self.session.execute(delete(TestAttempt).where(TestAttempt.test_id == test_id))
-        await self.session.execute(delete(KeywordTestLink).where(KeywordTestLink.test_id == test_id))
-        await self.session.execute(delete(UserTestLink).where(UserTestLink.test_id == test_id))
-        await self.session.execute(delete(Question).where(Question.test_id == test_id))
-        await self.session.delete(test)
+        for _, statement in _test_teardown_statements([test_id]):
+            await self.session.execute(statement)
         await self.session.commit()
         return True
 
@@ -364,6 +660,20 @@ class QuestionRepository:
         await self.session.refresh(question)
         return question
 
+    async def create_questions(self, test_id: int, rows: List[dict], commit: bool = True) -> List[Question]:
+        """Inserts all questions of a test with one multi-row INSERT ... RETURNING, in the order of `rows`.
+
+        Each row is a dict of text/correct_answer/choices/type. With commit=False the caller commits.
+        """
+        if not rows:
+            return []
+        statement = insert(Question).returning(Question, sort_by_parameter_order=True)
+        result = await self.session.scalars(statement, [{**row, "test_id": test_id} for row in rows])
+        questions = list(result.all())
+        if commit:
+            await self.session.commit()
+        return questions
+
     async def get_question_by_id(self, question_id: int) -> Optional[Question]:
         statement = select(Question).where(Question.id == question_id)
         result = await self.session.execute(statement)
@@ -393,6 +703,7 @@ class QuestionRepository:
         question = await self.get_question_by_id(question_id)
         if not question:
             return False
+        await self.session.execute(delete(GradingVerdict).where(GradingVerdict.question_id == question_id))
         await self.session.delete(question)
         await self.session.commit()
         return True
@@ -489,6 +800,62 @@ class UserRepository:
         result = await self.session.execute(statement)
         return result.scalars().all()
 
+    async def count_students_in_courses(self, course_ids: List[int]) -> int:
+        """Counts distinct students enrolled in any of course_ids without loading them."""
+        if not course_ids:
+            return 0
+        statement = (
+            select(func.count(func.distinct(UserCourseLink.user_id)))
+            .join(User, User.id == UserCourseLink.user_id)
+            .where(UserCourseLink.course_id.in_(course_ids), User.role == UserRole.STUDENT)
+        )
+        result = await self.session.execute(statement)
+        return result.scalar_one()
+
+    async def count_students_by_course(self, course_ids: List[int]) -> Dict[int, int]:
+        """Maps each of course_ids to its number of enrolled students, in one grouped query."""
+        if not course_ids:
+            return {}
+        statement = (
+            select(UserCourseLink.course_id, func.count(UserCourseLink.user_id))
+            .join(User, User.id == UserCourseLink.user_id)
+            .where(UserCourseLink.course_id.in_(course_ids), User.role == UserRole.STUDENT)
+            .group_by(UserCourseLink.course_id)
+        )
+        result = await self.session.execute(statement)
+        counts = {course_id: 0 for course_id in course_ids}
+        counts.update({course_id: count for course_id, count in result.all()})
+        return counts
+
+    async def get_student_roster(self, course_ids: List[int], prefix: Optional[str] = None, after_id: Optional[int] = None, limit: Optional[int] = None) -> List[Tuple[User, List[str]]]:
+        """Lists students enrolled in any of course_ids, each with the names of those courses, in one query.
+
+        Rows are (student, course_names) ordered by student id; after_id/limit page through them, and
+        prefix keeps students whose name, last name or email starts with it (case-insensitive).
+        """
+        if not course_ids:
+            return []
+        statement = (
+            select(User, func.array_agg(aggregate_order_by(Course.name, Course.id)))
+            .join(UserCourseLink, UserCourseLink.user_id == User.id)
+            .join(Course, Course.id == UserCourseLink.course_id)
+            .where(UserCourseLink.course_id.in_(course_ids), User.role == UserRole.STUDENT)
+            .group_by(User.id)
+            .order_by(User.id)
+        )
+        if prefix:
+            statement = statement.where(or_(
+                User.name.istartswith(prefix, autoescape=True),
+                User.lastname.istartswith(prefix, autoescape=True),
+                User.email.istartswith(prefix, autoescape=True),
+            ))
+        if after_id is not None:
+            statement = statement.where(User.id > after_id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        result = await self.session.execute(statement)
+        return [(user, list(course_names)) for user, course_names in result.all()]
+
     async def get_all_users_taking_test(self, test_id: int) -> List[User]:
         statement = (
             select(User)
@@ -511,9 +878,12 @@ class AttemptRepository:
     def __init__(self, session: Session):
         self.session = session
 
-    async def create_attempt(self, test_id: int, student_id: int) -> TestAttempt:
+    async def create_attempt(self, test_id: int, student_id: int, commit: bool = True) -> TestAttempt:
         attempt = TestAttempt(test_id=test_id, student_id=student_id)
         self.session.add(attempt)
+        if not commit:
+            await self.session.flush()
+            return attempt
         await self.session.commit()
         await self.session.refresh(attempt)
         return attempt
@@ -525,10 +895,22 @@ class AttemptRepository:
         result = await self.session.execute(statement)
         return result.scalars().first()
 
-    async def add_answers(self, attempt_id: int, answers: List[AnswerSubmitDTO]) -> None:
+    async def add_answers(self, attempt_id: int, answers: List[AnswerSubmitDTO], commit: bool = True) -> None:
         for answer in answers:
             self.session.add(Answer(attempt_id=attempt_id, question_id=answer.question_id, answer=answer.answer))
-        await self.session.commit()
+        if commit:
+            await self.session.commit()
+
+    async def mark_graded(self, attempt_id: int, score: float) -> bool:
+        """Moves a GRADING attempt to GRADED without committing; False if it wasn't GRADING anymore."""
+        statement = (
+            update(TestAttempt)
+            .where(TestAttempt.id == attempt_id, TestAttempt.status == AttemptStatus.GRADING)
+            .values(status=AttemptStatus.GRADED, score=score)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        return result.rowcount == 1
 
     async def get_attempt_by_id(self, attempt_id: int) -> Optional[TestAttempt]:
         statement = select(TestAttempt).where(TestAttempt.id == attempt_id)
@@ -545,6 +927,93 @@ class AttemptRepository:
         result = await self.session.execute(statement)
         return result.scalars().all()
 
+    async def get_attempts_with_students(self, test_id: int, sort: str = "id", descending: bool = False, after: Optional[list] = None, limit: Optional[int] = None) -> List[Tuple[TestAttempt, str, object]]:
+        """Lists a test's attempts joined with each student's email, keyset-paginated.
+
+        Rows are (attempt, student_email, sort_value), ordered by (sort key, attempt id). `after` is the
+        [sort_value, attempt_id] of the last row already seen. Ungraded attempts sort as score -1.
+        """
+        sort_key = {
+            "id": TestAttempt.id,
+            "score": func.coalesce(TestAttempt.score, -1.0),
+            "status": TestAttempt.status,
+        }[sort]
+        statement = (
+            select(TestAttempt, User.email, sort_key)
+            .join(User, User.id == TestAttempt.student_id)
+            .where(TestAttempt.test_id == test_id)
+        )
+        position = tuple_(sort_key, TestAttempt.id)
+        if after is not None:
+            statement = statement.where(position < tuple(after) if descending else position > tuple(after))
+        if descending:
+            statement = statement.order_by(sort_key.desc(), TestAttempt.id.desc())
+        else:
+            statement = statement.order_by(sort_key, TestAttempt.id)
+        if limit is not None:
+            statement = statement.limit(limit)
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
+    async def get_score_summary(self, test_id: int) -> dict:
+        """Attempt counts and score aggregates (over graded attempts) for a test, computed in Postgres."""
+        graded = TestAttempt.status == AttemptStatus.GRADED
+        statement = select(
+            func.count(TestAttempt.id),
+            func.count(TestAttempt.id).filter(graded),
+            func.avg(TestAttempt.score).filter(graded),
+            func.percentile_cont(0.5).within_group(TestAttempt.score).filter(graded),
+            func.min(TestAttempt.score).filter(graded),
+            func.max(TestAttempt.score).filter(graded),
+            func.coalesce(func.sum(TestAttempt.score).filter(graded), 0.0),
+        ).where(TestAttempt.test_id == test_id)
+        row = (await self.session.execute(statement)).one()
+        keys = ["attempt_count", "graded_count", "average", "median", "min", "max", "score_sum"]
+        return dict(zip(keys, row))
+
+    async def get_score_counts(self, test_id: int) -> List[Tuple[float, int]]:
+        """(score, graded attempt count) per distinct score of a test, lowest first; the live side of TestScoreBin."""
+        statement = (
+            select(TestAttempt.score, func.count())
+            .where(TestAttempt.test_id == test_id, TestAttempt.status == AttemptStatus.GRADED, TestAttempt.score.is_not(None))
+            .group_by(TestAttempt.score)
+            .order_by(TestAttempt.score)
+        )
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
+    async def get_score_histogram(self, test_id: int, band_edges: List[float]) -> List[int]:
+        """Counts graded scores per band with width_bucket; band i is [edges[i], edges[i+1]), the last is open-ended."""
+        bucket = func.width_bucket(TestAttempt.score, bindparam("edges", band_edges, type_=ARRAY(Float)))
+        statement = (
+            select(bucket, func.count())
+            .where(TestAttempt.test_id == test_id, TestAttempt.status == AttemptStatus.GRADED, TestAttempt.score.is_not(None))
+            .group_by(bucket)
+        )
+        result = await self.session.execute(statement)
+        counts = [0] * len(band_edges)
+        for index, count in result.all():
+            # width_bucket returns 0 for scores below the first edge; those fall outside every band.
+            if index >= 1:
+                counts[index - 1] = count
+        return counts
+
+    async def get_question_stats(self, test_id: int) -> List[Tuple[Question, int, int]]:
+        """Per question of a test: (question, graded answer count, correct answer count), in one grouped query."""
+        statement = (
+            select(
+                Question,
+                func.count(Answer.id).filter(Answer.is_correct.is_not(None)),
+                func.count(Answer.id).filter(Answer.is_correct.is_(True)),
+            )
+            .outerjoin(Answer, Answer.question_id == Question.id)
+            .where(Question.test_id == test_id)
+            .group_by(Question.id)
+            .order_by(Question.id)
+        )
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
     async def get_answers_for_test(self, test_id: int) -> List[Answer]:
         statement = select(Answer).join(TestAttempt, TestAttempt.id == Answer.attempt_id).where(TestAttempt.test_id == test_id)
         result = await self.session.execute(statement)
@@ -554,3 +1023,420 @@ class AttemptRepository:
         statement = select(Answer).where(Answer.id == answer_id)
         result = await self.session.execute(statement)
         return result.scalars().first()
+
+    async def get_graded_answers_for_question(self, question_id: int) -> List[Tuple[Answer, TestAttempt]]:
+        statement = (
+            select(Answer, TestAttempt)
+            .join(TestAttempt, TestAttempt.id == Answer.attempt_id)
+            .where(Answer.question_id == question_id, TestAttempt.status == AttemptStatus.GRADED)
+        )
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
+    async def get_answers_for_attempts(self, attempt_ids: List[int]) -> List[Answer]:
+        statement = select(Answer).where(Answer.attempt_id.in_(attempt_ids))
+        result = await self.session.execute(statement)
+        return result.scalars().all()
+
+class GradingVerdictRepository:
+    """The per-question verdict memo behind grading reuse; writes never commit, they ride the grading transaction."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def get_verdicts(self, keys: List[Tuple[int, str]]) -> Dict[Tuple[int, str], GradingVerdict]:
+        if not keys:
+            return {}
+        statement = select(GradingVerdict).where(tuple_(GradingVerdict.question_id, GradingVerdict.answer_key).in_(keys))
+        result = await self.session.execute(statement)
+        return {(verdict.question_id, verdict.answer_key): verdict for verdict in result.scalars().all()}
+
+    async def remember(self, rows: List[dict]) -> None:
+        """Stores LLM verdicts ({question_id, answer_key, is_correct, feedback}); existing verdicts win."""
+        if not rows:
+            return
+        statement = pg_insert(GradingVerdict).values(rows)
+        await self.session.execute(statement.on_conflict_do_nothing(
+            index_elements=[GradingVerdict.question_id, GradingVerdict.answer_key],
+        ))
+
+    async def override(self, question_id: int, answer_key: str, is_correct: bool, feedback: Optional[str]) -> None:
+        statement = pg_insert(GradingVerdict).values(
+            question_id=question_id, answer_key=answer_key, is_correct=is_correct, feedback=feedback, overridden=True
+        )
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[GradingVerdict.question_id, GradingVerdict.answer_key],
+            set_={
+                "is_correct": statement.excluded.is_correct,
+                "feedback": func.coalesce(statement.excluded.feedback, GradingVerdict.feedback),
+                "overridden": True,
+            },
+        ))
+
+class StatsRollupRepository:
+    """Maintains the per-test and per-question stats rollups.
+
+    The apply_* methods only execute upserts; they never commit, so callers run them in the same
+    transaction as the attempt/answer writes they describe.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def record_attempt_submitted(self, test_id: int) -> None:
+        await self._bump_test(test_id, attempt_count=1)
+
+    async def apply_attempt_change(self, test_id: int, old_status: AttemptStatus, old_score: Optional[float], new_status: AttemptStatus, new_score: Optional[float]) -> None:
+        """Moves an attempt's contribution from its old (status, score) to the new one."""
+        was_graded = old_status == AttemptStatus.GRADED and old_score is not None
+        is_graded = new_status == AttemptStatus.GRADED and new_score is not None
+        if was_graded == is_graded and old_score == new_score:
+            return
+        graded_delta = int(is_graded) - int(was_graded)
+        score_delta = (new_score if is_graded else 0.0) - (old_score if was_graded else 0.0)
+        await self._bump_test(test_id, graded_count=graded_delta, score_sum=score_delta)
+        bins = []
+        if was_graded:
+            bins.append({"test_id": test_id, "score": old_score, "count": -1})
+        if is_graded:
+            bins.append({"test_id": test_id, "score": new_score, "count": 1})
+        # Neither side graded (e.g. an ungraded attempt's score changed): nothing to move between bins.
+        if not bins:
+            return
+        statement = pg_insert(TestScoreBin).values(bins)
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[TestScoreBin.test_id, TestScoreBin.score],
+            set_={"count": TestScoreBin.count + statement.excluded.count},
+        ))
+
+    async def apply_answer_changes(self, test_id: int, changes: List[Tuple[int, Optional[bool], Optional[bool]]]) -> None:
+        """Applies (question_id, old is_correct, new is_correct) transitions as one multi-row upsert."""
+        deltas: Dict[int, List[int]] = {}
+        for question_id, old, new in changes:
+            delta = deltas.setdefault(question_id, [0, 0])
+            delta[0] += int(new is not None) - int(old is not None)
+            delta[1] += int(bool(new)) - int(bool(old))
+        rows = [
+            {"question_id": question_id, "test_id": test_id, "answered_count": answered, "correct_count": correct}
+            for question_id, (answered, correct) in deltas.items()
+            if answered or correct
+        ]
+        if not rows:
+            return
+        statement = pg_insert(QuestionStatsRollup).values(rows)
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[QuestionStatsRollup.question_id],
+            set_={
+                "answered_count": QuestionStatsRollup.answered_count + statement.excluded.answered_count,
+                "correct_count": QuestionStatsRollup.correct_count + statement.excluded.correct_count,
+            },
+        ))
+
+    async def _bump_test(self, test_id: int, attempt_count: int = 0, graded_count: int = 0, score_sum: float = 0.0) -> None:
+        statement = pg_insert(TestStatsRollup).values(
+            test_id=test_id, attempt_count=attempt_count, graded_count=graded_count, score_sum=score_sum
+        )
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[TestStatsRollup.test_id],
+            set_={
+                "attempt_count": TestStatsRollup.attempt_count + statement.excluded.attempt_count,
+                "graded_count": TestStatsRollup.graded_count + statement.excluded.graded_count,
+                "score_sum": TestStatsRollup.score_sum + statement.excluded.score_sum,
+            },
+        ))
+
+    async def get_test_rollup(self, test_id: int) -> Optional[TestStatsRollup]:
+        statement = select(TestStatsRollup).where(TestStatsRollup.test_id == test_id)
+        result = await self.session.execute(statement)
+        return result.scalars().first()
+
+    async def get_score_bins(self, test_id: int) -> List[Tuple[float, int]]:
+        statement = (
+            select(TestScoreBin.score, TestScoreBin.count)
+            .where(TestScoreBin.test_id == test_id, TestScoreBin.count > 0)
+            .order_by(TestScoreBin.score)
+        )
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
+    async def get_question_rollups(self, test_id: int) -> List[Tuple[Question, int, int]]:
+        """Per question of a test: (question, answered count, correct count); questions with no rollup row read as zeros."""
+        statement = (
+            select(
+                Question,
+                func.coalesce(QuestionStatsRollup.answered_count, 0),
+                func.coalesce(QuestionStatsRollup.correct_count, 0),
+            )
+            .outerjoin(QuestionStatsRollup, QuestionStatsRollup.question_id == Question.id)
+            .where(Question.test_id == test_id)
+            .order_by(Question.id)
+        )
+        result = await self.session.execute(statement)
+        return [tuple(row) for row in result.all()]
+
+    async def needs_backfill(self) -> bool:
+        """True when attempts exist but no rollups do, i.e. a database from before the rollup tables."""
+        has_rollups = await self.session.execute(select(TestStatsRollup.test_id).limit(1))
+        if has_rollups.first() is not None:
+            return False
+        has_attempts = await self.session.execute(select(TestAttempt.id).limit(1))
+        return has_attempts.first() is not None
+
+    async def rebuild(self, test_ids: Optional[List[int]] = None) -> None:
+        """Recomputes the rollups of the given tests (all tests if None) from the base tables, in one transaction."""
+        def scoped(statement, column):
+            return statement.where(column.in_(test_ids)) if test_ids is not None else statement
+
+        await self.session.execute(scoped(delete(QuestionStatsRollup), QuestionStatsRollup.test_id))
+        await self.session.execute(scoped(delete(TestScoreBin), TestScoreBin.test_id))
+        await self.session.execute(scoped(delete(TestStatsRollup), TestStatsRollup.test_id))
+
+        graded = (TestAttempt.status == AttemptStatus.GRADED) & TestAttempt.score.is_not(None)
+        tests = scoped(
+            select(
+                TestAttempt.test_id,
+                func.count(TestAttempt.id),
+                func.count(TestAttempt.id).filter(graded),
+                func.coalesce(func.sum(TestAttempt.score).filter(graded), 0.0),
+            ).where(TestAttempt.test_id.is_not(None)),
+            TestAttempt.test_id,
+        ).group_by(TestAttempt.test_id)
+        await self.session.execute(insert(TestStatsRollup).from_select(
+            ["test_id", "attempt_count", "graded_count", "score_sum"], tests
+        ))
+
+        bins = scoped(
+            select(TestAttempt.test_id, TestAttempt.score, func.count()).where(graded, TestAttempt.test_id.is_not(None)),
+            TestAttempt.test_id,
+        ).group_by(TestAttempt.test_id, TestAttempt.score)
+        await self.session.execute(insert(TestScoreBin).from_select(["test_id", "score", "count"], bins))
+
+        questions = scoped(
+            select(
+                Question.id,
+                Question.test_id,
+                func.count(Answer.id).filter(Answer.is_correct.is_not(None)),
+                func.count(Answer.id).filter(Answer.is_correct.is_(True)),
+            )
+            .outerjoin(Answer, Answer.question_id == Question.id)
+            .where(Question.test_id.is_not(None)),
+            Question.test_id,
+        ).group_by(Question.id)
+        await self.session.execute(insert(QuestionStatsRollup).from_select(
+            ["question_id", "test_id", "answered_count", "correct_count"], questions
+        ))
+        await self.session.commit()
+
+class SessionTokenRepository:
+    """Storage for the Postgres token store: one active token per subject, with its expiry."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def set_token(self, subject: str, token: str, expires_at: datetime) -> None:
+        statement = pg_insert(SessionToken).values(subject=subject, token=token, expires_at=expires_at)
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[SessionToken.subject],
+            set_={"token": statement.excluded.token, "expires_at": statement.excluded.expires_at},
+        ))
+        # Logins are rare next to lookups; they also sweep out whatever has expired.
+        await self.session.execute(delete(SessionToken).where(SessionToken.expires_at < func.now()))
+        await self.session.commit()
+
+    async def get_token(self, subject: str) -> Optional[str]:
+        statement = select(SessionToken.token).where(SessionToken.subject == subject, SessionToken.expires_at > func.now())
+        result = await self.session.execute(statement)
+        return result.scalars().first()
+
+    async def delete_token(self, subject: str) -> None:
+        await self.session.execute(delete(SessionToken).where(SessionToken.subject == subject))
+        await self.session.commit()
+
+class LLMCacheRepository:
+    """Storage for the Postgres backend of the LLM response cache."""
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def get_response(self, key: str, not_before: datetime) -> Optional[str]:
+        statement = select(LLMCacheEntry.response).where(LLMCacheEntry.key == key, LLMCacheEntry.created_at >= not_before)
+        result = await self.session.execute(statement)
+        return result.scalars().first()
+
+    async def put_response(self, key: str, model: str, prompt: str, response: str, created_at: datetime) -> None:
+        statement = pg_insert(LLMCacheEntry).values(key=key, model=model, prompt=prompt, response=response, created_at=created_at)
+        await self.session.execute(statement.on_conflict_do_update(
+            index_elements=[LLMCacheEntry.key],
+            set_={"response": statement.excluded.response, "created_at": statement.excluded.created_at},
+        ))
+        await self.session.commit()
+
+    async def evict(self, not_before: datetime, max_entries: int) -> None:
+        """Drops expired entries, then the oldest ones beyond `max_entries`."""
+        await self.session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.created_at < not_before))
+        newest = aliased(LLMCacheEntry)
+        overflow = select(newest.key).order_by(newest.created_at.desc()).offset(max_entries)
+        await self.session.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(overflow)))
+        await self.session.commit()
+
+class JobRepository:
+    """The durable job queue drained by worker.py.
+
+    Workers claim jobs with FOR UPDATE SKIP LOCKED, so any number of them can poll the same table
+    without handing a job to two of them. A claim holds the job for a visibility timeout; a job still
+    RUNNING after that is claimable again. Methods that change a claimed job take the `attempts` value
+    returned by the claim and do nothing if the job has since been claimed again.
+    """
+
+    LIVE_STATES = (JobState.QUEUED, JobState.RUNNING)
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    async def enqueue(self, kind: JobKind, payload: dict, dedupe_key: Optional[str] = None, max_attempts: int = 5, commit: bool = True) -> Optional[int]:
+        """Queues a job and returns its id; a no-op returning None if a live job with the same `dedupe_key` already exists."""
+        statement = pg_insert(Job).values(kind=kind.value, payload=payload, dedupe_key=dedupe_key, max_attempts=max_attempts)
+        result = await self.session.execute(statement.on_conflict_do_nothing(
+            index_elements=[Job.dedupe_key],
+            index_where=Job.state.in_(self.LIVE_STATES),
+        ).returning(Job.id))
+        job_id = result.scalar_one_or_none()
+        if commit:
+            await self.session.commit()
+        return job_id
+
+    async def get_job(self, job_id: int) -> Optional[Job]:
+        statement = select(Job).where(Job.id == job_id)
+        result = await self.session.execute(statement)
+        return result.scalars().first()
+
+    async def get_live_job(self, dedupe_key: str) -> Optional[Job]:
+        statement = select(Job).where(Job.dedupe_key == dedupe_key, Job.state.in_(self.LIVE_STATES))
+        result = await self.session.execute(statement)
+        return result.scalars().first()
+
+    async def claim(self, kinds: List[str], limit: int, visibility_timeout: float) -> List[Job]:
+        candidate = aliased(Job)
+        claimable = (
+            select(candidate.id)
+            .where(candidate.kind.in_(kinds))
+            .where(or_(
+                and_(candidate.state == JobState.QUEUED, candidate.run_after <= func.now()),
+                and_(candidate.state == JobState.RUNNING, candidate.locked_until < func.now(), candidate.attempts < candidate.max_attempts),
+            ))
+            .order_by(candidate.run_after)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        statement = (
+            update(Job)
+            .where(Job.id.in_(claimable))
+            .values(state=JobState.RUNNING, attempts=Job.attempts + 1, locked_until=func.now() + timedelta(seconds=visibility_timeout))
+            .returning(Job)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        jobs = list(result.scalars().all())
+        await self.session.commit()
+        return jobs
+
+    async def extend_claim(self, job_id: int, attempt: int, visibility_timeout: float) -> bool:
+        """Pushes a running job's claim out by another `visibility_timeout`; False if the claim was lost."""
+        statement = (
+            update(Job)
+            .where(Job.id == job_id, Job.attempts == attempt, Job.state == JobState.RUNNING)
+            .values(locked_until=func.now() + timedelta(seconds=visibility_timeout))
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def report_progress(self, job_id: int, attempt: int, step: str, completed: int, total: int) -> bool:
+        """Records how far a running job has got; False if the claim was lost."""
+        statement = (
+            update(Job)
+            .where(Job.id == job_id, Job.attempts == attempt, Job.state == JobState.RUNNING)
+            .values(current_step=step, completed_steps=completed, total_steps=total)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def complete(self, job_id: int, attempt: int) -> bool:
+        return await self._finish(job_id, attempt, state=JobState.DONE, locked_until=None, last_error=None)
+
+    async def retry(self, job_id: int, attempt: int, error: str, delay: float) -> bool:
+        return await self._finish(
+            job_id, attempt, state=JobState.QUEUED, locked_until=None, last_error=error,
+            run_after=func.now() + timedelta(seconds=delay),
+        )
+
+    async def fail(self, job_id: int, attempt: int, error: str) -> bool:
+        return await self._finish(job_id, attempt, state=JobState.FAILED, locked_until=None, last_error=error)
+
+    async def _finish(self, job_id: int, attempt: int, **values) -> bool:
+        statement = (
+            update(Job)
+            .where(Job.id == job_id, Job.attempts == attempt, Job.state == JobState.RUNNING)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        await self.session.commit()
+        return result.rowcount == 1
+
+    async def fail_expired(self) -> int:
+        """Fails RUNNING jobs whose visibility timeout passed on their last allowed attempt."""
+        statement = (
+            update(Job)
+            .where(Job.state == JobState.RUNNING, Job.locked_until < func.now(), Job.attempts >= Job.max_attempts)
+            .values(state=JobState.FAILED, locked_until=None, last_error="Visibility timeout expired on the last attempt")
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.session.execute(statement)
+        await self.session.commit()
+        return result.rowcount
+
+    async def enqueue_orphaned_gradings(self, max_attempts: int) -> int:
+        """Queues a grading job for every GRADING attempt that never had one.
+
+        Covers attempts submitted before the queue existed, or left behind by anything that bypassed
+        it. Attempts whose job FAILED are left alone (see requeue_failed), so a permanently broken
+        attempt isn't retried on every sweep.
+        """
+        dedupe_key = literal(f"{JobKind.GRADE_ATTEMPT.value}:") + cast(TestAttempt.id, String)
+        has_job = exists().where(Job.dedupe_key == dedupe_key)
+        orphans = select(
+            literal(JobKind.GRADE_ATTEMPT.value),
+            func.jsonb_build_object("attempt_id", TestAttempt.id),
+            dedupe_key,
+            literal(max_attempts),
+        ).where(TestAttempt.status == AttemptStatus.GRADING, ~has_job)
+        statement = pg_insert(Job).from_select(["kind", "payload", "dedupe_key", "max_attempts"], orphans)
+        result = await self.session.execute(statement.on_conflict_do_nothing(
+            index_elements=[Job.dedupe_key],
+            index_where=Job.state.in_(self.LIVE_STATES),
+        ))
+        await self.session.commit()
+        return result.rowcount
+
+    async def requeue_failed(self, kinds: Optional[List[str]] = None) -> int:
+        """Puts FAILED jobs back in the queue with a fresh attempt budget."""
+        statement = (
+            update(Job)
+            .where(Job.state == JobState.FAILED)
+            .values(state=JobState.QUEUED, attempts=0, run_after=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        if kinds:
+            statement = statement.where(Job.kind.in_(kinds))
+        result = await self.session.execute(statement)
+        await self.session.commit()
+        return result.rowcount
+
+    async def count_by_state(self) -> Dict[str, int]:
+        statement = select(Job.state, func.count()).group_by(Job.state)
+        result = await self.session.execute(statement)
+        return {state.value: count for state, count in result.all()}
@@ -1,5 +1,5 @@
 from sqlmodel import select
-from model.database import session
+from model.database import async_session_maker
 from model.user import User, UserRole, UserCourseLink
 from model.course import Course
 from model.keyword import Keyword, KeywordHierarchy
@@ -7,7 +7,7 @@ from model.keyword import Keyword, KeywordHierarchy
 
 async def seed_if_empty() -> None:
     """Populate the database with sample data for testing, only if it has no users yet."""
-    async with session() as s:
+    async with async_session_maker() as s:
         if (await s.execute(select(User))).scalars().first():
             return
 
@@ -1,31 +1,23 @@
 from fastapi import HTTPException
-from typing import List, Optional
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from repositories import CourseRepository, KeywordRepository, TestRepository, UserRepository
-from dtos.course_dtos import CourseSummaryDTO
+from typing import Awaitable, Callable, List, Optional
+from repositories import CourseRepository, JobRepository, UserRepository
+from model.database import async_session_maker
+from dtos.course_dtos import CourseSummaryDTO, GradingThresholdsDTO
+from dtos.job_dtos import JobProgressDTO
+from dtos.user_dtos import Principal
+from job_progress import to_progress_dto
+from job_queue import enqueue_course_deletion
+from model.job import Job
 from model.course import Course, CourseMaterial
 from model.user import User, UserCourseLink
-from sqlalchemy.orm import sessionmaker
-import os
-from dotenv import load_dotenv
+from pregrader import thresholds_for
 
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
-
-async def create_course(name: str, email: str) -> Course:
+async def create_course(name: str, principal: Principal) -> Course:
     async with async_session_maker() as session:
-        repo = UserRepository(session)
-        existing_user = await repo.get_user_by_email(email)
         course_repo = CourseRepository(session)
         course = await course_repo.create_course(name)
         user_repo = UserRepository(session)
-        await user_repo.add_course_to_user(existing_user.id, course.id)
+        await user_repo.add_course_to_user(principal.id, course.id)
         return course
 
 def _to_course_summary(course: Course, student_count: int) -> CourseSummaryDTO:
@@ -43,19 +35,15 @@ async def get_course(course_id: int) -> Optional[CourseSummaryDTO]:
         course = await course_repo.get_course_by_id(course_id)
         if not course:
             return None
-        students = await user_repo.get_students_in_courses([course.id])
-        return _to_course_summary(course, len(students))
+        student_count = await user_repo.count_students_in_courses([course.id])
+        return _to_course_summary(course, student_count)
 
-async def get_courses_for_user(email: str) -> List[CourseSummaryDTO]:
+async def get_courses_for_user(principal: Principal) -> List[CourseSummaryDTO]:
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
-        user = await user_repo.get_user_by_email(email)
-        courses = await user_repo.get_all_courses_user_takes(user.id)
-        summaries = []
-        for course in courses:
-            students = await user_repo.get_students_in_courses([course.id])
-            summaries.append(_to_course_summary(course, len(students)))
-        return summaries
+        courses = await user_repo.get_all_courses_user_takes(principal.id)
+        student_counts = await user_repo.count_students_by_course([course.id for course in courses])
+        return [_to_course_summary(course, student_counts[course.id]) for course in courses]
 
 async def get_all_materials_for_course(course_id: int) -> List[CourseMaterial]:
     async with async_session_maker() as session:
@@ -65,17 +53,46 @@ async def get_all_materials_for_course(course_id: int) -> List[CourseMaterial]:
             raise HTTPException(status_code=404, detail="Materials not found")
         return materials
 
-async def signup_to_course(email: str, course_id: int):
+async def signup_to_course(principal: Principal, course_id: int):
     async with async_session_maker() as session:
         repo = UserRepository(session)
-        existing_user = await repo.get_user_by_email(email)
-        await repo.add_course_to_user(existing_user.id, course_id)
+        await repo.add_course_to_user(principal.id, course_id)
 
-async def remove_from_course(email: str, course_id: int):
+async def remove_from_course(principal: Principal, course_id: int):
     async with async_session_maker() as session:
         repo = UserRepository(session)
-        existing_user = await repo.get_user_by_email(email)
-        await repo.remove_course_from_user(existing_user.id, course_id)
+        await repo.remove_course_from_user(principal.id, course_id)
+
+async def _get_taught_course(session, course_id: int, principal: Principal) -> Course:
+    course = await CourseRepository(session).get_course_by_id(course_id)
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    if not await UserRepository(session).is_enrolled(principal.id, course_id):
+        raise HTTPException(status_code=403, detail="Not a professor of this course")
+    return course
+
+def _to_thresholds_dto(course: Course) -> GradingThresholdsDTO:
+    pass_threshold, fail_threshold = thresholds_for(course)
+    return GradingThresholdsDTO(pass_threshold=pass_threshold, fail_threshold=fail_threshold)
+
+async def get_grading_thresholds(course_id: int, principal: Principal) -> GradingThresholdsDTO:
+    async with async_session_maker() as session:
+        return _to_thresholds_dto(await _get_taught_course(session, course_id, principal))
+
+async def set_grading_thresholds(course_id: int, principal: Principal, data: GradingThresholdsDTO) -> GradingThresholdsDTO:
+    """Sets the course's pre-grading thresholds and returns the effective ones (defaults filled in)."""
+    if any(value is not None and not 0 <= value <= 1 for value in (data.pass_threshold, data.fail_threshold)):
+        raise HTTPException(status_code=400, detail="Thresholds must be between 0 and 1")
+    async with async_session_maker() as session:
+        course = await _get_taught_course(session, course_id, principal)
+        course.pregrade_pass_threshold = data.pass_threshold
+        course.pregrade_fail_threshold = data.fail_threshold
+        pass_threshold, fail_threshold = thresholds_for(course)
+        if fail_threshold > pass_threshold:
+            raise HTTPException(status_code=400, detail="The fail threshold can't be above the pass threshold")
+        session.add(course)
+        await session.commit()
+        return _to_thresholds_dto(course)
 
 async def get_material(material_id: int) -> CourseMaterial:
     async with async_session_maker() as session:
@@ -83,27 +100,31 @@ async def get_material(material_id: int) -> CourseMaterial:
         material = await course_repo.get_course_material_by_id(material_id)
         return material
 
-async def delete_course_from_db(course_id: int) -> bool:
+async def delete_course_from_db(course_id: int, on_progress: Optional[Callable[[str, int, int], Awaitable[None]]] = None) -> bool:
     async with async_session_maker() as session:
         course_repo = CourseRepository(session)
-        test_repo = TestRepository(session)
-        keyword_repo = KeywordRepository(session)
 
         course = await course_repo.get_course_by_id(course_id)
         if not course:
             return False
 
-        # Tests first — reuses the tested delete_test cascade (questions, links, attempts, answers).
-        for test in await course_repo.get_all_tests_for_course(course_id):
-            await test_repo.delete_test(test.id)
+        # Tests, materials and the keyword tree go in a fixed number of set-based statements, one transaction.
+        return await course_repo.delete_course(course_id, course.keyword_hierarchy_id, on_progress=on_progress)
 
-        # Collect every keyword in the hierarchy (root + descendants via the parent tree).
-        hierarchy_id = course.keyword_hierarchy_id
-        keyword_ids: List[int] = []
-        if hierarchy_id:
-            hierarchy = await keyword_repo.get_hierarchy_by_id(hierarchy_id)
-            if hierarchy and hierarchy.root_id:
-                descendants = await keyword_repo.get_all_descendant_keywords(hierarchy.root_id)
-                keyword_ids = [hierarchy.root_id] + [k.id for k in descendants]
-
-        return await course_repo.delete_course(course_id, hierarchy_id, keyword_ids)
\ No newline at end of file
+async def start_course_deletion(course_id: int) -> Optional[JobProgressDTO]:
+    """Queues the course's deletion for worker.py; poll the returned job through GET /jobs/{id}."""
+    async with async_session_maker() as session:
+        if not await CourseRepository(session).get_course_by_id(course_id):
+            return None
+        job = await enqueue_course_deletion(JobRepository(session), course_id)
+    return to_progress_dto(job) if job else None
+
+async def run_course_deletion(job: Job) -> None:
+    """Worker handler for a queued course deletion; records each step on the job row."""
+    async def on_progress(step: str, completed: int, total: int) -> None:
+        # Its own session: the deletion's transaction only commits at the end.
+        async with async_session_maker() as session:
+            await JobRepository(session).report_progress(job.id, job.attempts, step, completed, total)
+
+    # A retry after a run that did commit finds the course already gone, which is the outcome wanted.
+    await delete_course_from_db(job.payload["course_id"], on_progress=on_progress)
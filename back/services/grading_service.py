@@ -1,27 +1,76 @@
 import asyncio
+import bisect
+import hashlib
+import json
 import os
-import statistics
-from typing import List
-from dotenv import load_dotenv
+import unicodedata
+from typing import List, Optional, Tuple
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
 
-from dtos.attempt_dtos import AttemptDetailDTO, AttemptListItemDTO, GradeOverrideDTO, QuestionResultDTO, TestAttemptsDTO
+from dtos.attempt_dtos import AttemptDetailDTO, AttemptListItemDTO, AttemptSortField, GradeOverrideDTO, QuestionResultDTO, TestAttemptsDTO
 from dtos.stats_dtos import QuestionStatDTO, ScoreBucketDTO, TestStatsDTO
-from model.attempt import AttemptStatus
+from dtos.user_dtos import Principal
+from model.attempt import AttemptStatus, GradedBy
 from model.question import Question, QuestionType
-from repositories import AttemptRepository, QuestionRepository, TestRepository, UserRepository
-from query_llm import grade_open_answer
+from repositories import AttemptRepository, CourseRepository, GradingVerdictRepository, QuestionRepository, StatsRollupRepository, TestRepository, UserRepository
+from model.database import async_session_maker
+from pagination import decode_cursor, encode_cursor, is_int, is_number
+from pregrader import PREGRADE, pregrade, thresholds_for
+from query_llm import grade_open_answer, grade_open_answers_batch
 
-load_dotenv()
+# Lower edges of the score bands in the stats distribution; the last band runs up to 100%.
+DEFAULT_SCORE_BANDS = [float(edge) for edge in os.getenv("STATS_SCORE_BANDS", "0,50,70").split(",")]
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Open answers sent to the LLM in one grading request; 1 grades every answer with its own call.
+GRADING_BATCH_SIZE = max(1, int(os.getenv("GRADING_BATCH_SIZE", "5")))
+# Grading LLM requests in flight at once, shared by every attempt this worker is grading.
+GRADING_CONCURRENCY = max(1, int(os.getenv("GRADING_CONCURRENCY", "8")))
+_grading_slots = asyncio.Semaphore(GRADING_CONCURRENCY)
 
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+def normalize_answer(text: str) -> str:
+    """Folds case, punctuation and whitespace, so answers differing only in those grade the same."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(char for char in text if not unicodedata.category(char).startswith("P"))
+    return " ".join(text.split())
+
+def _verdict_key(question: Question, answer: str) -> str:
+    """Memo key of an answer; includes the question's wording so an edited question gets fresh verdicts."""
+    payload = json.dumps([question.text, question.correct_answer, normalize_answer(answer)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _validate_band_edges(edges: List[float]) -> List[float]:
+    if any(edge < 0 or edge >= 100 for edge in edges) or any(b <= a for a, b in zip(edges, edges[1:])):
+        raise HTTPException(status_code=400, detail="Score bands must be increasing values in [0, 100)")
+    return edges
+
+def _band_label(edges: List[float], index: int) -> str:
+    upper = edges[index + 1] if index + 1 < len(edges) else 100
+    return f"{edges[index]:g}–{upper:g}%"
+
+def _median_from_bins(bins: List[Tuple[float, int]], total: int) -> Optional[float]:
+    """Median (interpolated like percentile_cont(0.5)) of a sorted (score, count) histogram."""
+    if not total:
+        return None
+    lower_rank, upper_rank = (total - 1) // 2, total // 2
+    lower = upper = None
+    seen = 0
+    for score, count in bins:
+        if lower is None and lower_rank < seen + count:
+            lower = score
+        if upper_rank < seen + count:
+            upper = score
+            break
+        seen += count
+    return (lower + upper) / 2
+
+def _band_counts(bins: List[Tuple[float, int]], edges: List[float]) -> List[int]:
+    # Same bucketing as width_bucket: band i is [edges[i], edges[i+1]), the last band is open-ended.
+    counts = [0] * len(edges)
+    for score, count in bins:
+        index = bisect.bisect_right(edges, score) - 1
+        if index >= 0:
+            counts[index] += count
+    return counts
 
 def _to_attempt_detail_dto(attempt, answers, questions: List[Question]) -> AttemptDetailDTO:
     answers_by_question = {answer.question_id: answer for answer in answers}
@@ -37,6 +86,8 @@ def _to_attempt_detail_dto(attempt, answers, questions: List[Question]) -> Attem
             correct_answer=question.correct_answer,
             is_correct=answer.is_correct if answer else None,
             feedback=answer.feedback if answer else None,
+            graded_by=answer.graded_by if answer else None,
+            lexical_score=answer.lexical_score if answer else None,
         ))
     graded = attempt.status == AttemptStatus.GRADED
     correct_count = sum(1 for answer in answers if answer.is_correct) if graded else None
@@ -50,68 +101,157 @@ def _to_attempt_detail_dto(attempt, answers, questions: List[Question]) -> Attem
         results=results,
     )
 
+async def _grade_chunk(chunk: List[Tuple[str, str, str]]) -> List[Optional[dict]]:
+    verdicts: List[Optional[dict]] = [None] * len(chunk)
+    if len(chunk) > 1:
+        try:
+            async with _grading_slots:
+                verdicts = await grade_open_answers_batch(chunk)
+        except Exception:
+            pass
+
+    async def grade_alone(item: Tuple[str, str, str]) -> Optional[dict]:
+        # Failures stay per answer: one bad call never affects the others.
+        try:
+            async with _grading_slots:
+                return await grade_open_answer(*item)
+        except Exception:
+            return None
+
+    missing = [index for index, verdict in enumerate(verdicts) if verdict is None]
+    for index, verdict in zip(missing, await asyncio.gather(*(grade_alone(chunk[index]) for index in missing))):
+        verdicts[index] = verdict
+    return verdicts
+
+async def grade_open_answers(items: List[Tuple[str, str, str]], batch_size: Optional[int] = None) -> List[Optional[dict]]:
+    """Verdicts for (question, definition, answer) triples, or None where grading failed.
+
+    Items go out `batch_size` (default GRADING_BATCH_SIZE) per request; any item a batch couldn't
+    grade is retried alone. All requests run concurrently, bounded by the worker-wide grading slots.
+    """
+    batch_size = batch_size or GRADING_BATCH_SIZE
+    chunks = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    results = await asyncio.gather(*(_grade_chunk(chunk) for chunk in chunks))
+    return [verdict for chunk_verdicts in results for verdict in chunk_verdicts]
+
 async def grade_attempt(attempt_id: int) -> None:
     async with async_session_maker() as session:
         attempt_repo = AttemptRepository(session)
         question_repo = QuestionRepository(session)
 
         attempt = await attempt_repo.get_attempt_by_id(attempt_id)
-        if not attempt:
+        # Already graded: a job re-run after its worker finished but died before marking it done.
+        if not attempt or attempt.status == AttemptStatus.GRADED:
             return
 
         answers = await attempt_repo.get_answers_for_attempt(attempt_id)
         questions = await question_repo.get_questions_for_test(attempt.test_id)
         questions_by_id = {question.id: question for question in questions}
+        old_status, old_score = attempt.status, attempt.score
+        old_verdicts = {answer.id: answer.is_correct for answer in answers}
 
-        correct = 0
+        # Verdicts are collected as answer id -> (is_correct, feedback, graded_by, lexical_score) and only
+        # written once this run has claimed the attempt (see mark_graded below).
+        results = {}
+        open_answers = []
         for answer in answers:
             question = questions_by_id.get(answer.question_id)
             if not question:
                 continue
             if question.type == QuestionType.MATCHING:
-                answer.is_correct = answer.answer.strip().casefold() == question.correct_answer.strip().casefold()
-                answer.feedback = None
+                is_correct = answer.answer.strip().casefold() == question.correct_answer.strip().casefold()
+                results[answer.id] = (is_correct, None, GradedBy.EXACT_MATCH, None)
+            else:
+                open_answers.append((answer, question))
+
+        # Open answers are decided by the first stage that can: a verdict already given for an identical
+        # (normalized) answer, then the lexical pre-grader for clear passes and fails, then the LLM.
+        items = [(question.text, question.correct_answer, answer.answer) for answer, question in open_answers]
+        verdicts: List[Optional[dict]] = [None] * len(open_answers)
+        graded_by: List[Optional[GradedBy]] = [None] * len(open_answers)
+        lexical: List[Optional[float]] = [None] * len(open_answers)
+
+        verdict_repo = GradingVerdictRepository(session)
+        keys = [(question.id, _verdict_key(question, answer.answer)) for answer, question in open_answers]
+        memo = await verdict_repo.get_verdicts(keys)
+        for index, key in enumerate(keys):
+            if key in memo:
+                verdicts[index] = {"correct": memo[key].is_correct, "feedback": memo[key].feedback}
+                graded_by[index] = GradedBy.MEMO
+        unseen = [index for index, key in enumerate(keys) if key not in memo]
+
+        if PREGRADE and unseen:
+            test = await TestRepository(session).get_test_by_id(attempt.test_id)
+            course = await CourseRepository(session).get_course_by_id(test.course_id)
+            pass_threshold, fail_threshold = thresholds_for(course)
+            corpus = [question.correct_answer for question in questions if question.type != QuestionType.MATCHING]
+            for index, (verdict, score) in zip(unseen, pregrade([items[index] for index in unseen], pass_threshold, fail_threshold, corpus)):
+                lexical[index] = score
+                if verdict is not None:
+                    verdicts[index] = verdict
+                    graded_by[index] = GradedBy.LEXICAL
+
+        uncertain = [index for index in unseen if verdicts[index] is None]
+        fresh = await grade_open_answers([items[index] for index in uncertain])
+        for index, verdict in zip(uncertain, fresh):
+            if verdict is not None:
+                verdicts[index] = verdict
+                graded_by[index] = GradedBy.LLM
+        # Only LLM verdicts are memoized; local ones are cheap to redo and follow threshold changes.
+        await verdict_repo.remember([
+            {"question_id": keys[index][0], "answer_key": keys[index][1], "is_correct": verdict["correct"], "feedback": verdict["feedback"]}
+            for index, verdict in zip(uncertain, fresh)
+            if verdict is not None
+        ])
+
+        for (answer, _), verdict, source, score in zip(open_answers, verdicts, graded_by, lexical):
+            if verdict is not None:
+                results[answer.id] = (verdict["correct"], verdict["feedback"], source, score)
             else:
-                try:
-                    result = await asyncio.to_thread(
-                        grade_open_answer, question.text, question.correct_answer, answer.answer
-                    )
-                    answer.is_correct = result["correct"]
-                    answer.feedback = result["feedback"]
-                except Exception:
-                    answer.is_correct = None
-                    answer.feedback = "Automatic grading unavailable"
-            if answer.is_correct:
-                correct += 1
-            session.add(answer)
+                results[answer.id] = (None, "Automatic grading unavailable", None, score)
 
         total = len(questions)
-        attempt.score = round(correct / total * 100, 1) if total else 0.0
-        attempt.status = AttemptStatus.GRADED
-        session.add(attempt)
+        correct = sum(1 for is_correct, _, _, _ in results.values() if is_correct)
+        score = round(correct / total * 100, 1) if total else 0.0
+        # A job whose claim expired can be running twice. Only the run that moves the attempt out of
+        # GRADING writes answers and rollup deltas; the other blocks on the row lock, then sees 0 rows.
+        if not await attempt_repo.mark_graded(attempt_id, score):
+            await session.rollback()
+            return
+
+        for answer in answers:
+            if answer.id in results:
+                answer.is_correct, answer.feedback, source, answer.lexical_score = results[answer.id]
+                answer.graded_by = source.value if source else None
+                session.add(answer)
+
+        rollups = StatsRollupRepository(session)
+        await rollups.apply_attempt_change(attempt.test_id, old_status, old_score, AttemptStatus.GRADED, score)
+        await rollups.apply_answer_changes(
+            attempt.test_id,
+            [(answer.question_id, old_verdicts[answer.id], answer.is_correct) for answer in answers],
+        )
         await session.commit()
 
-async def get_attempt_result(attempt_id: int, requester_email: str) -> AttemptDetailDTO:
+async def get_attempt_result(attempt_id: int, principal: Principal) -> AttemptDetailDTO:
     async with async_session_maker() as session:
         attempt_repo = AttemptRepository(session)
         question_repo = QuestionRepository(session)
         test_repo = TestRepository(session)
-        user_repo = UserRepository(session)
 
         attempt = await attempt_repo.get_attempt_by_id(attempt_id)
         if not attempt:
             raise HTTPException(status_code=404, detail="Attempt not found")
 
-        requester = await user_repo.get_user_by_email(requester_email)
         test = await test_repo.get_test_by_id(attempt.test_id)
-        if requester.id != attempt.student_id and requester.id != test.creator_id:
+        if principal.id != attempt.student_id and principal.id != test.creator_id:
             raise HTTPException(status_code=403, detail="Not allowed to view this attempt")
 
         answers = await attempt_repo.get_answers_for_attempt(attempt_id)
         questions = await question_repo.get_questions_for_test(attempt.test_id)
         return _to_attempt_detail_dto(attempt, answers, questions)
 
-async def get_test_attempts(test_id: int, professor_email: str) -> TestAttemptsDTO:
+async def get_test_attempts(test_id: int, principal: Principal, sort: AttemptSortField = AttemptSortField.ID, descending: bool = False, limit: Optional[int] = None, cursor: Optional[str] = None) -> TestAttemptsDTO:
     async with async_session_maker() as session:
         attempt_repo = AttemptRepository(session)
         test_repo = TestRepository(session)
@@ -120,78 +260,78 @@ async def get_test_attempts(test_id: int, professor_email: str) -> TestAttemptsD
         test = await test_repo.get_test_by_id(test_id)
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
-        professor = await user_repo.get_user_by_email(professor_email)
-        if test.creator_id != professor.id:
+        if test.creator_id != principal.id:
             raise HTTPException(status_code=403, detail="Not the creator of this test")
 
-        enrolled_count = len(await user_repo.get_students_in_courses([test.course_id]))
-        attempts = await attempt_repo.get_attempts_for_test(test_id)
-        items = []
-        for attempt in attempts:
-            student = await user_repo.get_user_by_id(attempt.student_id)
-            items.append(AttemptListItemDTO(
-                attempt_id=attempt.id,
-                student_email=student.email,
-                status=attempt.status,
-                score=attempt.score,
-            ))
-        return TestAttemptsDTO(enrolled_count=enrolled_count, attempts=items)
-
-async def get_test_stats(test_id: int, professor_email: str) -> TestStatsDTO:
+        enrolled_count = await user_repo.count_students_in_courses([test.course_id])
+        # [sort value, attempt id]; the sort value's type follows the sort field.
+        sort_value_check = {
+            AttemptSortField.ID: is_int,
+            AttemptSortField.SCORE: is_number,
+            AttemptSortField.STATUS: lambda value: value in {status.value for status in AttemptStatus},
+        }[sort]
+        after = decode_cursor(cursor, shape=[sort_value_check, is_int]) if cursor else None
+        # One extra row tells us whether another page follows.
+        rows = await attempt_repo.get_attempts_with_students(
+            test_id, sort=sort.value, descending=descending, after=after, limit=limit + 1 if limit else None
+        )
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            last_attempt, _, last_sort_value = rows[-1]
+            next_cursor = encode_cursor([last_sort_value, last_attempt.id])
+
+        items = [
+            AttemptListItemDTO(attempt_id=attempt.id, student_email=email, status=attempt.status, score=attempt.score)
+            for attempt, email, _ in rows
+        ]
+        return TestAttemptsDTO(enrolled_count=enrolled_count, attempts=items, next_cursor=next_cursor)
+
+async def get_test_stats(test_id: int, principal: Principal, bands: Optional[List[float]] = None) -> TestStatsDTO:
+    band_edges = _validate_band_edges(bands) if bands else DEFAULT_SCORE_BANDS
     async with async_session_maker() as session:
         attempt_repo = AttemptRepository(session)
-        question_repo = QuestionRepository(session)
         test_repo = TestRepository(session)
         user_repo = UserRepository(session)
 
         test = await test_repo.get_test_by_id(test_id)
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
-        professor = await user_repo.get_user_by_email(professor_email)
-        if test.creator_id != professor.id:
+        if test.creator_id != principal.id:
             raise HTTPException(status_code=403, detail="Not the creator of this test")
 
-        enrolled_count = len(await user_repo.get_students_in_courses([test.course_id]))
-        attempts = await attempt_repo.get_attempts_for_test(test_id)
-        attempt_count = len(attempts)
-        graded = [a for a in attempts if a.status == AttemptStatus.GRADED]
-        graded_count = len(graded)
-        scores = [a.score for a in graded if a.score is not None]
-
+        # Everything comes from the rollups, so the cost doesn't grow with the number of attempts.
+        rollups = StatsRollupRepository(session)
+        enrolled_count = await user_repo.count_students_in_courses([test.course_id])
+        rollup = await rollups.get_test_rollup(test_id)
+        attempt_count = rollup.attempt_count if rollup else 0
+        graded_count = rollup.graded_count if rollup else 0
         participation_rate = round(attempt_count / enrolled_count * 100, 1) if enrolled_count else None
-        average_score = round(statistics.mean(scores), 1) if scores else None
-        median_score = round(statistics.median(scores), 1) if scores else None
-        min_score = min(scores) if scores else None
-        max_score = max(scores) if scores else None
 
-        # Fixed score bands: [0,50) / [50,70) / [70,100].
-        bands = [("0–50%", 0, 50), ("50–70%", 50, 70), ("70–100%", 70, 101)]
+        bins = await rollups.get_score_bins(test_id)
+        scored_count = sum(count for _, count in bins)
+        average_score = round(rollup.score_sum / scored_count, 1) if scored_count else None
+        median = _median_from_bins(bins, scored_count)
+        median_score = round(median, 1) if median is not None else None
+        min_score = bins[0][0] if bins else None
+        max_score = bins[-1][0] if bins else None
+
         distribution = [
-            ScoreBucketDTO(label=label, count=sum(1 for s in scores if low <= s < high))
-            for label, low, high in bands
+            ScoreBucketDTO(label=_band_label(band_edges, index), count=count)
+            for index, count in enumerate(_band_counts(bins, band_edges))
         ]
 
-        questions = await question_repo.get_questions_for_test(test_id)
-        answers = await attempt_repo.get_answers_for_test(test_id)
-        answers_by_question = {}
-        for answer in answers:
-            answers_by_question.setdefault(answer.question_id, []).append(answer)
-
-        question_stats = []
-        for question in questions:
-            q_answers = answers_by_question.get(question.id, [])
-            graded_answers = [a for a in q_answers if a.is_correct is not None]
-            answered_count = len(graded_answers)
-            correct_count = sum(1 for a in graded_answers if a.is_correct)
-            correct_rate = round(correct_count / answered_count * 100, 1) if answered_count else None
-            question_stats.append(QuestionStatDTO(
+        question_stats = [
+            QuestionStatDTO(
                 question_id=question.id,
                 text=question.text,
                 type=question.type,
                 answered_count=answered_count,
                 correct_count=correct_count,
-                correct_rate=correct_rate,
-            ))
+                correct_rate=round(correct_count / answered_count * 100, 1) if answered_count else None,
+            )
+            for question, answered_count, correct_count in await rollups.get_question_rollups(test_id)
+        ]
 
         return TestStatsDTO(
             test_id=test.id,
@@ -208,34 +348,64 @@ async def get_test_stats(test_id: int, professor_email: str) -> TestStatsDTO:
             questions=question_stats,
         )
 
-async def override_grade(answer_id: int, professor_email: str, data: GradeOverrideDTO) -> AttemptDetailDTO:
+async def override_grade(answer_id: int, principal: Principal, data: GradeOverrideDTO) -> AttemptDetailDTO:
     async with async_session_maker() as session:
         attempt_repo = AttemptRepository(session)
         question_repo = QuestionRepository(session)
         test_repo = TestRepository(session)
-        user_repo = UserRepository(session)
 
         answer = await attempt_repo.get_answer_by_id(answer_id)
         if not answer:
             raise HTTPException(status_code=404, detail="Answer not found")
         attempt = await attempt_repo.get_attempt_by_id(answer.attempt_id)
         test = await test_repo.get_test_by_id(attempt.test_id)
-        professor = await user_repo.get_user_by_email(professor_email)
-        if test.creator_id != professor.id:
+        if test.creator_id != principal.id:
             raise HTTPException(status_code=403, detail="Not the creator of this test")
+        # The grading job rewrites every answer of an ungraded attempt, so an override now would be lost.
+        if attempt.status != AttemptStatus.GRADED:
+            raise HTTPException(status_code=409, detail="Attempt is still being graded")
 
-        answer.is_correct = data.is_correct
-        if data.feedback is not None:
-            answer.feedback = data.feedback
-        session.add(answer)
-        await session.commit()
-
-        answers = await attempt_repo.get_answers_for_attempt(attempt.id)
         questions = await question_repo.get_questions_for_test(attempt.test_id)
+        corrected = [(answer, attempt)]
+        if data.propagate:
+            # Every graded answer that normalizes to the same text gets the same correction, and the
+            # memo is updated so answers graded from now on get it too.
+            question = next(question for question in questions if question.id == answer.question_id)
+            key = _verdict_key(question, answer.answer)
+            await GradingVerdictRepository(session).override(question.id, key, data.is_correct, data.feedback)
+            corrected += [
+                (other, other_attempt)
+                for other, other_attempt in await attempt_repo.get_graded_answers_for_question(question.id)
+                if other.id != answer.id and _verdict_key(question, other.answer) == key
+            ]
+
+        answer_changes = []
+        for corrected_answer, _ in corrected:
+            answer_changes.append((corrected_answer.question_id, corrected_answer.is_correct, data.is_correct))
+            corrected_answer.is_correct = data.is_correct
+            corrected_answer.graded_by = GradedBy.OVERRIDE.value
+            if data.feedback is not None:
+                corrected_answer.feedback = data.feedback
+            session.add(corrected_answer)
+
+        # Rescore every affected attempt; the answers loaded here are the same objects updated above.
+        affected = {corrected_attempt.id: corrected_attempt for _, corrected_attempt in corrected}
+        correct_counts = dict.fromkeys(affected, 0)
+        for graded_answer in await attempt_repo.get_answers_for_attempts(list(affected)):
+            if graded_answer.is_correct:
+                correct_counts[graded_answer.attempt_id] += 1
         total = len(questions)
-        correct = sum(1 for graded_answer in answers if graded_answer.is_correct)
-        attempt.score = round(correct / total * 100, 1) if total else 0.0
-        session.add(attempt)
+        old_scores = {attempt_id: affected_attempt.score for attempt_id, affected_attempt in affected.items()}
+        for attempt_id, affected_attempt in affected.items():
+            affected_attempt.score = round(correct_counts[attempt_id] / total * 100, 1) if total else 0.0
+            session.add(affected_attempt)
+
+        # The overrides, the new scores and the rollup deltas land in one commit.
+        rollups = StatsRollupRepository(session)
+        for attempt_id, affected_attempt in affected.items():
+            await rollups.apply_attempt_change(attempt.test_id, affected_attempt.status, old_scores[attempt_id], affected_attempt.status, affected_attempt.score)
+        await rollups.apply_answer_changes(attempt.test_id, answer_changes)
         await session.commit()
 
+        answers = await attempt_repo.get_answers_for_attempt(attempt.id)
         return _to_attempt_detail_dto(attempt, answers, questions)
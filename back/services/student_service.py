@@ -1,22 +1,11 @@
-import os
-from typing import List, Set
-from dotenv import load_dotenv
+from typing import List, Optional, Set, Tuple
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
 
-from dtos.user_dtos import StudentCreateDTO, StudentRegisterResultDTO, StudentSummaryDTO
+from dtos.user_dtos import Principal, StudentCreateDTO, StudentRegisterResultDTO, StudentSummaryDTO
 from model.user import UserRole, User
 from repositories import UserRepository
-
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+from model.database import async_session_maker
+from pagination import decode_cursor, encode_cursor, is_int
 
 async def _student_summary(user_repo: UserRepository, student: User, owned_ids: Set[int]) -> StudentSummaryDTO:
     student_courses = await user_repo.get_all_courses_user_takes(student.id)
@@ -29,12 +18,11 @@ async def _student_summary(user_repo: UserRepository, student: User, owned_ids:
         courses=course_names,
     )
 
-async def create_student(professor_email: str, data: StudentCreateDTO) -> StudentRegisterResultDTO:
+async def create_student(principal: Principal, data: StudentCreateDTO) -> StudentRegisterResultDTO:
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
 
-        professor = await user_repo.get_user_by_email(professor_email)
-        owned_courses = await user_repo.get_all_courses_user_takes(professor.id)
+        owned_courses = await user_repo.get_all_courses_user_takes(principal.id)
         owned_ids = {course.id for course in owned_courses}
         courses_by_id = {course.id: course.name for course in owned_courses}
 
@@ -70,12 +58,25 @@ async def create_student(professor_email: str, data: StudentCreateDTO) -> Studen
             already_enrolled=already_enrolled,
         )
 
-async def list_students(professor_email: str) -> List[StudentSummaryDTO]:
+async def list_students(principal: Principal, prefix: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None) -> Tuple[List[StudentSummaryDTO], Optional[str]]:
+    """Returns one page of the professor's roster and the cursor for the next page (None on the last)."""
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
 
-        professor = await user_repo.get_user_by_email(professor_email)
-        owned_ids = {course.id for course in await user_repo.get_all_courses_user_takes(professor.id)}
+        owned_ids = [course.id for course in await user_repo.get_all_courses_user_takes(principal.id)]
+
+        after = decode_cursor(cursor, shape=[is_int]) if cursor else None
+        # One extra row tells us whether another page follows.
+        rows = await user_repo.get_student_roster(
+            owned_ids, prefix=prefix, after_id=after[0] if after else None, limit=limit + 1 if limit else None
+        )
+        next_cursor = None
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][0].id])
 
-        students = await user_repo.get_students_in_courses(list(owned_ids))
-        return [await _student_summary(user_repo, student, owned_ids) for student in students]
+        students = [
+            StudentSummaryDTO(id=student.id, name=student.name, lastname=student.lastname, email=student.email, courses=course_names)
+            for student, course_names in rows
+        ]
+        return students, next_cursor
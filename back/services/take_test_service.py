@@ -1,9 +1,6 @@
-import os
 from typing import List
-from dotenv import load_dotenv
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
 
 from dtos.attempt_dtos import (
     AttemptResultDTO,
@@ -12,56 +9,43 @@ from dtos.attempt_dtos import (
     SubmitTestDTO,
     TestListItemDTO,
 )
-from repositories import AttemptRepository, CourseRepository, QuestionRepository, TestRepository, UserRepository
+from dtos.user_dtos import Principal
+from job_queue import enqueue_grading
+from repositories import AttemptRepository, CourseRepository, JobRepository, QuestionRepository, StatsRollupRepository, TestRepository, UserRepository
+from model.database import async_session_maker
 
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
-
-async def get_course_tests_for_student(course_id: int, student_email: str) -> List[TestListItemDTO]:
+async def get_course_tests_for_student(course_id: int, principal: Principal) -> List[TestListItemDTO]:
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
-        course_repo = CourseRepository(session)
-        question_repo = QuestionRepository(session)
-        attempt_repo = AttemptRepository(session)
+        test_repo = TestRepository(session)
 
-        student = await user_repo.get_user_by_email(student_email)
-        if not await user_repo.is_enrolled(student.id, course_id):
+        if not await user_repo.is_enrolled(principal.id, course_id):
             raise HTTPException(status_code=403, detail="Not enrolled in this course")
 
-        tests = await course_repo.get_all_tests_for_course(course_id)
-
-        items = []
-        for test in tests:
-            questions = await question_repo.get_questions_for_test(test.id)
-            attempt = await attempt_repo.get_attempt_for_student_and_test(student.id, test.id)
-            items.append(TestListItemDTO(
+        rows = await test_repo.get_course_test_summaries(course_id, student_id=principal.id)
+        return [
+            TestListItemDTO(
                 test_id=test.id,
                 title=test.title,
-                num_questions=len(questions),
+                num_questions=num_questions,
                 taken=attempt is not None,
                 attempt_id=attempt.id if attempt else None,
                 status=attempt.status if attempt else None,
                 score=attempt.score if attempt else None,
-            ))
-        return items
+            )
+            for test, num_questions, _, attempt in rows
+        ]
 
-async def get_test_for_student(test_id: int, student_email: str) -> StudentTestDTO:
+async def get_test_for_student(test_id: int, principal: Principal) -> StudentTestDTO:
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
         test_repo = TestRepository(session)
         question_repo = QuestionRepository(session)
 
-        student = await user_repo.get_user_by_email(student_email)
         test = await test_repo.get_test_by_id(test_id)
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
-        if not await user_repo.is_enrolled(student.id, test.course_id):
+        if not await user_repo.is_enrolled(principal.id, test.course_id):
             raise HTTPException(status_code=403, detail="Not enrolled in this course")
 
         questions = await question_repo.get_questions_for_test(test_id)
@@ -74,20 +58,19 @@ async def get_test_for_student(test_id: int, student_email: str) -> StudentTestD
             ],
         )
 
-async def submit_test(test_id: int, student_email: str, submission: SubmitTestDTO) -> AttemptResultDTO:
+async def submit_test(test_id: int, principal: Principal, submission: SubmitTestDTO) -> AttemptResultDTO:
     async with async_session_maker() as session:
         user_repo = UserRepository(session)
         test_repo = TestRepository(session)
         question_repo = QuestionRepository(session)
         attempt_repo = AttemptRepository(session)
 
-        student = await user_repo.get_user_by_email(student_email)
         test = await test_repo.get_test_by_id(test_id)
         if not test:
             raise HTTPException(status_code=404, detail="Test not found")
-        if not await user_repo.is_enrolled(student.id, test.course_id):
+        if not await user_repo.is_enrolled(principal.id, test.course_id):
             raise HTTPException(status_code=403, detail="Not enrolled in this course")
-        if await attempt_repo.get_attempt_for_student_and_test(student.id, test_id):
+        if await attempt_repo.get_attempt_for_student_and_test(principal.id, test_id):
             raise HTTPException(status_code=400, detail="Test already taken")
 
         question_ids = {q.id for q in await question_repo.get_questions_for_test(test_id)}
@@ -95,7 +78,17 @@ async def submit_test(test_id: int, student_email: str, submission: SubmitTestDT
         if foreign_ids:
             raise HTTPException(status_code=400, detail=f"Answers for questions not in this test: {foreign_ids}")
 
-        attempt = await attempt_repo.create_attempt(test_id, student.id)
-        await attempt_repo.add_answers(attempt.id, submission.answers)
+        # The attempt, its answers, the rollup's attempt count and the grading job are committed together,
+        # so a submitted attempt can't end up without a job to grade it.
+        try:
+            attempt = await attempt_repo.create_attempt(test_id, principal.id, commit=False)
+            await attempt_repo.add_answers(attempt.id, submission.answers, commit=False)
+            await StatsRollupRepository(session).record_attempt_submitted(test_id)
+            await enqueue_grading(JobRepository(session), attempt.id, commit=False)
+            await session.commit()
+        except IntegrityError:
+            # A concurrent submission won the (student_id, test_id) unique constraint.
+            await session.rollback()
+            raise HTTPException(status_code=400, detail="Test already taken")
 
         return AttemptResultDTO(attempt_id=attempt.id, test_id=test_id, submitted=True)
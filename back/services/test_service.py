@@ -1,25 +1,15 @@
-import os
 import random
 from typing import List, Optional
-from dotenv import load_dotenv
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
 
 from dtos.keyword_dtos import KeywordNodeDTO
+from dtos.user_dtos import Principal
 from dtos.test_dtos import ProfessorTestDetailDTO, ProfessorTestListItemDTO, QuestionResponseDTO, TestCreateDTO, TestResponseDTO
+from hierarchy_cache import subtree_nodes
 from model.question import Question, QuestionType
 from query_llm import generate_distractor_topics
-from repositories import AttemptRepository, CourseRepository, KeywordRepository, QuestionRepository, TestRepository, UserRepository
-
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+from repositories import AttemptRepository, CourseRepository, KeywordRepository, QuestionRepository, TestRepository
+from model.database import async_session_maker
 
 def _build_matching_choices(correct_topic: str, distractor_topics: List[str], num_distractors: int, exclude: Optional[str] = None) -> List[str]:
     # `exclude` is the keyword being asked about — it must never appear as an option, even though
@@ -39,11 +29,10 @@ def _to_question_dto(question: Question) -> QuestionResponseDTO:
         correct_answer=question.correct_answer,
     )
 
-async def create_test(course_id: int, creator_email: str, test_data: TestCreateDTO) -> TestResponseDTO:
+async def create_test(course_id: int, principal: Principal, test_data: TestCreateDTO) -> TestResponseDTO:
     async with async_session_maker() as session:
         course_repo = CourseRepository(session)
         keyword_repo = KeywordRepository(session)
-        user_repo = UserRepository(session)
         test_repo = TestRepository(session)
         question_repo = QuestionRepository(session)
 
@@ -53,23 +42,21 @@ async def create_test(course_id: int, creator_email: str, test_data: TestCreateD
         if not course.keyword_hierarchy_id:
             raise HTTPException(status_code=400, detail="Course has no keyword index yet; upload materials first")
 
-        hierarchy = await keyword_repo.get_hierarchy_by_id(course.keyword_hierarchy_id)
-        root = await keyword_repo.get_keyword_by_id(hierarchy.root_id)
+        # The whole tree comes from the hierarchy cache; it's the root followed by its descendants.
+        nodes = await keyword_repo.get_hierarchy_nodes(course.keyword_hierarchy_id)
+        if not nodes:
+            raise HTTPException(status_code=400, detail="Course has no keyword index yet; upload materials first")
+        root = nodes[0]
+        nodes_by_id = {node.id: node for node in nodes}
 
         # Resolve the scope root: an optional keyword the professor picked to test only its subtree,
         # defaulting to the hierarchy root (the whole course). Validate the id against the hierarchy's
         # real membership before trusting it, so a client can't scope a test to another course's tree.
-        full_pool = await keyword_repo.get_all_descendant_keywords(hierarchy.root_id)
-        valid_ids = {root.id} | {keyword.id for keyword in full_pool}
-        if test_data.root_keyword_id is not None and test_data.root_keyword_id not in valid_ids:
+        if test_data.root_keyword_id is not None and test_data.root_keyword_id not in nodes_by_id:
             raise HTTPException(status_code=400, detail="Selected keyword is not part of this course's hierarchy")
 
-        if test_data.root_keyword_id is None or test_data.root_keyword_id == root.id:
-            scope_root = root
-            keyword_pool = full_pool
-        else:
-            scope_root = await keyword_repo.get_keyword_by_id(test_data.root_keyword_id)
-            keyword_pool = await keyword_repo.get_all_descendant_keywords(scope_root.id)
+        scope_root = nodes_by_id[test_data.root_keyword_id] if test_data.root_keyword_id is not None else root
+        keyword_pool = subtree_nodes(nodes, scope_root.id)
         if not keyword_pool:
             raise HTTPException(status_code=400, detail="Selected topic has no sub-keywords to build a test from")
 
@@ -83,10 +70,6 @@ async def create_test(course_id: int, creator_email: str, test_data: TestCreateD
             if keyword.parent_id != scope_root.id
         })
 
-        creator = await user_repo.get_user_by_email(creator_email)
-
-        test = await test_repo.create_test(title=test_data.title, creator_id=creator.id, course_id=course_id)
-
         matching_keywords = random.sample(keyword_pool, min(test_data.num_matching_questions, len(keyword_pool)))
         open_keywords = random.sample(keyword_pool, min(test_data.num_open_questions, len(keyword_pool)))
 
@@ -97,53 +80,47 @@ async def create_test(course_id: int, creator_email: str, test_data: TestCreateD
             shortfall = num_distractors - (len(distractor_topics) - 1)
             if shortfall > 0:
                 try:
-                    generated = generate_distractor_topics(course.name, distractor_topics + [scope_root.name], shortfall)
+                    generated = await generate_distractor_topics(course.name, distractor_topics + [scope_root.name], shortfall)
                 except Exception:
                     generated = []
                 distractor_topics = list(dict.fromkeys(distractor_topics + generated))
 
-        questions: List[QuestionResponseDTO] = []
-
+        question_rows = []
         for keyword in matching_keywords:
             correct_topic = keywords_by_id[keyword.parent_id].name
-            choices = _build_matching_choices(correct_topic, distractor_topics, num_distractors, exclude=keyword.name)
-            question = await question_repo.create_question(
+            question_rows.append(dict(
                 text=f"Which topic does '{keyword.name}' belong to?",
                 correct_answer=correct_topic,
-                choices=choices,
-                test_id=test.id,
+                choices=_build_matching_choices(correct_topic, distractor_topics, num_distractors, exclude=keyword.name),
                 type=QuestionType.MATCHING,
-            )
-            questions.append(_to_question_dto(question))
-
+            ))
         for keyword in open_keywords:
-            question = await question_repo.create_question(
+            question_rows.append(dict(
                 text=f"What is {keyword.name}?",
                 correct_answer=keyword.definition,
                 choices=[],
-                test_id=test.id,
                 type=QuestionType.OPEN,
-            )
-            questions.append(_to_question_dto(question))
+            ))
 
-        used_keywords = {keyword.id: keyword for keyword in matching_keywords + open_keywords}
-        await test_repo.add_keywords_to_test(test.id, list(used_keywords.values()))
+        # Everything is generated up front, so the test, its questions and its keyword links are
+        # written with multi-row INSERTs in a single transaction.
+        test = await test_repo.create_test(title=test_data.title, creator_id=principal.id, course_id=course_id, commit=False)
+        created = await question_repo.create_questions(test.id, question_rows, commit=False)
+        await test_repo.link_keywords_to_test(test.id, [keyword.id for keyword in matching_keywords + open_keywords])
+        await session.commit()
 
+        questions = [_to_question_dto(question) for question in created]
         return TestResponseDTO(id=test.id, title=test.title, course_id=test.course_id, questions=questions)
 
 async def get_course_tests_for_professor(course_id: int) -> List[ProfessorTestListItemDTO]:
     async with async_session_maker() as session:
-        course_repo = CourseRepository(session)
-        question_repo = QuestionRepository(session)
-        attempt_repo = AttemptRepository(session)
+        test_repo = TestRepository(session)
 
-        tests = await course_repo.get_all_tests_for_course(course_id)
-        items: List[ProfessorTestListItemDTO] = []
-        for test in tests:
-            questions = await question_repo.get_questions_for_test(test.id)
-            attempts = await attempt_repo.get_attempts_for_test(test.id)
-            items.append(ProfessorTestListItemDTO(test_id=test.id, title=test.title, num_questions=len(questions), attempt_count=len(attempts)))
-        return items
+        rows = await test_repo.get_course_test_summaries(course_id)
+        return [
+            ProfessorTestListItemDTO(test_id=test.id, title=test.title, num_questions=num_questions, attempt_count=attempt_count)
+            for test, num_questions, attempt_count, _ in rows
+        ]
 
 async def get_test_detail_for_professor(test_id: int) -> ProfessorTestDetailDTO:
     async with async_session_maker() as session:
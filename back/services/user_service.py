@@ -2,19 +2,7 @@ from fastapi import HTTPException
 from dtos.user_dtos import UserLogin, UserRegistration
 from model.user import User, UserRole
 from repositories import UserRepository
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_async_engine(DATABASE_URL, echo=True)
-
-async_session_maker = sessionmaker(
-    bind=engine, expire_on_commit=False, class_=AsyncSession
-)
+from model.database import async_session_maker
 
 async def create_user(user: UserRegistration) -> User:
     async with async_session_maker() as session:
@@ -0,0 +1,14 @@
+import re
+from typing import List
+
+# Shared by pregrader.py (answer/definition similarity) and parse_materials.py (ranking keywords
+# against a material chunk); kept free of heavy imports so either can load it cheaply.
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be been by for from has have in into is it its of on or that the their them "
+    "they this to was were which with what when where who why how does do can".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word terms of `text`, without stopwords."""
+    return [word for word in _WORD.findall(text.casefold()) if word not in _STOPWORDS]
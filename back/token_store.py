@@ -0,0 +1,143 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from model.database import async_session_maker
+from repositories import SessionTokenRepository
+
+load_dotenv()
+
+# Where active login tokens live: "memory" (single worker only), "postgres" or "redis".
+TOKEN_STORE = os.getenv("TOKEN_STORE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# How long a worker trusts a token it has already seen without asking the store again. A logout on
+# another worker takes up to this long to reach this one; 0 disables the local cache.
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "5"))
+
+class TokenStore(ABC):
+    """The active token per subject (user email); a new login replaces the previous token.
+
+    Entries expire at the token's own JWT `exp`, so the store never outlives the token.
+    """
+
+    @abstractmethod
+    async def set(self, subject: str, token: str, expires_at: float) -> None: ...
+
+    @abstractmethod
+    async def get(self, subject: str) -> Optional[str]: ...
+
+    @abstractmethod
+    async def delete(self, subject: str) -> None: ...
+
+class MemoryTokenStore(TokenStore):
+    def __init__(self):
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+
+    async def set(self, subject: str, token: str, expires_at: float) -> None:
+        self._tokens[subject] = (token, expires_at)
+
+    async def get(self, subject: str) -> Optional[str]:
+        entry = self._tokens.get(subject)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self._tokens.pop(subject, None)
+            return None
+        return entry[0]
+
+    async def delete(self, subject: str) -> None:
+        self._tokens.pop(subject, None)
+
+class PostgresTokenStore(TokenStore):
+    async def set(self, subject: str, token: str, expires_at: float) -> None:
+        async with async_session_maker() as session:
+            await SessionTokenRepository(session).set_token(subject, token, datetime.fromtimestamp(expires_at, tz=timezone.utc))
+
+    async def get(self, subject: str) -> Optional[str]:
+        async with async_session_maker() as session:
+            return await SessionTokenRepository(session).get_token(subject)
+
+    async def delete(self, subject: str) -> None:
+        async with async_session_maker() as session:
+            await SessionTokenRepository(session).delete_token(subject)
+
+class RedisTokenStore(TokenStore):
+    """Works against anything speaking the Redis protocol (Redis, Valkey, KeyDB, ...)."""
+
+    KEY_PREFIX = "testly:token:"
+
+    def __init__(self, url: str):
+        try:
+            from redis import asyncio as redis
+        except ImportError:
+            raise RuntimeError("TOKEN_STORE=redis needs the 'redis' package: pip install redis")
+        self._client = redis.from_url(url, decode_responses=True)
+
+    async def set(self, subject: str, token: str, expires_at: float) -> None:
+        ttl = max(1, int(expires_at - time.time()))
+        await self._client.set(self.KEY_PREFIX + subject, token, ex=ttl)
+
+    async def get(self, subject: str) -> Optional[str]:
+        return await self._client.get(self.KEY_PREFIX + subject)
+
+    async def delete(self, subject: str) -> None:
+        await self._client.delete(self.KEY_PREFIX + subject)
+
+class CachedTokenStore:
+    """Read-through cache in front of a shared TokenStore.
+
+    Only tokens the store confirmed are cached, so a token issued by another worker is never
+    rejected because of a stale entry: a mismatch always goes back to the store.
+    """
+
+    def __init__(self, backend: TokenStore, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self._cache: Dict[str, Tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def is_active(self, subject: str, token: str) -> bool:
+        entry = self._cache.get(subject)
+        if entry is not None and entry[0] == token and entry[1] > time.monotonic():
+            self.hits += 1
+            return True
+        self.misses += 1
+        stored = await self.backend.get(subject)
+        if stored is None:
+            self._cache.pop(subject, None)
+            return False
+        if self.ttl > 0:
+            self._cache[subject] = (stored, time.monotonic() + self.ttl)
+        return stored == token
+
+    async def set(self, subject: str, token: str, expires_at: float) -> None:
+        await self.backend.set(subject, token, expires_at)
+        self._cache.pop(subject, None)
+
+    async def delete(self, subject: str) -> None:
+        await self.backend.delete(subject)
+        self._cache.pop(subject, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "cached_subjects": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+def _create_backend(kind: str) -> TokenStore:
+    if kind == "memory":
+        return MemoryTokenStore()
+    if kind == "postgres":
+        return PostgresTokenStore()
+    if kind == "redis":
+        return RedisTokenStore(REDIS_URL)
+    raise ValueError(f"Unknown TOKEN_STORE {kind!r}; expected memory, postgres or redis")
+
+token_store = CachedTokenStore(_create_backend(TOKEN_STORE), TOKEN_CACHE_TTL)
@@ -0,0 +1,143 @@
+"""Runs queued background jobs (grading submitted attempts, deleting courses) outside the API process.
+
+Jobs live in Postgres, so they survive restarts and any number of workers can drain the same queue.
+Each worker also runs a periodic recovery sweep that queues grading for attempts stuck in GRADING
+without a job. Run from back/, alongside the API:
+
+    python worker.py                    # WORKER_CONCURRENCY jobs at once
+    python worker.py --concurrency 8
+    python worker.py --requeue-failed   # give FAILED jobs a fresh set of attempts, then exit
+"""
+import argparse
+import asyncio
+import signal
+from typing import Awaitable, Callable, Dict, Set
+
+from job_queue import JOB_MAX_ATTEMPTS, JOB_POLL_INTERVAL, JOB_SWEEP_INTERVAL, JOB_VISIBILITY_TIMEOUT, WORKER_CONCURRENCY, retry_delay
+from model.database import async_session_maker
+from model.job import Job, JobKind
+from query_llm import llm
+from repositories import JobRepository
+from services.course_service import run_course_deletion
+from services.grading_service import grade_attempt
+
+async def _grade_attempt(job: Job) -> None:
+    await grade_attempt(job.payload["attempt_id"])
+
+HANDLERS: Dict[str, Callable[[Job], Awaitable[None]]] = {
+    JobKind.GRADE_ATTEMPT.value: _grade_attempt,
+    JobKind.DELETE_COURSE.value: run_course_deletion,
+}
+
+class Worker:
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        """Stops claiming new jobs; jobs already running are finished first."""
+        self._stopping.set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_sweep = loop.time()
+        while not self._stopping.is_set():
+            if loop.time() >= next_sweep:
+                await self._sweep()
+                next_sweep = loop.time() + JOB_SWEEP_INTERVAL
+
+            free = self.concurrency - len(self._running)
+            jobs = await self._claim(free) if free else []
+            for job in jobs:
+                task = asyncio.create_task(self._run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if not free:
+                await asyncio.wait(self._running, timeout=JOB_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            elif not jobs:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._running:
+            print(f"waiting for {len(self._running)} running job(s)", flush=True)
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _claim(self, limit: int) -> list:
+        try:
+            async with async_session_maker() as session:
+                return await JobRepository(session).claim(list(HANDLERS), limit, JOB_VISIBILITY_TIMEOUT)
+        except Exception as e:
+            print(f"claiming jobs failed: {e!r}", flush=True)
+            return []
+
+    async def _heartbeat(self, job: Job) -> None:
+        """Keeps extending the job's claim while it runs, so a slow job isn't handed to another worker."""
+        while True:
+            await asyncio.sleep(JOB_VISIBILITY_TIMEOUT / 3)
+            try:
+                async with async_session_maker() as session:
+                    if not await JobRepository(session).extend_claim(job.id, job.attempts, JOB_VISIBILITY_TIMEOUT):
+                        return
+            except Exception as e:
+                print(f"extending the claim on job {job.id} failed: {e!r}", flush=True)
+
+    async def _run_job(self, job: Job) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            await HANDLERS[job.kind](job)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            heartbeat.cancel()
+
+        async with async_session_maker() as session:
+            job_repo = JobRepository(session)
+            if error is None:
+                if not await job_repo.complete(job.id, job.attempts):
+                    # The claim was lost and another worker took the job over; its run will record the outcome.
+                    print(f"job {job.id} ({job.kind}) finished after losing its claim", flush=True)
+            elif job.attempts >= job.max_attempts:
+                await job_repo.fail(job.id, job.attempts, error)
+                print(f"job {job.id} ({job.kind}) failed for good after {job.attempts} attempt(s): {error}", flush=True)
+            else:
+                await job_repo.retry(job.id, job.attempts, error, retry_delay(job.attempts))
+
+    async def _sweep(self) -> None:
+        try:
+            async with async_session_maker() as session:
+                job_repo = JobRepository(session)
+                expired = await job_repo.fail_expired()
+                orphaned = await job_repo.enqueue_orphaned_gradings(JOB_MAX_ATTEMPTS)
+        except Exception as e:
+            print(f"recovery sweep failed: {e!r}", flush=True)
+            return
+        if expired or orphaned:
+            print(f"recovery sweep: {expired} expired job(s) failed, {orphaned} orphaned attempt(s) queued for grading", flush=True)
+
+async def requeue_failed() -> None:
+    async with async_session_maker() as session:
+        count = await JobRepository(session).requeue_failed(list(HANDLERS))
+    print(f"requeued {count} failed job(s)")
+
+async def run(concurrency: int) -> None:
+    worker = Worker(concurrency)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    print(f"worker started, running up to {concurrency} job(s) at once", flush=True)
+    try:
+        await worker.run()
+    finally:
+        await llm.aclose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--requeue-failed", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(requeue_failed() if args.requeue_failed else run(max(1, args.concurrency)))